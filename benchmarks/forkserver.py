@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# benchmarks/forkserver.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Timing spawning daemons cold, and through a fork server.
+
+    Run from the command line, with the `daemon` package importable
+    (such as from the top of the source tree with ``PYTHONPATH=.``),
+    printing the results as JSON::
+
+        python benchmarks/forkserver.py [-n COUNT] [--preload MODULE]...
+
+    See also ``benchmarks/startup.py``.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from daemon import create_daemon
+from daemon.forkserver import ForkServerClient, start_fork_server
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
+_cold_command = (
+    'from daemon import create_daemon; '
+    'create_daemon(lambda runner: 0, force_detach=True).start(wait_ready=True, ready_timeout=10)'
+)
+
+
+def _exit_at_once():
+    """ Spawn target for the benchmark, which exits as soon as it starts. """
+    return 0
+
+
+def _start_cold():
+    """ Start a daemon calling `_exit_at_once` the usual way. """
+    create_daemon(lambda runner: _exit_at_once(), force_detach=True).start(wait_ready=True, ready_timeout=10)
+
+
+def summarize(latencies):
+    """ Return the mean and worst of `latencies`, in milliseconds. """
+    return {
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 3),
+        'max_ms': round(1000 * max(latencies), 3),
+    }
+
+
+def benchmark(count=20, preload_modules=()):
+    """ Time spawning `count` daemons cold, then through a fork server.
+
+        There are two cold paths: ``create_daemon(run).start()`` from
+        this process, and the same from a new interpreter, which must
+        also start Python and import the application. Returns a dict of
+        the mean and worst latencies of each, in milliseconds.
+    """
+    cold = []
+    for _ in range(count):
+        started = _monotonic()
+        _start_cold()
+        cold.append(_monotonic() - started)
+
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    command = [sys.executable, '-c', _cold_command]
+    for name in preload_modules:
+        command[-1] = 'import {}; {}'.format(name, command[-1])
+    interpreter = []
+    for _ in range(count):
+        started = _monotonic()
+        subprocess.check_call(command, env=environ)
+        interpreter.append(_monotonic() - started)
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'forkserver.sock')
+    server_pid = start_fork_server(path, preload_modules, ready_timeout=10)
+    try:
+        client = ForkServerClient(path, timeout=10)
+        warm = []
+        for _ in range(count):
+            started = _monotonic()
+            # The fork server is forked from this script, as its `__main__`.
+            client.spawn('__main__:_exit_at_once')
+            warm.append(_monotonic() - started)
+    finally:
+        os.kill(server_pid, signal.SIGTERM)
+        time.sleep(0.1)
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+    return {
+        'count': count,
+        'cold': summarize(cold),
+        'cold_interpreter': summarize(interpreter),
+        'fork_server': summarize(warm),
+    }
+
+
+def main(argv=None):
+    """ Run the benchmark from the command line, printing its result as JSON. """
+    parser = argparse.ArgumentParser(prog='forkserver.py', description='Compare spawn latencies.')
+    parser.add_argument('-n', '--count', type=int, default=20, help='daemons to spawn each way')
+    parser.add_argument('--preload', action='append', default=[], metavar='MODULE',
+                        help='module to import before serving')
+    args = parser.parse_args(argv)
+
+    print(json.dumps(benchmark(args.count, args.preload), indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
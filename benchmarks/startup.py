@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+# benchmarks/startup.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Timing the steps of starting a daemon.
+
+    Run from the command line, with the `daemon` package importable
+    (such as from the top of the source tree with ``PYTHONPATH=.``),
+    printing the results as JSON::
+
+        python benchmarks/startup.py close-fds [-n COUNT] [--open-fds N] [--max-fds N]
+
+    compares the strategies of `close_all_open_files`. Each run
+    happens in a forked process, which opens the given number of
+    descriptors and then times closing them all.
+
+    ::
+
+        python benchmarks/startup.py preload [-n WORKERS] [--objects N] [--preload MODULE]...
+
+    compares the memory of workers forked from a process which has
+    built some state, with and without `prepare_for_fork` in between.
+    See also ``benchmarks/forkserver.py``.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import resource
+import sys
+import time
+
+from daemon.daemon import (
+    close_fds_strategies, get_close_fds_strategy, get_maximum_file_descriptors, prepare_for_fork,
+    read_memory_usage,
+)
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
+
+def summarize(latencies):
+    """ Return the mean and worst of `latencies`, in milliseconds. """
+    return {
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 3),
+        'max_ms': round(1000 * max(latencies), 3),
+    }
+
+
+def _call_in_child(measure):
+    """ Call `measure` in a forked process; return the result it reports.
+
+        `measure` receives the descriptor the result is reported on,
+        and returns a value which can be encoded as JSON. Returns
+        ``None`` if the child failed to report a result.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read_fd)
+            data = json.dumps(measure(write_fd)).encode('utf-8')
+            while data:
+                data = data[os.write(write_fd, data):]
+            status = 0
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    chunks = []
+    try:
+        while True:
+            chunk = os.read(read_fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+
+    try:
+        return json.loads(b''.join(chunks).decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def benchmark_close_fds(count=10, open_fds=1000, max_fds=None, strategies=None):
+    """ Time each strategy of `close_fds_strategies` closing every descriptor.
+
+        Each of `count` runs per strategy forks a process which opens
+        `open_fds` descriptors (spread over the range up to the limit,
+        as a long-running launcher's might be), then closes all but the
+        one reporting the result. `max_fds` lowers the limit on open
+        descriptors in the child, which bounds the ``'sweep'`` and
+        ``'closerange'`` strategies; by default the current hard limit
+        is used. Strategies the system does not support are reported
+        as ``None``.
+
+        Returns a dict of the mean and worst times of each strategy, in
+        milliseconds.
+    """
+    limit = get_maximum_file_descriptors()
+    max_fds = limit if max_fds is None else min(max_fds, limit)
+    if strategies is None:
+        strategies = sorted(close_fds_strategies)
+
+    # Look up `close_range` once here, so that importing `ctypes` in
+    # each child is not counted against that strategy.
+    get_close_fds_strategy()
+
+    def measure(strategy, report_fd):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max_fds, max_fds))
+
+        base = os.open(os.devnull, os.O_RDONLY)
+        step = max(1, (max_fds - base - 2) // max(open_fds, 1))
+        for index in range(open_fds - 1):
+            target = base + 1 + index * step
+            if target >= max_fds:
+                break
+            if target != report_fd:
+                os.dup2(base, target)
+
+        started = _monotonic()
+        close_fds_strategies[strategy](set([report_fd]), max_fds)
+        return _monotonic() - started
+
+    results = {}
+    for strategy in strategies:
+        times = []
+        for _ in range(count):
+            elapsed = _call_in_child(lambda report_fd: measure(strategy, report_fd))
+            if elapsed is None:
+                times = None
+                break
+            times.append(elapsed)
+        results[strategy] = summarize(times) if times else None
+
+    return {
+        'count': count,
+        'open_fds': open_fds,
+        'max_fds': max_fds,
+        'strategies': results,
+    }
+
+
+def benchmark_preload(workers=4, objects=200000, preload_modules=()):
+    """ Compare the memory of forked workers with and without `prepare_for_fork`.
+
+        For each way, a master process is forked which imports
+        `preload_modules` and builds `objects` small containers, as an
+        application's state might be; with ``'frozen'``, it then calls
+        `prepare_for_fork`, as `DaemonContext` does after preloading.
+        It forks `workers` workers in turn, each of which runs a
+        garbage collection and then reads its memory usage (see
+        `read_memory_usage`). Without `gc.freeze` (before Python 3.7),
+        both ways are the same.
+
+        Returns a dict, for ``'plain'`` and ``'frozen'``, of the mean
+        resident, shared and private memory of a worker in bytes, and
+        the time taken to prepare the master in milliseconds.
+    """
+    def run_master(frozen):
+        for name in preload_modules:
+            importlib.import_module(name)
+        state = [{'index': index, 'name': str(index)} for index in range(objects)]
+
+        started = _monotonic()
+        if frozen:
+            prepare_for_fork()
+        prepare_ms = round(1000 * (_monotonic() - started), 3)
+
+        def run_worker(report_fd):
+            gc.collect()
+            return read_memory_usage()
+
+        usages = [_call_in_child(run_worker) for _ in range(workers)]
+        usages = [usage for usage in usages if usage]
+        del state
+
+        result = {'prepare_ms': prepare_ms}
+        for kind in ['rss', 'shared', 'private']:
+            sizes = [usage[kind] for usage in usages if kind in usage]
+            result[kind] = sum(sizes) // len(sizes) if sizes else None
+        return result
+
+    return {
+        'workers': workers,
+        'objects': objects,
+        'preload_modules': list(preload_modules),
+        'plain': _call_in_child(lambda report_fd: run_master(False)),
+        'frozen': _call_in_child(lambda report_fd: run_master(True)),
+    }
+
+
+def main(argv=None):
+    """ Run a benchmark from the command line, printing its result as JSON. """
+    parser = argparse.ArgumentParser(prog='startup.py', description='Time the steps of starting a daemon.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    close_parser = subparsers.add_parser('close-fds', help='compare the strategies for closing descriptors')
+    close_parser.add_argument('-n', '--count', type=int, default=10, help='runs of each strategy')
+    close_parser.add_argument('--open-fds', type=int, default=1000, help='descriptors open before closing')
+    close_parser.add_argument('--max-fds', type=int, default=None, help='limit on open descriptors')
+    close_parser.add_argument('--strategy', action='append', default=None, choices=sorted(close_fds_strategies),
+                              help='strategy to time (default: all)')
+    preload_parser = subparsers.add_parser('preload', help='compare the memory of workers with and without freezing')
+    preload_parser.add_argument('-n', '--workers', type=int, default=4, help='workers to fork')
+    preload_parser.add_argument('--objects', type=int, default=200000, help='objects built before forking')
+    preload_parser.add_argument('--preload', action='append', default=[], metavar='MODULE',
+                                help='module to import before forking')
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'close-fds':
+        result = benchmark_close_fds(args.count, args.open_fds, args.max_fds, args.strategy)
+    elif args.benchmark == 'preload':
+        result = benchmark_preload(args.workers, args.objects, args.preload)
+    else:
+        parser.error('a benchmark is required')
+
+    print(json.dumps(result, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
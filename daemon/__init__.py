@@ -51,7 +51,8 @@ from __future__ import unicode_literals, print_function, absolute_import
 
 from types import MethodType
 
-from .daemon import DaemonContext
+from .daemon import DaemonContext, StartupTimings
+from .streams import BufferedStreamSink
 
 
 def create_daemon(run, *args, **kwargs):
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# daemon/__main__.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Controlling many daemons from the command line.
+
+    Run as ``python -m daemon``; the classes used are those of
+    `daemon.runner`, imported once as part of the package.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import argparse
+import json
+import os
+import sys
+
+from . import create_daemon
+from .runner import DaemonFleet, DaemonRunner, import_callable
+
+
+def main(argv=None):
+    """ Control many daemons from the command line.
+
+        Usage: ``python -m daemon ACTION SPEC...``, where each
+        SPEC is ``PIDFILE[=MODULE:CALLABLE]``. The callable, required
+        to start a daemon, is run as the daemon's `run` method. Prints
+        the `DaemonFleet` report as JSON; exits with status 1 if any
+        daemon failed.
+    """
+    parser = argparse.ArgumentParser(prog='python -m daemon', description='Control many daemons at once.')
+    parser.add_argument('action', choices=['start', 'stop', 'restart', 'status'])
+    parser.add_argument('specs', nargs='+', metavar='PIDFILE[=MODULE:CALLABLE]')
+    parser.add_argument('-j', '--parallel', type=int, default=16, help='maximum concurrent operations')
+    parser.add_argument('-t', '--timeout', type=float, help='seconds to wait for each daemon')
+    parser.add_argument('--backend', default='link', help='PID file backend (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    runners = {}
+    for spec in args.specs:
+        path, _, reference = spec.partition('=')
+        path = os.path.abspath(path)
+        if reference:
+            runner = create_daemon(import_callable(reference), pidfile=path, pidfile_backend=args.backend,
+                                   force_detach=True)
+        elif args.action in ('start', 'restart'):
+            parser.error('{} needs MODULE:CALLABLE to start'.format(spec))
+        else:
+            runner = DaemonRunner(pidfile=path, pidfile_backend=args.backend, force_detach=True)
+        runners[path] = runner
+
+    fleet = DaemonFleet(runners, args.parallel)
+    if args.action == 'status':
+        report = fleet.status()
+    elif args.action == 'start':
+        report = fleet.start(args.timeout)
+    elif args.action == 'stop':
+        report = fleet.stop(timeout=args.timeout)
+    else:
+        report = fleet.restart(args.timeout, args.timeout)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# daemon/aio.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Controlling daemons from an `asyncio` event loop.
+
+    The coroutines here are reached through `DaemonRunner.astart`,
+    `DaemonRunner.astop` and `DaemonRunner.astatus`. None of them
+    blocks the event loop while waiting: readiness is read from the
+    readiness pipe, and process exit from a process file descriptor,
+    both registered with the loop's reader callbacks.
+
+    This module requires Python 3.5 or later.
+"""
+
+import asyncio
+import os
+import signal
+
+from .daemon import DaemonReadinessError, is_process_running, open_process_fd, _monotonic
+from .runner import (
+    DaemonHandle, DaemonRunnerResultTimeoutError, DaemonRunnerStartFailureError, DaemonRunnerStartTimeoutError,
+    DaemonRunnerStopFailureError, stop_waits,
+)
+
+
+def _get_loop():
+    get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+    return get_running_loop()
+
+
+async def _wait_readable(fd, timeout=None):
+    """ Wait until `fd` is readable; return ``False`` on timeout. """
+    loop = _get_loop()
+    readable = loop.create_future()
+
+    def on_readable():
+        if not readable.done():
+            readable.set_result(True)
+
+    loop.add_reader(fd, on_readable)
+    try:
+        await asyncio.wait_for(readable, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+
+    return True
+
+
+async def wait_for_process_exit(pid, timeout=None):
+    """ Wait for the process `pid` to exit, without blocking the loop.
+
+        As for `daemon.daemon.wait_for_process_exit`: returns ``True``
+        once the process has exited, or ``False`` if it is still
+        running after `timeout` seconds.
+    """
+    try:
+        pidfd = open_process_fd(pid)
+    except OSError:
+        return True
+
+    if pidfd is not None:
+        try:
+            return await _wait_readable(pidfd, timeout)
+        finally:
+            os.close(pidfd)
+
+    deadline = None if timeout is None else _monotonic() + timeout
+    delay = 0.001
+    while is_process_running(pid):
+        if deadline is not None:
+            remaining = deadline - _monotonic()
+            if remaining <= 0:
+                return False
+            delay = min(delay, remaining)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.1)
+
+    return True
+
+
+async def wait_until_ready(readiness, timeout=None, keep_open=False):
+    """ Wait for a daemon started by `DaemonRunner.spawn` to be ready.
+
+        Returns the PID of the daemon; raises as for
+        `DaemonRunner.start`. See `ReadinessPipe.wait` for `keep_open`.
+    """
+    readiness.close_write_end()
+    deadline = None if timeout is None else _monotonic() + timeout
+
+    message = readiness.feed(b'')
+    try:
+        while message is None:
+            remaining = None if deadline is None else max(0, deadline - _monotonic())
+            if not await _wait_readable(readiness.read_fd, remaining):
+                raise DaemonRunnerStartTimeoutError('Daemon process not ready after {} seconds'.format(timeout))
+
+            chunk = os.read(readiness.read_fd, 65536)
+            if not chunk:
+                break
+            message = readiness.feed(chunk)
+    except BaseException:
+        # Including cancellation of the waiting task.
+        readiness.close()
+        raise
+
+    try:
+        return readiness.ready_pid(message, keep_open)
+    except DaemonReadinessError as exc:
+        raise DaemonRunnerStartFailureError('{!s}'.format(exc))
+
+
+class AsyncDaemonHandle(DaemonHandle):
+    """ Handle on a daemon process, for use in an event loop.
+
+        As for `DaemonHandle`, but `wait` and `result` are coroutines,
+        reading the reports of the daemon process from the loop's
+        reader callbacks.
+    """
+
+    async def wait(self, timeout=None):
+        """ Wait for the daemon process to exit.
+
+            Returns ``True`` once it has exited, or ``False`` if it is
+            still running after `timeout` seconds.
+        """
+        deadline = None if timeout is None else _monotonic() + timeout
+        while not self._reported:
+            if self._receive(0):
+                continue
+            remaining = None if deadline is None else max(0, deadline - _monotonic())
+            if not await _wait_readable(self.readiness.read_fd, remaining):
+                return False
+
+        if self._pid is None:
+            return True
+
+        remaining = None if deadline is None else max(0, deadline - _monotonic())
+        return await wait_for_process_exit(self._pid, remaining)
+
+    async def result(self, timeout=None):
+        """ Wait for the daemon process to exit, and return its result.
+
+            Raises as for `DaemonHandle.result`.
+        """
+        if not await self.wait(timeout):
+            raise DaemonRunnerResultTimeoutError('Daemon process still running after {} seconds'.format(timeout))
+
+        return self._reported_result()
+
+
+async def start(runner, delay_after_fork=None, ready_timeout=None):
+    """ Start the daemon of `runner`, and wait for it to be ready.
+
+        The fork itself happens in the calling thread, and takes as
+        long as the first child takes to fork again and exit. Returns
+        an `AsyncDaemonHandle`.
+    """
+    readiness = runner.spawn(delay_after_fork, wait_ready=True)
+    pid = await wait_until_ready(readiness, ready_timeout, keep_open=True)
+    return AsyncDaemonHandle(readiness, pid)
+
+
+async def stop(runner, sig=None, timeout=None, escalate_to=signal.SIGKILL):
+    """ Stop the daemon of `runner`, and wait for it to exit.
+
+        Arguments are as for `DaemonRunner.stop` with `wait` true.
+        Returns the number of seconds the daemon took to exit, or
+        ``None`` if there was no daemon process to stop.
+    """
+    if not runner.pidfile:
+        raise DaemonRunnerStopFailureError('Cannot stop daemon with no PID file')
+    if not runner.alive:
+        return None
+
+    pid = runner.pid
+    # Asking the control server to stop the daemon waits for its answer.
+    await _get_loop().run_in_executor(None, runner.stop, sig)
+
+    started = _monotonic()
+    elapsed = None
+    steps = stop_waits(runner, pid, timeout, escalate_to)
+    exited = None
+    while True:
+        try:
+            steps.send(exited)
+        except StopIteration:
+            return elapsed
+        exited = await wait_for_process_exit(pid, timeout)
+        elapsed = _monotonic() - started
+
+
+async def status(runner):
+    """ Return the PID and state of the daemon of `runner`.
+
+        The result is a dict with ``'pid'``, ``'alive'`` and
+        ``'stale'``, as for an entry of `DaemonFleet.status`.
+    """
+    pid = runner.pid
+    alive = runner.alive
+    return {'pid': pid, 'alive': alive, 'stale': bool(pid) and not alive}
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# daemon/control.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Controlling a running daemon through a Unix socket.
+
+    Unlike a signal, a control command carries arguments, and is
+    answered once it has finished: with its result, or with the error
+    which stopped it. The daemon serves a `ControlServer`; a
+    `ControlClient` sends each request as a JSON message::
+
+        {'command': 'reload', 'args': {}}
+
+    and receives either ``{'ok': True, 'result': ...}`` or
+    ``{'ok': False, 'error': '...'}``.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import socket
+import threading
+
+from .handoff import HandoffError, bind_unix_socket, is_peer_trusted, receive_message, send_message
+
+
+class ControlError(Exception):
+    """ Exception raised when a control command fails. """
+
+
+class ControlUnavailableError(ControlError):
+    """ Exception raised when there is no control server to connect to. """
+
+
+class ControlServer(object):
+    """ Server in a running daemon, answering control commands.
+
+        `commands` maps command names to callables, called with the
+        request's arguments as keyword arguments; each returns a
+        result which can be serialised as JSON. The mapping is used as
+        is, so commands added to it later are served too.
+
+        A command still running after `timeout` seconds is answered
+        with an error, and left to finish in the background.
+
+        Each connection is served in a thread of its own, so that a
+        client which connects and sends nothing does not hold up the
+        others; it is dropped once it has sent nothing for `timeout`
+        seconds. Commands still run one at a time.
+
+        The socket at `path` is accessible to its owner only, and a
+        client running as another user (other than the superuser) is
+        not served.
+    """
+
+    def __init__(self, path, commands, timeout=10.0):
+        """ Set up a new instance. """
+        self.path = path
+        self.commands = commands
+        self.timeout = timeout
+        self.socket = None
+        self._inode = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._deferred = []
+
+    def start(self):
+        """ Start listening for commands in a background thread. """
+        self.socket, self._inode = bind_unix_socket(self.path, 8)
+
+        self._thread = threading.Thread(target=self._serve, name='daemon-control')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def fileno(self):
+        """ Return the file descriptor of the listening socket. """
+        return self.socket.fileno()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except (socket.error, OSError, AttributeError):
+                return
+
+            conn.settimeout(self.timeout)
+            thread = threading.Thread(target=self._serve_connection, args=(conn,), name='daemon-control-connection')
+            thread.daemon = True
+            thread.start()
+
+    def _serve_connection(self, conn):
+        try:
+            if is_peer_trusted(conn):
+                self._handle(conn)
+        except (socket.error, OSError, HandoffError, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def _handle(self, conn):
+        """ Answer each request from `conn`, until it disconnects. """
+        while True:
+            message, _ = receive_message(conn)
+            if message is None:
+                return
+
+            with self._lock:
+                send_message(conn, self.call(message.get('command'), message.get('args') or {}))
+
+                deferred, self._deferred = self._deferred, []
+                for action in deferred:
+                    action()
+
+    def call(self, command, args):
+        """ Run `command` with `args`; return the response message. """
+        handler = self.commands.get(command)
+        if handler is None:
+            return {'ok': False, 'error': 'Unknown command: {}'.format(command)}
+
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = handler(**args)
+            except Exception as exc:
+                outcome['error'] = '{}: {!s}'.format(type(exc).__name__, exc)
+
+        thread = threading.Thread(target=run, name='daemon-control-{}'.format(command))
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout)
+
+        if thread.is_alive():
+            return {'ok': False, 'error': 'Command {} did not finish within {} seconds'.format(command, self.timeout)}
+        if 'error' in outcome:
+            return {'ok': False, 'error': outcome['error']}
+
+        return {'ok': True, 'result': outcome.get('result')}
+
+    def defer(self, action):
+        """ Call `action` once the answer to the current command is sent. """
+        self._deferred.append(action)
+
+    def close(self, remove=True):
+        """ Stop listening, and remove the socket file if `remove` is true.
+
+            The file is left alone if another server has since replaced
+            it with its own. A process forked from the daemon closes
+            its copy of the socket with `remove` false.
+        """
+        if self.socket is None:
+            return
+
+        sock, self.socket = self.socket, None
+        if remove:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (socket.error, OSError):
+                pass
+        sock.close()
+
+        if not remove:
+            return
+
+        try:
+            if os.lstat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class ControlClient(object):
+    """ Client sending control commands to a running daemon. """
+
+    def __init__(self, path, timeout=None):
+        """ Set up a new instance. """
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, command, **args):
+        """ Send `command` with `args`, and return its result.
+
+            Raises `ControlUnavailableError` if no control server is
+            listening at `path`, or `ControlError` if the command
+            failed, or no answer came within `timeout` seconds.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            try:
+                sock.connect(self.path)
+            except (socket.error, OSError) as exc:
+                raise ControlUnavailableError('No control server at {} ({!s})'.format(self.path, exc))
+
+            try:
+                send_message(sock, {'command': command, 'args': args})
+                reply, _ = receive_message(sock)
+            except socket.timeout:
+                raise ControlError('No answer to {} within {} seconds'.format(command, self.timeout))
+            except (socket.error, OSError, HandoffError) as exc:
+                raise ControlError('Control connection failed ({!s})'.format(exc))
+        finally:
+            sock.close()
+
+        if reply is None:
+            raise ControlError('Daemon closed the control connection')
+        if not reply.get('ok'):
+            raise ControlError(reply.get('error', 'Command failed'))
+
+        return reply.get('result')
@@ -20,17 +20,32 @@
 from __future__ import unicode_literals, print_function, absolute_import
 
 import atexit
+import contextlib
 import errno
+import gc
+import importlib
+import json
 import os
 import resource
+import select
 import signal
 import six
 import socket
+import stat
+import struct
 import sys
+import time
 
 from setproctitle import setproctitle
 
-from six.moves import StringIO
+from six.moves import StringIO, cPickle as pickle
+
+from .control import ControlServer
+from .handoff import HandoffServer
+from .notify import ServiceNotifier
+from .reaper import ChildReaper
+from .signals import SignalDispatcher
+from .streams import BufferedStreamSink
 
 
 _default_std_info = {
@@ -48,6 +63,11 @@ _default_std_info = {
     },
 }
 
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
 
 class DaemonError(Exception):
     """ Base exception class for errors from this module. """
@@ -60,6 +80,14 @@ class DaemonOSEnvironmentError(DaemonError, OSError):
 class DaemonProcessDetachError(DaemonError, OSError):
     """ Exception raised when process detach fails. """
 
+
+class DaemonReadinessError(DaemonError, RuntimeError):
+    """ Exception raised when the daemon process fails to become ready. """
+
+
+class DaemonReadinessTimeout(DaemonReadinessError):
+    """ Exception raised when the daemon process is not ready in time. """
+
 
 class DaemonContext(object):
     """ Context for turning the current program into a daemon process.
@@ -138,13 +166,25 @@ class DaemonContext(object):
             :Default: ``None``
 
             If ``True``, detach the process context when opening the daemon
-            context; if ``False``, do not detach.
+            context; if ``False``, do not detach. ``'double'`` (the same
+            as ``True``) forks twice, so the daemon is not a session
+            leader and cannot acquire a controlling terminal;
+            ``'single'`` forks once and starts a new session.
 
             If unspecified (``None``) during initialisation of the instance,
             this will be set to ``True`` by default, and ``False`` only if
-            detaching the process is determined to be redundant; for example,
-            in the case when the process was started by `init`, by `initd`, or
-            by `inetd`.
+            detaching the process is determined to be redundant; see
+            `detect_process_environment`. That is the case when the
+            process was started by `init` or by `inetd`, is the first
+            process of a container, was passed a notification socket by
+            a service manager such as `systemd`, or was passed sockets
+            meant for it by socket activation. A service of
+            ``Type=forking`` must therefore set ``True``. Otherwise,
+            ``'single'`` is chosen if the process neither leads its
+            process group nor has a controlling terminal.
+
+            The chosen way is available as the `detach_mode` attribute:
+            ``'none'``, ``'single'`` or ``'double'``.
 
         `signal_map`
             :Default: system-dependent
@@ -227,18 +267,301 @@ class DaemonContext(object):
             If ``None``, the corresponding system stream is re-bound to the
             file named by `os.devnull`.
 
+            `stdout` and `stderr` may also be a `BufferedStreamSink`; the
+            system stream is then bound to the sink's pipe, and its
+            flusher thread writes to the real file in batches. The sink is
+            flushed and closed by `close`.
+
+            Output files given by path can be reopened, after being moved
+            aside, with the `reopen_streams` signal handler (for example,
+            ``signal_map={signal.SIGHUP: 'reopen_streams'}``). Moving them
+            aside is left to an external tool such as `logrotate`: a
+            plain output file grows without limit, and is never rotated
+            by size. For that, use a `BufferedStreamSink` with
+            `rotate_size`, or the `rotate_size` argument of
+            `DaemonRunner`.
+
         `process_name`
             :Default: ``None``
 
             If specified, sets the daemonized process's name (ie. what appears
             in `ps`)
+
+        `close_fds_strategy`
+            :Default: ``None``
+
+            How open file descriptors are closed on daemon start: the name
+            of an entry in `close_fds_strategies` (``'close_range'``,
+            ``'proc'``, ``'closerange'`` or ``'sweep'``), or a callable
+            accepting the set of descriptors to exclude and the maximum
+            descriptor count. If ``None``, the fastest strategy supported
+            by the running system is chosen; see `get_close_fds_strategy`.
+
+        `startup_timings`
+            :Default: ``None``
+
+            Callable which receives the duration of each step of `open`,
+            as ``startup_timings(phase, seconds, **info)``. The phases are
+            ``'chroot'``, ``'prevent_core'``, ``'umask'``, ``'chdir'``,
+            ``'listen'``, ``'owner'``, ``'detach'`` (with ``mode``),
+            ``'preload'``, ``'subreaper'``, ``'process_name'``,
+            ``'signals'``,
+            ``'close_files'`` (with ``fds_closed``), ``'streams'`` and
+            ``'pidfile'`` (with ``lock_wait``, the part of it spent
+            waiting for the lock, if the lock class records it), in that
+            order, skipping those not performed;
+            then ``'open'`` with the total. Durations are measured with a
+            monotonic clock.
+
+            A `StartupTimings` instance collects these and can write them
+            out as a record from the daemon process.
+
+        `readiness`
+            :Default: ``None``
+
+            A `ReadinessPipe`, created before `open` is called, through
+            which the daemon process reports to the launching process that
+            it is ready, or the error that stopped it starting. Its write
+            end is kept open in the daemon process.
+
+        `ready_on_open`
+            :Default: ``True``
+
+            If true, the daemon process reports readiness as soon as `open`
+            completes. Otherwise the application must call `notify_ready`
+            once it has finished initialising.
+
+        `notifier`
+            :Default: ``None``
+
+            A `ServiceNotifier` for reporting state to a service manager
+            over the `NOTIFY_SOCKET` protocol. If ``None``, one is created
+            from the environment when `open` is called, if `NOTIFY_SOCKET`
+            is set and this process is the main process of the service
+            (see `is_process_service_main`), and the variable is then
+            unset; if ``False``, no notifications are sent. A
+            `NOTIFY_SOCKET` inherited from an ancestor belongs to that
+            ancestor's service, and is left alone.
+
+            The notifier is created before the root directory changes
+            (see `chroot_directory`), and connects its socket then, so a
+            `NOTIFY_SOCKET` path outside the new root is still reached.
+
+            The notification socket is kept open in the daemon process.
+            After detaching, the daemon sends ``MAINPID``; readiness (see
+            `notify_ready`) sends ``READY=1``, and `close` sends
+            ``STOPPING=1``. Other states can be sent with `notify`.
+
+        `watchdog`
+            :Default: ``True``
+
+            If true, and the service manager requested watchdog
+            keep-alives via `WATCHDOG_USEC`, a thread in the daemon process
+            sends ``WATCHDOG=1`` at half the requested interval. If
+            `WATCHDOG_PID` is set, it must name either the daemon process
+            or the launching process it detached from; see
+            `ServiceNotifier.watchdog_applies`.
+
+        `handoff_sockets`
+            :Default: ``None``
+
+            Mapping from names to listening sockets which a successor may
+            take over for a graceful restart; see
+            `DaemonRunner.restart`. If not empty, the daemon process
+            serves a `HandoffServer` at `handoff_socket_path`. When the
+            successor has taken over the PID file and is ready, the
+            `handoff_drain` callable is called to stop serving and exit.
+
+            Sockets taken over from a predecessor are available to the
+            successor in the `inherited_sockets` mapping, and are not
+            closed when the daemon starts.
+
+        `handoff_path`
+            :Default: ``None``
+
+            Path of the Unix socket served for `handoff_sockets`. If
+            ``None``, a hidden file beside the PID file is used.
+
+        `handoff_drain`
+            :Default: ``None``
+
+            Callable with no arguments, called in a background thread once
+            a successor is ready. If ``None``, the daemon process sends
+            itself ``SIGTERM``.
+
+        `signal_dispatch`
+            :Default: ``None``
+
+            How the handlers in `signal_map` are run. If ``None``, they
+            are installed as Python signal handlers, which run in the
+            main thread between any two bytecodes.
+
+            Otherwise, a `SignalDispatcher` is installed as
+            `signal_dispatcher`, noting arriving signals in a pipe, and
+            the handlers run in normal context: with ``'thread'``, in a
+            dedicated thread, where a handler raising `SystemExit` (such
+            as `terminate`) flushes the standard streams and ends the
+            process; with ``'loop'``, from an event loop once the
+            application calls ``signal_dispatcher.attach(loop)``.
+
+        `preload_modules`
+            :Default: ``None``
+
+            Names of modules to import in the daemon process, once it
+            has detached, so that their memory is shared copy-on-write
+            with any processes it forks in turn (such as the workers of
+            a `DaemonRunner`). Importing them before detaching would
+            only load them into the launching process, which exits.
+
+        `warm_up`
+            :Default: ``None``
+
+            Callable with no arguments, called after `preload_modules`
+            are imported, to build any other state worth sharing.
+
+            After preloading, the garbage collector collects and then
+            freezes all objects (see `prepare_for_fork`), so that later
+            collections do not write to their pages and copy them.
+
+        `malloc_trim`
+            :Default: ``False``
+
+            If true, after preloading, also return unused memory at the
+            top of the C heap to the system, where supported.
+
+        `listen`
+            :Default: ``None``
+
+            Addresses for the daemon to listen on: a list, or a mapping
+            from names to addresses. Each address is either a
+            ``(host, port)`` tuple for a TCP socket, or the path of a
+            Unix socket. The sockets are bound before the process owner
+            changes (so privileged ports can be used), and are never
+            closed by `open`; they are available by name (for a list,
+            ``'host:port'`` or the path) in the `listening_sockets`
+            mapping. A socket of the same name in `inherited_sockets`
+            is used instead of binding a new one.
+
+        `listen_backlog`
+            :Default: ``128``
+
+            Backlog of connections for each socket in `listen`.
+
+        `reuse_port`
+            :Default: ``False``
+
+            If true, set ``SO_REUSEPORT`` on each socket in `listen`,
+            and bind `listen_count` sockets to each TCP address; the
+            kernel then spreads incoming connections across them. A
+            process forked from the daemon process can keep just one of
+            each with `use_worker_sockets`.
+
+        `listen_count`
+            :Default: ``1``
+
+            Number of sockets bound to each TCP address in `listen`,
+            when `reuse_port` is true.
+
+        `socket_activation`
+            :Default: ``True``
+
+            If true, and a service manager passed listening sockets to
+            this process under the socket activation protocol (see
+            `read_listen_fds`), add them to `inherited_sockets` by name
+            when `open` is called, so that they are kept open. The
+            environment variables describing them are removed, so that
+            other processes do not take them as their own.
+
+        `reap_children`
+            :Default: ``False``
+
+            If true, wait for child processes as they exit, so that they
+            do not remain as zombies: a `ChildReaper` is created as
+            `child_reaper`, and ``signal.SIGCHLD`` is mapped to
+            `reap_children` unless `signal_map` already maps it. The
+            exit status of a child started with `subprocess` is then
+            lost to its `Popen` object.
+
+        `child_subreaper`
+            :Default: ``False``
+
+            If true, make the daemon process a child subreaper (on
+            Linux), which becomes the parent of its orphaned
+            descendants instead of `init`, such as those of a child
+            which detaches in turn. Implies `reap_children`.
+
+        `control`
+            :Default: ``False``
+
+            If true, the daemon process serves a `ControlServer` at
+            `control_socket_path`, answering commands from
+            `DaemonRunner.control`. The built-in commands are:
+
+            * ``'status'``: The PID, uptime and detach mode of the
+              daemon, and the counters of its signal dispatcher, child
+              reaper and output sinks, where in use.
+
+            * ``'reload'``: Run the handler of ``signal.SIGHUP`` in
+              `signal_map`, answering once it has finished.
+
+            * ``'drain'``: Call `handoff_drain`, or send the daemon
+              process ``SIGTERM`` if there is none, once answered.
+
+            * ``'stop'``: Send the daemon process ``SIGTERM``, once
+              answered.
+
+            * ``'metrics'``: The runtime metrics of the daemon process,
+              in the Prometheus text format; see `metrics`.
+
+        `control_commands`
+            :Default: ``None``
+
+            Mapping from names to further commands, or replacements
+            for the built-in ones: callables taking the command's
+            arguments as keyword arguments, and returning a result
+            which can be serialised as JSON. Commands added to the
+            `control_commands` attribute later are served too.
+
+        `control_path`
+            :Default: ``None``
+
+            Path of the Unix socket served for `control`. If ``None``,
+            a hidden file beside the PID file is used.
+
+        `control_timeout`
+            :Default: ``10.0``
+
+            Seconds a control command may run before it is answered
+            with an error.
+
+        `metrics_path`
+            :Default: ``None``
+
+            If not ``None``, the daemon process writes its runtime
+            metrics (see `metrics`) to the file at this path, in the
+            Prometheus text format, replacing it atomically every
+            `metrics_interval` seconds. The file is removed by `close`.
+
+        `metrics_interval`
+            :Default: ``15.0``
+
+            Seconds between writes of `metrics_path`.
         """
 
     def __init__(self, chroot_directory=None, working_directory='/', umask=0,
                  uid=None, gid=None, prevent_core=True, detach_process=None,
                  files_preserve=None, pidfile=None, manage_pidfile=True,
                  stdin=None, stdout=None, stderr=None, signal_map=None,
-                 process_name=None, binary_out=True, binary_err=True):
+                 process_name=None, binary_out=True, binary_err=True,
+                 close_fds_strategy=None, startup_timings=None,
+                 readiness=None, ready_on_open=True, notifier=None,
+                 watchdog=True, handoff_sockets=None, handoff_path=None,
+                 handoff_drain=None, signal_dispatch=None, preload_modules=None,
+                 warm_up=None, malloc_trim=False, listen=None, listen_backlog=128,
+                 reuse_port=False, listen_count=1, socket_activation=True,
+                 reap_children=False, child_subreaper=False, control=False,
+                 control_commands=None, control_path=None, control_timeout=10.0,
+                 metrics_path=None, metrics_interval=15.0):
         """ Set up a new instance. """
         self.chroot_directory = chroot_directory
         self.working_directory = working_directory
@@ -253,6 +576,40 @@ class DaemonContext(object):
         self.process_name = process_name
         self.binary_out = binary_out
         self.binary_err = binary_err
+        self.close_fds_strategy = close_fds_strategy
+        self.startup_timings = startup_timings
+        self.readiness = readiness
+        self.ready_on_open = ready_on_open
+        self.notifier = notifier
+        self.watchdog = watchdog
+        self.handoff_sockets = handoff_sockets
+        self.handoff_path = handoff_path
+        self.handoff_drain = handoff_drain
+        self.handoff_client = None
+        self.inherited_sockets = {}
+        self.signal_dispatch = signal_dispatch
+        self.signal_dispatcher = None
+        self.main_pid = None
+        self.preload_modules = preload_modules or []
+        self.warm_up = warm_up
+        self.malloc_trim = malloc_trim
+        self.listen = listen
+        self.listen_backlog = listen_backlog
+        self.reuse_port = reuse_port
+        self.listen_count = listen_count
+        self.listening_sockets = {}
+        self._listening_socket_copies = {}
+        self.socket_activation = socket_activation
+        self.child_subreaper = child_subreaper
+        self.control = control
+        self.control_commands = dict(control_commands or {})
+        self.control_path = control_path
+        self.control_timeout = control_timeout
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.child_reaper = None
+        if reap_children or child_subreaper:
+            self.child_reaper = ChildReaper()
 
         if uid is None:
             uid = os.getuid()
@@ -262,14 +619,35 @@ class DaemonContext(object):
         self.gid = gid
 
         if detach_process is None:
-            detach_process = is_detach_process_context_required()
+            detach_mode = detect_process_environment().detach_mode
+            detach_process = detach_mode != 'none' and detach_mode
+        elif detach_process is True:
+            detach_mode = 'double'
+        elif not detach_process:
+            detach_mode = 'none'
+        elif detach_process in detach_modes:
+            detach_mode = detach_process
+        else:
+            raise ValueError('Unknown detach mode: {}'.format(detach_process))
         self.detach_process = detach_process
+        self.detach_mode = detach_mode
 
         if signal_map is None:
             signal_map = make_default_signal_map()
+        if self.child_reaper is not None and hasattr(signal, 'SIGCHLD'):
+            signal_map = dict(signal_map)
+            signal_map.setdefault(signal.SIGCHLD, 'reap_children')
         self.signal_map = signal_map
 
         self._is_open = False
+        self._handoff_server = None
+        self._control_server = None
+        self._opened_at = None
+        self._metrics = None
+        self._metrics_writer = None
+        self._pidfile_handed_over = False
+        self._process_handle = None
+        self._stream_paths = {}
 
     @property
     def is_open(self):
@@ -287,6 +665,13 @@ class DaemonContext(object):
               immediately. This makes it safe to call `open` multiple times on
               an instance.
 
+            * If the `notifier` attribute is ``None``, and this process
+              is the main process of a service, create a notifier from
+              `NOTIFY_SOCKET`.
+
+            * If the `socket_activation` attribute is true, take over any
+              sockets passed by the service manager.
+
             * If the `prevent_core` attribute is true, set the resource limits
               for the process to prevent any core dump from the process.
 
@@ -299,6 +684,9 @@ class DaemonContext(object):
               by the process. Note that the specified directory needs to
               already be set up for this purpose.
 
+            * If the `listen` attribute is not empty, bind and listen on
+              its addresses.
+
             * Set the process UID and GID to the `uid` and `gid` attribute
               values.
 
@@ -314,9 +702,21 @@ class DaemonContext(object):
 
             * If the `detach_process` option is true, detach the current
               process into its own process group, and disassociate from any
-              controlling terminal.
+              controlling terminal, as set by `detach_mode`. If there is a
+              `notifier`, tell the service manager the PID of the detached
+              process.
+
+            * If the `preload_modules` or `warm_up` attributes are set,
+              import the modules and call the callable, then prepare
+              the process's memory to be shared by the forks that
+              follow.
 
-            * Set signal handlers as specified by the `signal_map` attribute.
+            * If the `child_subreaper` option is true, make the process a
+              child subreaper.
+
+            * Set signal handlers as specified by the `signal_map` attribute,
+              or route them through a `SignalDispatcher` as specified by
+              the `signal_dispatch` attribute.
 
             * If any of the attributes `stdin`, `stdout`, `stderr` are not
               ``None``, bind the system streams `sys.stdin`, `sys.stdout`,
@@ -334,56 +734,175 @@ class DaemonContext(object):
             * Register the `close` method to be called during Python's exit
               processing.
 
+            * If the `handoff_sockets` attribute is not empty, start
+              serving them to a successor.
+
+            * If the `control` option is true, start serving control
+              commands.
+
+            * If the `metrics_path` attribute is not ``None``, start
+              writing the metrics to it.
+
+            * If the `readiness` attribute is not ``None`` and the
+              `ready_on_open` attribute is true, report readiness to the
+              launching process. If any step fails, report the error
+              instead.
+
             When the function returns, the running program is a daemon
             process.
         """
         if self.is_open:
             return
 
-        if self.chroot_directory is not None:
-            change_root_directory(self.chroot_directory)
-
-        if self.prevent_core:
-            prevent_core_dump()
-
-        change_file_creation_mask(self.umask)
-        change_working_directory(self.working_directory)
-        change_process_owner(self.uid, self.gid)
-
-        if self.detach_process:
-            detach_process_context()
+        open_started = _monotonic()
 
-        if self.process_name:
-            setproctitle(self.process_name)
-
-        signal_handler_map = self._make_signal_handler_map()
-        set_signal_handlers(signal_handler_map)
-
-        exclude_fds = self._get_exclude_file_descriptors()
-        close_all_open_files(exclude=exclude_fds)
-
-        self.stdin = set_std(self.stdin, os.devnull, 'r')
+        try:
+            # Before `read_listen_fds` unsets the `LISTEN_PID` this checks.
+            if self.notifier is None and is_process_service_main():
+                self.notifier = ServiceNotifier.from_environment(unset=True)
+
+            if self.socket_activation:
+                for name, activated in read_listen_fds():
+                    self.inherited_sockets.setdefault(name, activated)
+
+            if self.chroot_directory is not None:
+                with self._startup_phase('chroot'):
+                    change_root_directory(self.chroot_directory)
+
+            if self.prevent_core:
+                with self._startup_phase('prevent_core'):
+                    prevent_core_dump()
+
+            with self._startup_phase('umask'):
+                change_file_creation_mask(self.umask)
+            with self._startup_phase('chdir'):
+                change_working_directory(self.working_directory)
+            if self.listen:
+                with self._startup_phase('listen'):
+                    self._bind_listening_sockets()
+
+            with self._startup_phase('owner'):
+                change_process_owner(self.uid, self.gid)
+
+            if self.detach_process:
+                with self._startup_phase('detach') as info:
+                    info['mode'] = self.detach_mode
+                    detach_process_context(self.detach_mode)
+
+                if self.notifier:
+                    self.notifier.mainpid()
+
+            self.main_pid = os.getpid()
+
+            if self.preload_modules or self.warm_up is not None:
+                with self._startup_phase('preload'):
+                    for name in self.preload_modules:
+                        importlib.import_module(name)
+                    if self.warm_up is not None:
+                        self.warm_up()
+                    prepare_for_fork(malloc_trim=self.malloc_trim)
+
+            if self.child_subreaper:
+                with self._startup_phase('subreaper'):
+                    set_child_subreaper()
+
+            if self.process_name:
+                with self._startup_phase('process_name'):
+                    setproctitle(self.process_name)
+
+            with self._startup_phase('signals'):
+                if self.detach_process:
+                    # A wakeup descriptor inherited from the launcher's
+                    # event loop is about to be closed.
+                    reset_signal_wakeup_fd()
+                self.install_signal_handlers()
+
+            with self._startup_phase('close_files') as info:
+                exclude_fds = self._get_exclude_file_descriptors()
+                open_before = None
+                if self.startup_timings is not None:
+                    open_before = count_open_file_descriptors()
+
+                # Any cached process descriptor is about to be closed.
+                self._process_handle = None
+                fds_closed = close_all_open_files(exclude=exclude_fds, strategy=self.close_fds_strategy)
+                if fds_closed is None and open_before is not None:
+                    fds_closed = open_before - count_open_file_descriptors()
+                info['fds_closed'] = fds_closed
+
+            with self._startup_phase('streams'):
+                self._stream_paths = dict(
+                    (name, getattr(self, name)) for name in ['stdout', 'stderr']
+                    if isinstance(getattr(self, name), six.string_types) and getattr(self, name) != os.devnull
+                )
+
+                self.stdin = set_std(self.stdin, os.devnull, 'r')
+
+                same_std_out_err = self.stdout == self.stderr
+
+                self.stdout = set_std(
+                    self.stdout, os.devnull,
+                    'wb+' if self.binary_out else 'w+'
+                )
+                self.stderr = self.stdout if same_std_out_err else set_std(
+                    self.stderr, os.devnull,
+                    'wb+' if self.binary_err else 'w+'
+                )
+
+                for std in ['stdin', 'stdout', 'stderr']:
+                    stream = getattr(self, std)
+                    if isinstance(stream, BufferedStreamSink):
+                        stream.open()
+                    redirect_stream(std, stream)
+
+                for sink in self._stream_sinks():
+                    sink.start()
+
+            if self.pidfile is not None and self.manage_pidfile:
+                with self._startup_phase('pidfile') as info:
+                    self.pidfile.__enter__()
+                    info['lock_wait'] = getattr(self.pidfile, 'lock_wait', None)
+
+            self._is_open = True
+
+            atexit.register(self.close)
+
+            if self.handoff_sockets:
+                self._start_handoff_server()
+
+            self._opened_at = time.time()
+            if self.control:
+                self._start_control_server()
+
+            if self.metrics_path is not None:
+                self._start_metrics_writer()
+        except Exception as exc:
+            if self.readiness is not None:
+                self.readiness.notify_error(exc)
+            raise
 
-        same_std_out_err = self.stdout == self.stderr
+        if self.startup_timings is not None:
+            self.startup_timings('open', _monotonic() - open_started)
 
-        self.stdout = set_std(
-            self.stdout, os.devnull,
-            'wb+' if self.binary_out else 'w+'
-        )
-        self.stderr = self.stdout if same_std_out_err else set_std(
-            self.stderr, os.devnull,
-            'wb+' if self.binary_err else 'w+'
-        )
+        if self.notifier and self.watchdog:
+            self.notifier.start_watchdog()
 
-        for std in ['stdin', 'stdout', 'stderr']:
-            redirect_stream(std, getattr(self, std))
+        if self.ready_on_open:
+            self.notify_ready()
 
-        if self.pidfile is not None and self.manage_pidfile:
-            self.pidfile.__enter__()
+    @contextlib.contextmanager
+    def _startup_phase(self, phase):
+        """ Time one phase of `open`, reporting it to `startup_timings`.
 
-        self._is_open = True
+            Yields a dict; any items added to it are passed on to
+            `startup_timings` as keyword arguments.
+        """
+        info = {}
+        started = _monotonic()
+        yield info
 
-        atexit.register(self.close)
+        if self.startup_timings is not None:
+            self.startup_timings(phase, _monotonic() - started, **info)
 
     def __enter__(self):
         """ Context manager entry point. """
@@ -400,8 +919,18 @@ class DaemonContext(object):
               immediately. This makes it safe to call `close` multiple times
               on an instance.
 
+            * If there is a `notifier`, send ``STOPPING=1`` and stop the
+              watchdog thread.
+
+            * Flush the standard streams, and close any
+              `BufferedStreamSink`, pointing the standard output
+              descriptors back at its file.
+
+            * Stop serving `handoff_sockets` and control commands, and
+              remove the `metrics_path` file.
+
             * If the `pidfile` attribute is not ``None``, exit its context
-              manager.
+              manager, unless it has been handed over to a successor.
 
             * Mark this instance as closed (for the purpose of future `open`
               and `close` calls).
@@ -409,7 +938,26 @@ class DaemonContext(object):
         if not self.is_open:
             return
 
-        if self.pidfile is not None and self.manage_pidfile:
+        if self.notifier:
+            self.notifier.stopping()
+            self.notifier.stop_watchdog()
+
+        self.flush_streams()
+        for sink in self._stream_sinks():
+            sink.close(redirect_fds=[
+                fd for name, fd in [('stdout', 1), ('stderr', 2)] if getattr(self, name) is sink
+            ])
+
+        if self._handoff_server is not None:
+            self._handoff_server.close()
+            self._handoff_server = None
+
+        self.close_control_server()
+        if self._metrics_writer is not None:
+            self._metrics_writer.close()
+            self._metrics_writer = None
+
+        if self.pidfile is not None and self.manage_pidfile and not self._pidfile_handed_over:
             # Follow the interface for telling a context manager to exit,
             # <URL:http://docs.python.org/library/stdtypes.html#typecontextmanager>.
             self.pidfile.__exit__(None, None, None)
@@ -420,11 +968,87 @@ class DaemonContext(object):
         """ Context manager exit point. """
         self.close()
 
+    def flush_streams(self):
+        """ Flush `sys.stdout`, `sys.stderr` and any `BufferedStreamSink`.
+
+            Call this before leaving the process without running exit
+            handlers, such as with `os._exit`.
+
+            The sinks are flushed only in the daemon process itself. A
+            forked worker writes into the same pipes, which the daemon
+            process drains; the sinks' lock, as inherited by the
+            worker, may have been held by the flusher thread at the
+            fork and never be released.
+        """
+        flush_system_streams()
+
+        if os.getpid() != self.main_pid:
+            return
+
+        for sink in self._stream_sinks():
+            sink.flush()
+
+    def _stream_sinks(self):
+        """ Return the distinct `BufferedStreamSink` instances in use. """
+        sinks = []
+        for stream in [self.stdout, self.stderr]:
+            if isinstance(stream, BufferedStreamSink) and stream not in sinks:
+                sinks.append(stream)
+        return sinks
+
+    def notify_ready(self):
+        """ Report to the launching process that the daemon is ready.
+
+            Reports through the `readiness` pipe, if any (once only),
+            and sends ``READY=1`` to the service manager, if there is a
+            `notifier`. If this daemon is taking over from a
+            predecessor, tells the predecessor to drain.
+        """
+        if self.readiness is not None:
+            self.readiness.notify_ready(self.main_pid)
+
+        if self.notifier:
+            self.notifier.ready()
+
+        if self.handoff_client is not None:
+            client, self.handoff_client = self.handoff_client, None
+            try:
+                client.drain()
+            finally:
+                client.close()
+
+    def report_exit(self, code, result=None, error=None):
+        """ Report to the launching process that the daemon is exiting.
+
+            Reports the exit status `code`, with the `result` of the
+            daemon's work or a description of the `error` which ended
+            it, through the `readiness` pipe, if any. Only the daemon
+            process itself reports, not processes forked from it.
+        """
+        if self.readiness is not None and os.getpid() == self.main_pid:
+            self.readiness.notify_exit(code, result, error)
+
+    def notify(self, *states, **fields):
+        """ Send a state notification to the service manager.
+
+            Arguments are as for `ServiceNotifier.notify`. Returns
+            ``False`` if there is no `notifier` or the notification
+            could not be sent.
+        """
+        if not self.notifier:
+            return False
+
+        return self.notifier.notify(*states, **fields)
+
     @property
     def pid(self):
         if not self.pidfile:
             raise DaemonOSEnvironmentError('No PID file associated with daemon')
 
+        return self._get_process_handle().pid
+
+    def _read_pid(self):
+        """ Read the PID from the PID file, uncached. """
         if self.manage_pidfile:
             pid = self.pidfile.read_pid()
         else:
@@ -436,20 +1060,24 @@ class DaemonContext(object):
 
         return pid or 0
 
+    def _get_process_handle(self):
+        """ Return the `ProcessHandle` for the PID file, refreshed. """
+        if self._process_handle is None:
+            path = self.pidfile if isinstance(self.pidfile, six.string_types) else self.pidfile.path
+            self._process_handle = ProcessHandle(path, self._read_pid)
+
+        self._process_handle.refresh()
+        return self._process_handle
+
     @property
     def alive(self):
-        if self.pid == 0:
-            return False
-
-        try:
-            os.kill(self.pid, 0)
-        except OSError:
-            return False
+        if not self.pidfile:
+            raise DaemonOSEnvironmentError('No PID file associated with daemon')
 
-        return True
+        return self._get_process_handle().alive
 
-    @property
-    def _stale_path(self):
+    def _pidfile_sibling_path(self, suffix):
+        """ Return the path of a hidden file beside the PID file. """
         if self.pidfile is None:
             return None
 
@@ -459,7 +1087,149 @@ class DaemonContext(object):
 
         dirpath, basename = os.path.split(path)
 
-        return os.path.join(dirpath, '.' + basename + '.stale')
+        return os.path.join(dirpath, '.' + basename + '.' + suffix)
+
+    @property
+    def _stale_path(self):
+        return self._pidfile_sibling_path('stale')
+
+    @property
+    def handoff_socket_path(self):
+        """ Path of the Unix socket served for `handoff_sockets`. """
+        if self.handoff_path is not None:
+            return self.handoff_path
+
+        path = self._pidfile_sibling_path('handoff')
+        if path is None:
+            raise DaemonOSEnvironmentError('No PID file or handoff path associated with daemon')
+
+        return path
+
+    def _start_handoff_server(self):
+        """ Serve `handoff_sockets` to a successor. """
+        def release():
+            if self.pidfile is not None and self.manage_pidfile:
+                self.pidfile.__exit__(None, None, None)
+                self._pidfile_handed_over = True
+
+        def reacquire():
+            if self._pidfile_handed_over:
+                self.pidfile.__enter__()
+                self._pidfile_handed_over = False
+
+        drain = self.handoff_drain
+        if drain is None:
+            def drain():
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        self._handoff_server = HandoffServer(
+            self.handoff_socket_path, self.handoff_sockets, release, reacquire, drain)
+        self._handoff_server.start()
+
+    @property
+    def control_socket_path(self):
+        """ Path of the Unix socket served for `control`. """
+        if self.control_path is not None:
+            return self.control_path
+
+        path = self._pidfile_sibling_path('control')
+        if path is None:
+            raise DaemonOSEnvironmentError('No PID file or control path associated with daemon')
+
+        return path
+
+    def _start_control_server(self):
+        """ Serve the built-in and `control_commands` commands. """
+        commands = self.control_commands
+        commands.setdefault('status', self.control_status)
+        commands.setdefault('reload', self._control_reload)
+        commands.setdefault('drain', self._control_drain)
+        commands.setdefault('stop', self._control_stop)
+        commands.setdefault('metrics', lambda: self.metrics.as_text())
+
+        self._control_server = ControlServer(self.control_socket_path, commands, self.control_timeout)
+        self._control_server.start()
+
+    def close_control_server(self, remove=True):
+        """ Stop serving control commands.
+
+            A process forked from the daemon process, which does not
+            inherit the serving thread, calls this with `remove` false
+            to close its copy of the socket, leaving the file in place.
+        """
+        if self._control_server is not None:
+            self._control_server.close(remove)
+            self._control_server = None
+
+    def close_after_fork(self):
+        """ Close the daemon process's own descriptors in a process forked from it.
+
+            The PID file lock (where held by a descriptor, see
+            `pidlockfile.KernelPIDLockFile.close_after_fork`) and the
+            control socket stay with the daemon process. Without this,
+            a forked worker would keep the lock held after the daemon
+            process exits.
+        """
+        close_lock = getattr(self.pidfile, 'close_after_fork', None)
+        if self.manage_pidfile and close_lock is not None:
+            close_lock()
+
+        self.close_control_server(remove=False)
+
+    @property
+    def metrics(self):
+        """ The `DaemonMetrics` of the daemon process.
+
+            Each figure is read when the metrics are collected, at no
+            cost beforehand.
+        """
+        if self._metrics is None:
+            from .metrics import DaemonMetrics
+            self._metrics = DaemonMetrics(self)
+
+        return self._metrics
+
+    def _start_metrics_writer(self):
+        """ Write the metrics to `metrics_path` every `metrics_interval` seconds. """
+        from .metrics import MetricsFileWriter
+
+        self._metrics_writer = MetricsFileWriter(self.metrics_path, self.metrics.as_text, self.metrics_interval)
+        self._metrics_writer.start()
+
+    def control_status(self):
+        """ Return the state of the daemon process, for the ``'status'`` command. """
+        status = {
+            'pid': os.getpid(),
+            'main_pid': self.main_pid,
+            'uptime': None if self._opened_at is None else time.time() - self._opened_at,
+            'detach_mode': self.detach_mode,
+            'commands': sorted(self.control_commands),
+        }
+        if self.signal_dispatcher is not None:
+            status['signals'] = self.signal_dispatcher.as_dict()
+        if self.child_reaper is not None:
+            status['children'] = self.child_reaper.as_dict()
+        sinks = self._stream_sinks()
+        if sinks:
+            status['streams'] = [sink.as_dict() for sink in sinks]
+        return status
+
+    def _control_reload(self):
+        handler = self._make_signal_handler_map().get(getattr(signal, 'SIGHUP', None))
+        if not callable(handler):
+            raise ValueError('No handler for SIGHUP in signal_map')
+        handler(signal.SIGHUP, None)
+
+    def _control_drain(self):
+        drain = self.handoff_drain
+        if drain is None:
+            def drain():
+                os.kill(os.getpid(), signal.SIGTERM)
+        self._control_server.defer(drain)
+
+    def _control_stop(self):
+        self._control_server.defer(lambda: os.kill(os.getpid(), signal.SIGTERM))
+        return {'pid': os.getpid()}
 
     @property
     def stale(self):
@@ -480,7 +1250,10 @@ class DaemonContext(object):
             :Return: ``None``
 
             Signal handler for the ``signal.SIGTERM`` signal. Performs the
-            following step:
+            following steps:
+
+            * Run the exit handlers, including `close`, which flushes any
+              buffered output.
 
             * Raise a ``SystemExit`` exception explaining the signal.
         """
@@ -489,6 +1262,125 @@ class DaemonContext(object):
         atexit._run_exitfuncs()
         raise SystemExit('Terminating on signal {:d}'.format(signal_number))
 
+    def reap_children(self, signal_number=None, stack_frame=None):
+        """ Signal handler for exited child processes.
+            :Return: ``None``
+
+            For use in `signal_map` for ``signal.SIGCHLD``. Waits for
+            every child process which has exited, recording their exit
+            statuses in `child_reaper`.
+        """
+        if self.child_reaper is not None:
+            self.child_reaper.reap()
+
+    def reopen_streams(self, signal_number=None, stack_frame=None):
+        """ Signal handler for reopening the output files.
+            :Return: ``None``
+
+            For use in `signal_map`, typically for ``signal.SIGHUP``
+            once the files have been moved aside for rotation. Performs
+            the following steps:
+
+            * Flush `sys.stdout` and `sys.stderr`.
+
+            * Tell each `BufferedStreamSink` to reopen its file.
+
+            * Reopen, for appending, each of `stdout` and `stderr` that
+              was given as a path, and duplicate the new file over both
+              the standard output descriptor and that of the existing
+              file object, which then writes to the new file.
+        """
+        flush_system_streams()
+
+        for sink in self._stream_sinks():
+            sink.reopen()
+
+        for name, fd in [('stdout', 1), ('stderr', 2)]:
+            path = self._stream_paths.get(name)
+            stream = getattr(self, name)
+            if path is None or isinstance(stream, BufferedStreamSink):
+                continue
+
+            reopened_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+            try:
+                for target_fd in set([fd, stream.fileno()]):
+                    os.dup2(reopened_fd, target_fd)
+            finally:
+                os.close(reopened_fd)
+
+    def _bind_listening_sockets(self):
+        """ Bind the sockets for `listen`, unless inherited. """
+        addresses = self.listen
+        if not hasattr(addresses, 'items'):
+            addresses = dict((format_socket_address(address), address) for address in addresses)
+
+        count = self.listen_count if self.reuse_port else 1
+        for name, address in addresses.items():
+            if name in self.inherited_sockets:
+                self.listening_sockets[name] = self.inherited_sockets[name]
+                continue
+
+            copies = [bind_listening_socket(address, self.listen_backlog, self.reuse_port)]
+            if not isinstance(address, six.string_types):
+                # Bind the copies to the address actually bound, in case it named port 0.
+                bound_address = copies[0].getsockname()
+                copies.extend(
+                    bind_listening_socket(bound_address, self.listen_backlog, self.reuse_port)
+                    for _ in range(count - 1)
+                )
+            self.listening_sockets[name] = copies[0]
+            if len(copies) > 1:
+                self._listening_socket_copies[name] = copies
+
+    def use_worker_sockets(self, index):
+        """ Keep only copy `index` of each ``SO_REUSEPORT`` listening socket.
+
+            Call this in a worker process forked from the daemon
+            process: `listening_sockets` is updated to hold the
+            worker's own copies, and the other copies are closed, so
+            that the kernel does not queue the worker's share of
+            connections on sockets it never accepts from.
+        """
+        for name, copies in self._listening_socket_copies.items():
+            own = copies[index % len(copies)]
+            for sock in copies:
+                if sock is not own:
+                    sock.close()
+            self.listening_sockets[name] = own
+        self._listening_socket_copies = {}
+
+    def install_signal_handlers(self):
+        """ Install the handlers for `signal_map`, as set by `signal_dispatch`.
+
+            Called by `open`; call it again in a process forked from
+            the daemon process, which does not inherit the thread of a
+            `SignalDispatcher`.
+        """
+        signal_handler_map = self._make_signal_handler_map()
+        if self.signal_dispatch:
+            self._install_signal_dispatcher(signal_handler_map)
+        else:
+            set_signal_handlers(signal_handler_map)
+
+    def _install_signal_dispatcher(self, signal_handler_map):
+        """ Install a `SignalDispatcher` for `signal_handler_map`. """
+        if self.signal_dispatch not in ('thread', 'loop'):
+            raise ValueError('Unknown signal dispatch mode: {}'.format(self.signal_dispatch))
+
+        def exit_process(code):
+            self.flush_streams()
+            self.report_exit(code)
+            os._exit(code)
+
+        self.signal_dispatcher = SignalDispatcher(signal_handler_map, exit_handler=exit_process)
+        try:
+            self.signal_dispatcher.install()
+        except ValueError as exc:
+            raise DaemonOSEnvironmentError('Unable to install signal dispatcher ({!s})'.format(exc))
+
+        if self.signal_dispatch == 'thread':
+            self.signal_dispatcher.start()
+
     def _get_exclude_file_descriptors(self):
         """ Return the set of file descriptors to exclude closing.
 
@@ -508,9 +1400,28 @@ class DaemonContext(object):
         if files_preserve is None:
             files_preserve = []
 
-        files_preserve.extend(
-            item for item in [self.stdin, self.stdout, self.stderr] if hasattr(item, 'fileno')
-        )
+        for item in [self.stdin, self.stdout, self.stderr]:
+            if isinstance(item, BufferedStreamSink):
+                files_preserve.extend(item.file_descriptors())
+            elif hasattr(item, 'fileno'):
+                files_preserve.append(item)
+
+        if self.readiness is not None:
+            files_preserve.append(self.readiness)
+
+        if self.notifier:
+            files_preserve.append(self.notifier)
+
+        if self.handoff_client is not None:
+            files_preserve.append(self.handoff_client)
+
+        if self.signal_dispatcher is not None:
+            files_preserve.extend(self.signal_dispatcher.file_descriptors())
+
+        files_preserve.extend(self.inherited_sockets.values())
+        files_preserve.extend(self.listening_sockets.values())
+        for copies in self._listening_socket_copies.values():
+            files_preserve.extend(copies)
 
         exclude_descriptors = set()
         for item in files_preserve:
@@ -552,83 +1463,489 @@ class DaemonContext(object):
         )
 
 
-def change_working_directory(directory):
-    """ Change the working directory of this process."""
-    try:
-        os.chdir(directory)
-    except OSError as exc:
-        raise DaemonOSEnvironmentError('Unable to change working directory ({!s})'.format(exc))
+class StartupTimings(object):
+    """ Collector for the durations of the steps of `DaemonContext.open`.
+
+        Pass an instance as the `startup_timings` option of a
+        `DaemonContext`. Each phase is recorded in order in `phases`
+        as a ``(phase, seconds)`` pair; the number of file
+        descriptors closed, and the part of the ``'pidfile'`` phase
+        spent waiting for the lock (as opposed to writing the file),
+        are kept in `fds_closed` and `lock_wait`.
+
+        If `path` is given, once `open` completes the daemon process
+        appends the record (see `as_dict`) to that file as a single
+        line of JSON.
+    """
 
+    def __init__(self, path=None):
+        """ Set up a new instance. """
+        self.path = path
+        self.phases = []
+        self.fds_closed = None
+        self.lock_wait = None
+        self.total = None
+        self.pid = None
+
+    def __call__(self, phase, seconds, **info):
+        """ Record the duration of `phase`. """
+        if phase == 'open':
+            self.total = seconds
+            self.pid = os.getpid()
+            if self.path is not None:
+                self.write(self.path)
+            return
 
-def change_root_directory(directory):
-    """ Change the root directory of this process.
+        self.phases.append((phase, seconds))
 
-        Sets the current working directory, then the process root
-        directory, to the specified `directory`. Requires appropriate
-        OS privileges for this process.
-    """
-    try:
-        os.chdir(directory)
-        os.chroot(directory)
-    except OSError as exc:
-        raise DaemonOSEnvironmentError('Unable to change root directory ({!s})'.format(exc))
+        if phase == 'close_files':
+            self.fds_closed = info.get('fds_closed')
+        elif phase == 'pidfile':
+            self.lock_wait = info.get('lock_wait')
 
+    def as_dict(self):
+        """ Return the collected timings as a dict. """
+        return {
+            'pid': self.pid,
+            'phases': [{'phase': phase, 'seconds': seconds} for phase, seconds in self.phases],
+            'total': self.total,
+            'fds_closed': self.fds_closed,
+            'lock_wait': self.lock_wait,
+        }
 
-def change_file_creation_mask(mask):
-    """ Change the file creation mask for this process."""
-    try:
-        os.umask(mask)
-    except OSError as exc:
-        raise DaemonOSEnvironmentError('Unable to change file creation mask ({!s})'.format(exc))
+    def write(self, path):
+        """ Append the record to the file at `path` as a line of JSON. """
+        with open(path, 'a') as fp:
+            fp.write(json.dumps(self.as_dict(), sort_keys=True) + '\n')
 
 
-def change_process_owner(uid, gid):
-    """ Change the owning UID and GID of this process.
+class ReadinessPipe(object):
+    """ Pipe from the daemon process back to the process that launched it.
 
-        Sets the GID then the UID of the process (in that order, to
-        avoid permission errors) to the specified `gid` and `uid`
-        values. Requires appropriate OS privileges for this process.
-    """
-    try:
-        os.setgid(gid)
-        os.setuid(uid)
-    except OSError as exc:
-        raise DaemonOSEnvironmentError('Unable to change process owner ({!s}'.format(exc))
+        Create the instance before the daemon context is opened, so
+        that both ends survive the forks. The daemon process reports
+        with `notify_ready` or `notify_error`; the launching process
+        blocks in `wait` until one of those arrives, the daemon
+        process exits, or the timeout expires. As it exits, the daemon
+        process reports its exit status with `notify_exit`.
 
-
-def prevent_core_dump():
-    """ Prevent this process from generating a core dump.
+        Once the daemon is ready, `wait` closes the read end, unless
+        told to keep it open for the exit report; whoever keeps it
+        open (such as `DaemonHandle`) must `close` it.
 
-        Sets the soft and hard limits for core dump size to zero. On
-        Unix, this prevents the process from creating core dump
-        altogether.
+        Messages are length-prefixed pickles of ``(kind, value)``.
     """
-    core_resource = resource.RLIMIT_CORE
 
-    try:
-        # Ensure the resource limit exists on this platform, by requesting
-        # its current value
-        resource.getrlimit(core_resource)
-    except ValueError as exc:
-        raise DaemonOSEnvironmentError('System does not support RLIMIT_CORE resource limit ({!s})'.format(exc))
+    def __init__(self):
+        """ Set up a new instance. """
+        self.read_fd, self.write_fd = os.pipe()
+        self._buffer = b''
+        self._notified = False
 
-    # Set hard and soft limits to zero, i.e. no core dump at all
-    core_limit = (0, 0)
-    resource.setrlimit(core_resource, core_limit)
+    def fileno(self):
+        """ Return the file descriptor used by the daemon process. """
+        return self.write_fd
 
-
-def detach_process_context():
-    """ Detach the process context from parent and session.
+    def send(self, kind, value=None, timeout=None):
+        """ Send a message to the launching process.
 
-        Detach from the parent process and session group, allowing the
-        parent to exit while this process continues running.
+            If `timeout` is not ``None``, give up once the pipe has
+            been full for that many seconds. Returns ``True`` if the
+            whole message was written.
+        """
+        if self.write_fd is None:
+            return False
+
+        data = pickle.dumps((kind, value), 2)
+        data = struct.pack('!I', len(data)) + data
+        deadline = None if timeout is None else _monotonic() + timeout
+        try:
+            while data:
+                if deadline is None:
+                    data = data[os.write(self.write_fd, data):]
+                    continue
+
+                remaining = deadline - _monotonic()
+                if remaining <= 0 or not select.select([], [self.write_fd], [], remaining)[1]:
+                    return False
+                # Once writable, a pipe takes this much without blocking.
+                data = data[os.write(self.write_fd, data[:select.PIPE_BUF]):]
+        except OSError as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+            return False
+
+        return True
+
+    def notify_ready(self, pid=None):
+        """ Report that the daemon process, or process `pid`, is ready. """
+        if not self._notified:
+            self._notified = True
+            self.send('ready', os.getpid() if pid is None else pid)
+
+    def notify_error(self, exc):
+        """ Report that the daemon process failed to start. """
+        if not self._notified:
+            self._notified = True
+            self.send('error', '{}: {!s}'.format(type(exc).__name__, exc))
+
+    def notify_exit(self, code, result=None, error=None, timeout=10.0):
+        """ Report that the daemon process is exiting with status `code`.
+
+            `result` is the value its work returned, and `error`
+            describes the failure which ended it, if any. If the report
+            does not fit in the pipe, wait up to `timeout` seconds for
+            the launching process to read it; if the launching process
+            has closed its read end (see `DaemonHandle.close`) or
+            exited, give up at once.
+        """
+        try:
+            pickle.dumps(result, 2)
+        except Exception as exc:
+            result = None
+            error = error or 'Result could not be pickled ({}: {!s})'.format(type(exc).__name__, exc)
+
+        self.send('exit', (code, result, error), timeout)
+
+    def close_write_end(self):
+        """ Close the launching process's copy of the write end. """
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def _close_read_end(self):
+        if self.read_fd is not None:
+            os.close(self.read_fd)
+            self.read_fd = None
+
+    def close(self):
+        """ Close both ends of the launching process's copy of the pipe. """
+        self.close_write_end()
+        self._close_read_end()
+
+    def feed(self, data):
+        """ Add `data` read from the pipe; return the next complete message.
+
+            Returns ``None`` if no message is complete yet.
+        """
+        self._buffer += data
+        if len(self._buffer) < 4:
+            return None
+
+        size = struct.unpack('!I', self._buffer[:4])[0]
+        if len(self._buffer) < 4 + size:
+            return None
+
+        data, self._buffer = self._buffer[4:4 + size], self._buffer[4 + size:]
+        return pickle.loads(data)
+
+    def receive(self, timeout=None):
+        """ Receive the next message from the daemon process.
+
+            Returns the ``(kind, value)`` pair, or ``None`` if the
+            daemon process closed the pipe without sending one. Raises
+            `DaemonReadinessTimeout` if nothing arrives in `timeout`
+            seconds.
+        """
+        self.close_write_end()
+
+        deadline = None if timeout is None else _monotonic() + timeout
+        message = self.feed(b'')
+        while message is None:
+            remaining = None if deadline is None else max(0, deadline - _monotonic())
+            readable = select.select([self.read_fd], [], [], remaining)[0]
+            if not readable:
+                raise DaemonReadinessTimeout('Daemon process not ready after {} seconds'.format(timeout))
+
+            chunk = os.read(self.read_fd, 65536)
+            if not chunk:
+                return None
+            message = self.feed(chunk)
+
+        return message
+
+    def wait(self, timeout=None, keep_open=False):
+        """ Wait for the daemon process to report readiness.
+
+            Returns the PID of the daemon process. Raises
+            `DaemonReadinessError` if the daemon process reported an
+            error or exited first, or `DaemonReadinessTimeout` if it
+            did not report in `timeout` seconds.
+
+            The read end is then closed, unless `keep_open` is true,
+            so that the exit report can still be received.
+        """
+        try:
+            message = self.receive(timeout)
+        except DaemonReadinessTimeout:
+            if not keep_open:
+                self._close_read_end()
+            raise
+
+        return self.ready_pid(message, keep_open)
+
+    def ready_pid(self, message, keep_open=False):
+        """ Interpret the first `message` received from the daemon process.
+
+            Returns the PID of the daemon process if it is ready;
+            otherwise raises as for `wait`, which see for `keep_open`.
+        """
+        if message is None:
+            self._close_read_end()
+            raise DaemonReadinessError('Daemon process exited before becoming ready')
+
+        kind, value = message
+        if kind == 'error':
+            self._close_read_end()
+            raise DaemonReadinessError('Daemon process failed to start ({})'.format(value))
+        if kind == 'exit':
+            self._close_read_end()
+            raise DaemonReadinessError('Daemon process exited before becoming ready')
+
+        if not keep_open:
+            self._close_read_end()
+        return value
+
+
+def change_working_directory(directory):
+    """ Change the working directory of this process."""
+    try:
+        os.chdir(directory)
+    except OSError as exc:
+        raise DaemonOSEnvironmentError('Unable to change working directory ({!s})'.format(exc))
+
+
+def change_root_directory(directory):
+    """ Change the root directory of this process.
+
+        Sets the current working directory, then the process root
+        directory, to the specified `directory`. Requires appropriate
+        OS privileges for this process.
+    """
+    try:
+        os.chdir(directory)
+        os.chroot(directory)
+    except OSError as exc:
+        raise DaemonOSEnvironmentError('Unable to change root directory ({!s})'.format(exc))
+
+
+def change_file_creation_mask(mask):
+    """ Change the file creation mask for this process."""
+    try:
+        os.umask(mask)
+    except OSError as exc:
+        raise DaemonOSEnvironmentError('Unable to change file creation mask ({!s})'.format(exc))
+
+
+LISTEN_FDS_START = 3
+
+
+def read_listen_fds(environ=None, unset=True):
+    """ Return the sockets passed to this process by a service manager.
+
+        Under the socket activation protocol, the service manager
+        passes open file descriptors starting at `LISTEN_FDS_START`,
+        and sets `LISTEN_FDS` to their number, `LISTEN_PID` to the PID
+        of the process they are meant for, and optionally
+        `LISTEN_FDNAMES` to their colon-separated names.
+
+        Returns a list of ``(name, socket)`` pairs, empty if nothing
+        was passed to this process. Descriptors which are not sockets
+        (such as FIFOs) are returned as integers. Unnamed descriptors
+        are named ``'fd3'``, ``'fd4'``, and so on. The descriptors are
+        marked close-on-exec, and if `unset` is true the variables are
+        removed from `environ` (by default, `os.environ`).
+    """
+    if environ is None:
+        environ = os.environ
+
+    try:
+        listen_pid = int(environ.get('LISTEN_PID', ''))
+        count = int(environ.get('LISTEN_FDS', ''))
+    except ValueError:
+        return []
+
+    names = environ.get('LISTEN_FDNAMES', '')
+    if unset:
+        for key in ['LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES']:
+            environ.pop(key, None)
+
+    if listen_pid != os.getpid() or count <= 0:
+        return []
+
+    names = names.split(':') if names else []
+    result = []
+    seen = set()
+    for index in range(count):
+        fd = LISTEN_FDS_START + index
+        name = names[index] if index < len(names) and names[index] not in ('', 'unknown') else 'fd{:d}'.format(fd)
+        if name in seen:
+            name = '{}.fd{:d}'.format(name, fd)
+        seen.add(name)
+
+        set_inheritable = getattr(os, 'set_inheritable', None)
+        if set_inheritable is not None:
+            set_inheritable(fd, False)
+
+        result.append((name, socket_from_fd(fd)))
+
+    return result
+
+
+def socket_from_fd(fd):
+    """ Return a socket object for the socket `fd`, or `fd` if not a socket.
+
+        The socket object takes over the descriptor itself, where the
+        Python version allows; otherwise it uses a duplicate.
+    """
+    if not stat.S_ISSOCK(os.fstat(fd).st_mode):
+        return fd
+
+    try:
+        return socket.socket(fileno=fd)
+    except TypeError:
+        # Python 2 cannot detect the family and type of the descriptor.
+        probe = socket.fromfd(fd, socket.AF_UNIX, socket.SOCK_STREAM)
+        family = probe.getsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_DOMAIN', 39))
+        kind = probe.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE)
+        probe.close()
+
+        sock = socket.fromfd(fd, family, kind)
+        os.close(fd)
+        return sock
+
+
+def format_socket_address(address):
+    """ Return a name for the socket `address`, such as ``'host:port'``. """
+    if isinstance(address, six.string_types):
+        return address
+
+    host, port = address[:2]
+    if ':' in host:
+        return '[{}]:{}'.format(host, port)
+    return '{}:{}'.format(host, port)
+
+
+def bind_listening_socket(address, backlog=128, reuse_port=False):
+    """ Return a new socket bound and listening on `address`.
+
+        `address` is a ``(host, port)`` tuple for a TCP socket, whose
+        host may be a name or an IPv4 or IPv6 address, or the path of a
+        Unix socket; a stale Unix socket file at that path is removed
+        first. If `reuse_port` is true, a TCP socket is created with
+        ``SO_REUSEPORT``, so that others may be bound to the same
+        address.
+    """
+    if isinstance(address, six.string_types):
+        family, bind_address = socket.AF_UNIX, address
+        try:
+            if stat.S_ISSOCK(os.lstat(address).st_mode):
+                os.unlink(address)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+    else:
+        host, port = address[:2]
+        family, _, _, _, bind_address = socket.getaddrinfo(
+            host or None, port, socket.AF_UNSPEC, socket.SOCK_STREAM, 0, socket.AI_PASSIVE)[0]
+
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if family != socket.AF_UNIX:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port and family != socket.AF_UNIX:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise DaemonOSEnvironmentError('System does not support SO_REUSEPORT')
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(bind_address)
+        sock.listen(backlog)
+    except socket.error as exc:
+        sock.close()
+        raise DaemonOSEnvironmentError('Unable to listen on {} ({!s})'.format(format_socket_address(address), exc))
+
+    return sock
+
+
+def change_process_owner(uid, gid):
+    """ Change the owning UID and GID of this process.
+
+        Sets the GID then the UID of the process (in that order, to
+        avoid permission errors) to the specified `gid` and `uid`
+        values. Requires appropriate OS privileges for this process.
+    """
+    try:
+        os.setgid(gid)
+        os.setuid(uid)
+    except OSError as exc:
+        raise DaemonOSEnvironmentError('Unable to change process owner ({!s}'.format(exc))
+
+
+PR_SET_CHILD_SUBREAPER = 36
+
+
+def set_child_subreaper(enable=True):
+    """ Make the current process a child subreaper, or stop it being one.
+
+        A child subreaper becomes the parent of any of its descendants
+        orphaned by their own parent's exit, instead of `init`. This
+        is specific to Linux, and is not inherited across `fork`.
+    """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        prctl = libc.prctl
+    except (ImportError, OSError, AttributeError):
+        raise DaemonOSEnvironmentError('System does not support child subreapers')
+
+    prctl.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+    prctl.restype = ctypes.c_int
+    if prctl(PR_SET_CHILD_SUBREAPER, 1 if enable else 0, 0, 0, 0) != 0:
+        error = ctypes.get_errno()
+        raise DaemonOSEnvironmentError('Unable to set child subreaper ({!s})'.format(os.strerror(error)))
+
+
+def prevent_core_dump():
+    """ Prevent this process from generating a core dump.
+
+        Sets the soft and hard limits for core dump size to zero. On
+        Unix, this prevents the process from creating core dump
+        altogether.
+    """
+    core_resource = resource.RLIMIT_CORE
+
+    try:
+        # Ensure the resource limit exists on this platform, by requesting
+        # its current value
+        resource.getrlimit(core_resource)
+    except ValueError as exc:
+        raise DaemonOSEnvironmentError('System does not support RLIMIT_CORE resource limit ({!s})'.format(exc))
+
+    # Set hard and soft limits to zero, i.e. no core dump at all
+    core_limit = (0, 0)
+    resource.setrlimit(core_resource, core_limit)
+
+
+detach_modes = ('single', 'double')
+
+
+def detach_process_context(mode='double'):
+    """ Detach the process context from parent and session.
+
+        Detach from the parent process and session group, allowing the
+        parent to exit while this process continues running.
+
+        With `mode` ``'double'``, fork a second time once in the new
+        session, so that the process is not a session leader and cannot
+        acquire a controlling terminal. With ``'single'``, the process
+        remains the leader of its new session, and the parent does not
+        wait for it: a parent that keeps running must reap it.
 
         Reference: “Advanced Programming in the Unix Environment”,
         section 13.3, by W. Richard Stevens, published 1993 by
         Addison-Wesley.
     """
 
-    def fork_then_exit_parent(error_message, second_fork=False):
+    def fork_then_exit_parent(error_message, second_fork=False, wait=True):
         """ Fork a child process, then exit the parent process.
 
             If the fork fails, raise a ``DaemonProcessDetachError``
@@ -641,16 +1958,252 @@ def detach_process_context():
                 if second_fork:
                     os._exit(0)
                 else:
-                    os.waitpid(pid, 0)
+                    if wait:
+                        os.waitpid(pid, 0)
                     sys.exit(0)
         except OSError as exc:
             raise DaemonProcessDetachError('{}: [{:d}] {}'.format(error_message, exc.errno, exc.strerror))
 
+    if mode not in detach_modes:
+        raise ValueError('Unknown detach mode: {}'.format(mode))
+
+    if mode == 'single':
+        fork_then_exit_parent(error_message='Failed fork', wait=False)
+        os.setsid()
+        return
+
     fork_then_exit_parent(error_message='Failed first fork')
     os.setsid()
     fork_then_exit_parent(error_message='Failed second fork', second_fork=True)
 
 
+def open_process_fd(pid):
+    """ Open a file descriptor referring to the process `pid`.
+
+        Returns the descriptor from `os.pidfd_open`, which becomes
+        readable when the process exits, or ``None`` if the system
+        does not support process file descriptors. Raises ``OSError``
+        with ``errno.ESRCH`` if there is no such process.
+    """
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:
+        return None
+
+    try:
+        return pidfd_open(pid)
+    except OSError as exc:
+        if exc.errno == errno.ESRCH:
+            raise
+        return None
+
+
+def is_process_running(pid):
+    """ Determine whether the process `pid` exists.
+
+        A process owned by another user exists even though it cannot
+        be signalled. A zombie process has already exited, so does not
+        count as existing; if it is a child of this process, it is
+        reaped.
+    """
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except OSError as exc:
+        if exc.errno != errno.ECHILD:
+            raise
+
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        if exc.errno == errno.ESRCH:
+            return False
+        if exc.errno != errno.EPERM:
+            raise
+
+    return read_process_state(pid) != 'Z'
+
+
+def _read_process_stat_fields(pid):
+    """ Return the fields of `/proc/<pid>/stat`, from the state onward.
+
+        Returns ``None`` if the file cannot be read.
+    """
+    try:
+        with open('/proc/{:d}/stat'.format(pid), 'rb') as fp:
+            stat_line = fp.read()
+    except (IOError, OSError):
+        return None
+
+    # The command name is in parentheses and may itself contain them.
+    return stat_line[stat_line.rfind(b')') + 2:].split()
+
+
+def read_process_state(pid):
+    """ Return the state letter of the process `pid` from `/proc`.
+
+        Returns ``None`` if the state cannot be read.
+    """
+    fields = _read_process_stat_fields(pid)
+    return fields[0].decode('ascii') if fields else None
+
+
+_boot_time = None
+
+
+def read_process_start_time(pid):
+    """ Return the time the process `pid` started, in seconds since the epoch.
+
+        Returns ``None`` if the start time cannot be read.
+    """
+    global _boot_time
+
+    fields = _read_process_stat_fields(pid)
+    if not fields or len(fields) < 20:
+        return None
+
+    if _boot_time is None:
+        try:
+            with open('/proc/stat', 'rb') as fp:
+                for line in fp:
+                    if line.startswith(b'btime '):
+                        _boot_time = int(line.split()[1])
+                        break
+        except (IOError, OSError):
+            return None
+        if _boot_time is None:
+            return None
+
+    # Field 22 of the file is the start time, in clock ticks since boot.
+    return _boot_time + int(fields[19]) / float(os.sysconf('SC_CLK_TCK'))
+
+
+class ProcessHandle(object):
+    """ Cached handle on the process named in a PID file.
+
+        The PID is read from the file at `path` with `read_pid`, and a
+        process file descriptor (see `open_process_fd`) is opened for
+        it. Both are kept until the file's inode or modification time
+        changes, so checking whether the process is alive costs one
+        `stat` and one `poll`.
+
+        A process that started after the PID file was written is a
+        different process that reused the PID, and is treated as not
+        running. Where process file descriptors are not supported,
+        the start time of the process is also compared on each check.
+
+        If there is no file at `path` (as with a lock which writes no
+        PID file), a PID once read is kept for as long as that process
+        runs, so that `read_pid` is not called on every check.
+    """
+
+    def __init__(self, path, read_pid):
+        """ Set up a new instance. """
+        self.path = path
+        self._read_pid = read_pid
+        self._key = None
+        self._pidfd = None
+        self.pid = 0
+        self.start_time = None
+        self._exited = False
+
+    def refresh(self):
+        """ Re-read the PID file, if it has changed since last read. """
+        try:
+            st = os.stat(self.path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            key = None
+        else:
+            key = (st.st_ino, getattr(st, 'st_mtime_ns', st.st_mtime))
+
+        if key is not None and key == self._key:
+            return
+        if key is None and self._key is None and self.pid and self.alive:
+            return
+
+        self.close()
+        self._key = None
+        self.pid = self._read_pid() or 0
+        self._exited = False
+        self.start_time = None
+
+        if self.pid:
+            try:
+                self._pidfd = open_process_fd(self.pid)
+            except OSError:
+                self._exited = True
+
+            self.start_time = read_process_start_time(self.pid)
+            if self.start_time is not None and key is not None and self.start_time > st.st_mtime + 1:
+                self._exited = True
+
+        self._key = key
+
+    @property
+    def alive(self):
+        """ ``True`` if the process is running. """
+        if not self.pid or self._exited:
+            return False
+
+        if self._pidfd is not None:
+            if select.select([self._pidfd], [], [], 0)[0]:
+                self._exited = True
+            return not self._exited
+
+        try:
+            running = is_process_running(self.pid)
+        except OSError:
+            return False
+
+        if running and self.start_time is not None:
+            running = read_process_start_time(self.pid) == self.start_time
+
+        return running
+
+    def close(self):
+        """ Close the process file descriptor, if open. """
+        if self._pidfd is not None:
+            os.close(self._pidfd)
+            self._pidfd = None
+
+
+def wait_for_process_exit(pid, timeout=None):
+    """ Wait for the process `pid` to exit.
+
+        Returns ``True`` once the process has exited, or ``False`` if
+        it is still running after `timeout` seconds (if not ``None``).
+
+        Where supported, this blocks on a process file descriptor and
+        returns as soon as the process exits. Otherwise it polls with
+        `is_process_running`, backing off from one millisecond to a
+        tenth of a second between checks.
+    """
+    try:
+        pidfd = open_process_fd(pid)
+    except OSError:
+        return True
+
+    if pidfd is not None:
+        try:
+            return bool(select.select([pidfd], [], [], timeout)[0])
+        finally:
+            os.close(pidfd)
+
+    deadline = None if timeout is None else _monotonic() + timeout
+    delay = 0.001
+    while is_process_running(pid):
+        if deadline is not None:
+            remaining = deadline - _monotonic()
+            if remaining <= 0:
+                return False
+            delay = min(delay, remaining)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.1)
+
+    return True
+
+
 def is_process_started_by_init():
     """ Determine if the current process is started by `init`.
 
@@ -667,20 +2220,15 @@ def is_process_started_by_init():
 def is_socket(fd):
     """ Determine if the file descriptor is a socket.
 
-        Return ``False`` if querying the socket type of `fd` raises an
-        error; otherwise return ``True``.
+        Return ``False`` if `fd` is not open, or is open on anything
+        other than a socket; otherwise return ``True``.
     """
-    file_socket = socket.fromfd(fd, socket.AF_INET, socket.SOCK_RAW)
-
     try:
-        file_socket.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE)
-    except socket.error as exc:
-        exc_errno = exc.args[0]
-        if exc_errno == errno.ENOTSOCK:
-            # Socket operation on non-socket
-            return False
+        mode = os.fstat(fd).st_mode
+    except OSError:
+        return False
 
-    return True
+    return stat.S_ISSOCK(mode)
 
 
 def is_process_started_by_superserver():
@@ -704,21 +2252,170 @@ def is_process_started_by_superserver():
     return False
 
 
-def is_detach_process_context_required():
-    """ Determine whether detaching process context is required.
+def is_process_socket_activated():
+    """ Determine if the current process was passed sockets to serve.
 
-        Return ``True`` if the process environment indicates the
-        process is already detached:
+        Return ``True`` if `LISTEN_PID` names this process, as set by a
+        service manager under the socket activation protocol (see
+        `read_listen_fds`), otherwise ``False``.
+    """
+    try:
+        listen_pid = int(os.environ.get('LISTEN_PID', ''))
+    except ValueError:
+        return False
+
+    return listen_pid == os.getpid()
 
-        * Process was started by `init`; or
 
-        * Process was started by `inetd`.
+def is_process_group_leader():
+    """ Determine if the current process is the leader of its process group.
+
+        Return ``True`` if the process group ID is the process ID,
+        otherwise ``False``.
     """
-    if is_process_started_by_init() or is_process_started_by_superserver():
-        return False
+    return os.getpgrp() == os.getpid()
+
 
+def has_controlling_terminal():
+    """ Determine if the current process has a controlling terminal.
+
+        Return ``False`` if opening ``/dev/tty`` reports that there is
+        none; otherwise, including when that cannot be told, ``True``.
+    """
+    try:
+        fd = os.open('/dev/tty', os.O_RDWR | os.O_NOCTTY)
+    except OSError as exc:
+        return exc.errno != errno.ENXIO
+
+    os.close(fd)
     return True
 
+
+def is_process_service_main():
+    """ Determine if the current process is the main process of a service.
+
+        A service manager passes `NOTIFY_SOCKET` to the process it
+        starts, but every descendant of that process inherits it too.
+        Return ``True`` only if `NOTIFY_SOCKET` is set and either the
+        parent process is `init`, or `LISTEN_PID` names this process;
+        otherwise ``False``.
+    """
+    if not os.environ.get('NOTIFY_SOCKET'):
+        return False
+
+    return is_process_started_by_init() or is_process_socket_activated()
+
+
+class ProcessEnvironment(object):
+    """ How the current process was started, as far as it can tell.
+
+        * `started_by_init`: The parent process is `init`.
+        * `started_by_superserver`: Standard input is a socket, as
+          passed by `inetd`.
+        * `container_init`: The process is the first process of its PID
+          namespace, typically of a container.
+        * `notify_socket`: A service manager passed `NOTIFY_SOCKET`, to
+          be told when the service is ready, and this process is the
+          main process of the service (see `is_process_service_main`).
+        * `socket_activated`: A service manager passed sockets meant
+          for this process, as named by `LISTEN_PID`.
+        * `process_group_leader`: The process leads its process group,
+          so cannot start a new session without forking.
+        * `controlling_terminal`: The process has a controlling
+          terminal.
+
+        Only these are taken to mean that the process is already
+        managed. Other variables a service manager or supervisor sets,
+        such as ``INVOCATION_ID``, are inherited by every descendant
+        (including a shell, and whatever is started from it), so they
+        do not tell whether this process was started by one; nor does
+        `NOTIFY_SOCKET` on its own.
+
+        `detach_mode` is the way to detach in that environment, as for
+        `DaemonContext.detach_process`.
+    """
+
+    def __init__(self, started_by_init=False, started_by_superserver=False, container_init=False,
+                 notify_socket=False, socket_activated=False, process_group_leader=True,
+                 controlling_terminal=True):
+        """ Set up a new instance. """
+        self.started_by_init = started_by_init
+        self.started_by_superserver = started_by_superserver
+        self.container_init = container_init
+        self.notify_socket = notify_socket
+        self.socket_activated = socket_activated
+        self.process_group_leader = process_group_leader
+        self.controlling_terminal = controlling_terminal
+
+    def __repr__(self):
+        return '<{}: detach_mode {}>'.format(self.__class__.__name__, self.detach_mode)
+
+    @property
+    def detach_mode(self):
+        """ The way to detach in this environment.
+
+            ``'none'`` if detaching is redundant. Otherwise ``'single'``
+            if the process neither leads its process group nor has a
+            controlling terminal: its child, as leader of a new session
+            with no terminal involved, need not fork again. Otherwise
+            ``'double'``.
+        """
+        if (self.started_by_init or self.started_by_superserver or self.container_init
+                or self.notify_socket or self.socket_activated):
+            return 'none'
+        if not (self.process_group_leader or self.controlling_terminal):
+            return 'single'
+        return 'double'
+
+    def as_dict(self):
+        """ Return the detected properties and `detach_mode` as a dict. """
+        return {
+            'started_by_init': self.started_by_init,
+            'started_by_superserver': self.started_by_superserver,
+            'container_init': self.container_init,
+            'notify_socket': self.notify_socket,
+            'socket_activated': self.socket_activated,
+            'process_group_leader': self.process_group_leader,
+            'controlling_terminal': self.controlling_terminal,
+            'detach_mode': self.detach_mode,
+        }
+
+
+_process_environment = None
+
+
+def detect_process_environment(refresh=False):
+    """ Return the `ProcessEnvironment` of the current process.
+
+        The environment is detected once and cached, until the process
+        forks or `refresh` is true.
+    """
+    global _process_environment
+
+    pid = os.getpid()
+    if refresh or _process_environment is None or _process_environment[0] != pid:
+        environment = ProcessEnvironment(
+            started_by_init=is_process_started_by_init(),
+            started_by_superserver=is_process_started_by_superserver(),
+            container_init=pid == 1,
+            notify_socket=is_process_service_main(),
+            socket_activated=is_process_socket_activated(),
+            process_group_leader=is_process_group_leader(),
+            controlling_terminal=has_controlling_terminal(),
+        )
+        _process_environment = (pid, environment)
+
+    return _process_environment[1]
+
+
+def is_detach_process_context_required():
+    """ Determine whether detaching process context is required.
+
+        Return ``False`` if the process environment indicates the
+        process need not detach; see `ProcessEnvironment.detach_mode`.
+    """
+    return detect_process_environment().detach_mode != 'none'
+
 
 def close_file_descriptor_if_open(fd, check_fd_urandom):
     """ Close a file descriptor if already open.
@@ -739,6 +2436,84 @@ def close_file_descriptor_if_open(fd, check_fd_urandom):
             raise DaemonOSEnvironmentError('Failed to close file descriptor {:d} ({!s})'.format(fd, exc))
 
 
+def trim_malloc_heap():
+    """ Return unused memory of the C heap to the system.
+
+        Uses the GNU C library's `malloc_trim`; returns ``False`` if
+        that is not available.
+    """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None)
+    except (ImportError, OSError):
+        return False
+
+    malloc_trim = getattr(libc, 'malloc_trim', None)
+    if malloc_trim is None:
+        return False
+
+    malloc_trim.argtypes = [ctypes.c_size_t]
+    malloc_trim(0)
+    return True
+
+
+def prepare_for_fork(malloc_trim=False):
+    """ Make the process's memory as shareable as possible by its forks.
+
+        Collects garbage, then (from Python 3.7) moves every surviving
+        object to the garbage collector's permanent generation with
+        `gc.freeze`, so that collections in forked processes do not
+        write to, and thereby copy, the pages they live on. If
+        `malloc_trim` is true, also calls `trim_malloc_heap`.
+    """
+    gc.collect()
+    freeze = getattr(gc, 'freeze', None)
+    if freeze is not None:
+        freeze()
+
+    if malloc_trim:
+        trim_malloc_heap()
+
+
+def read_memory_usage(pid=None):
+    """ Return the memory usage of process `pid` (by default, this one).
+
+        Returns a dict of sizes in bytes: ``'rss'`` (resident),
+        ``'shared'`` (resident pages shared with other processes) and,
+        where the system reports them, ``'pss'`` (proportional share)
+        and ``'private'`` (unique to the process, or USS). Returns
+        ``None`` if the process's `/proc` entry cannot be read.
+    """
+    base = '/proc/{}'.format('self' if pid is None else pid)
+
+    fields = {
+        'Rss': 'rss', 'Pss': 'pss',
+        'Shared_Clean': 'shared', 'Shared_Dirty': 'shared',
+        'Private_Clean': 'private', 'Private_Dirty': 'private',
+    }
+    try:
+        with open(base + '/smaps_rollup') as fp:
+            usage = {}
+            for line in fp:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].rstrip(':') in fields:
+                    key = fields[parts[0].rstrip(':')]
+                    usage[key] = usage.get(key, 0) + int(parts[1]) * 1024
+            if usage:
+                return usage
+    except (IOError, OSError, ValueError):
+        pass
+
+    try:
+        with open(base + '/statm') as fp:
+            _, resident, shared = [int(value) for value in fp.read().split()[:3]]
+    except (IOError, OSError, ValueError):
+        return None
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    return {'rss': resident * page_size, 'shared': shared * page_size}
+
+
 MAXFD = 2048
 
 def get_maximum_file_descriptors():
@@ -757,19 +2532,198 @@ def get_maximum_file_descriptors():
     return maxfd
 
 
-def close_all_open_files(exclude=set()):
-    """ Close all open file descriptors.
+def _iter_file_descriptor_gaps(exclude, upper):
+    """ Iterate over the ranges of file descriptors not in `exclude`.
 
-        Closes every file descriptor (if open) of this process. If
-        specified, `exclude` is a set of file descriptors to *not*
-        close.
+        Yields ``(low, high)`` pairs, inclusive at both ends, covering
+        every file descriptor from zero up to (but not including)
+        `upper` that is not a member of `exclude`.
+    """
+    low = 0
+    for fd in sorted(fd for fd in exclude if 0 <= fd < upper):
+        if fd > low:
+            yield low, fd - 1
+        low = fd + 1
+
+    if low < upper:
+        yield low, upper - 1
+
+
+def _get_libc_close_range():
+    """ Return the C library `close_range` function, or ``None``. """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+    except (ImportError, OSError):
+        return None
+
+    close_range = getattr(libc, 'close_range', None)
+    if close_range is None:
+        return None
+
+    close_range.argtypes = [ctypes.c_uint, ctypes.c_uint, ctypes.c_int]
+    close_range.restype = ctypes.c_int
+
+    # Probe an empty range; kernels without the system call fail with ENOSYS.
+    if close_range(CLOSE_RANGE_MAXFD, CLOSE_RANGE_MAXFD, 0) != 0:
+        return None
+
+    return close_range
+
+
+def close_fds_with_close_range(exclude, maxfd):
+    """ Close open file descriptors via the `close_range(2)` system call.
+
+        Issues one system call for each gap in `exclude`; the last gap
+        extends to the highest possible descriptor, regardless of
+        `maxfd`. The number of descriptors closed is not known, so
+        returns ``None``.
+    """
+    close_range = _get_libc_close_range()
+    if close_range is None:
+        raise DaemonOSEnvironmentError('System does not support close_range')
+
+    for low, high in _iter_file_descriptor_gaps(exclude, CLOSE_RANGE_MAXFD + 1):
+        if close_range(low, high, 0) != 0:
+            import ctypes
+            exc_errno = ctypes.get_errno()
+            raise DaemonOSEnvironmentError('Failed to close file descriptors {:d}-{:d} ({!s})'.format(
+                low, high, os.strerror(exc_errno)))
+
+    return None
+
+
+def close_fds_with_proc(exclude, maxfd):
+    """ Close open file descriptors listed in the process's `/proc` entry.
+
+        Only the descriptors that are actually open are closed, so the
+        cost is proportional to the number of open files rather than
+        to the resource limit. Returns the number of descriptors
+        closed.
+    """
+    closed = 0
+    # The directory listing itself uses a descriptor, which is already
+    # closed again by the time it is seen here; `EBADF` is expected.
+    for name in os.listdir(PROC_FD_DIRECTORY):
+        fd = int(name)
+        if fd in exclude:
+            continue
+
+        try:
+            os.close(fd)
+        except OSError as exc:
+            if exc.errno != errno.EBADF:
+                raise DaemonOSEnvironmentError('Failed to close file descriptor {:d} ({!s})'.format(fd, exc))
+        else:
+            closed += 1
+
+    return closed
+
+
+def close_fds_with_closerange(exclude, maxfd):
+    """ Close open file descriptors via `os.closerange`.
+
+        Calls `os.closerange` once for each gap in `exclude` below
+        `maxfd`. The number of descriptors closed is not known, so
+        returns ``None``.
+    """
+    for low, high in _iter_file_descriptor_gaps(exclude, maxfd):
+        os.closerange(low, high + 1)
+
+    return None
+
+
+def close_fds_with_sweep(exclude, maxfd):
+    """ Close open file descriptors by trying every one below `maxfd`.
+
+        This is the original, slow behaviour; it is required on
+        Python 3.4.0, where `os.urandom` keeps a descriptor open that
+        must survive. Returns ``None``.
     """
-    maxfd = get_maximum_file_descriptors()
     check_fd_urandom = os.open("/dev/urandom", os.O_RDONLY) if sys.version_info[0:3] == (3, 4, 0) else None
     for fd in reversed(range(maxfd)):
         if fd not in exclude:
             close_file_descriptor_if_open(fd, check_fd_urandom)
 
+    return None
+
+
+CLOSE_RANGE_MAXFD = 0xffffffff
+PROC_FD_DIRECTORY = '/proc/self/fd'
+
+close_fds_strategies = {
+    'close_range': close_fds_with_close_range,
+    'proc': close_fds_with_proc,
+    'closerange': close_fds_with_closerange,
+    'sweep': close_fds_with_sweep,
+}
+
+_close_fds_strategy = None
+
+
+def get_close_fds_strategy():
+    """ Return the name of the fastest file closing strategy available.
+
+        The strategies are checked in order of preference: the
+        `close_range` system call, the `/proc` file descriptor
+        listing, then `os.closerange`. The result is determined once
+        and cached for the life of the process.
+    """
+    global _close_fds_strategy
+
+    if _close_fds_strategy is None:
+        if sys.version_info[0:3] == (3, 4, 0):
+            _close_fds_strategy = 'sweep'
+        elif _get_libc_close_range() is not None:
+            _close_fds_strategy = 'close_range'
+        elif os.path.isdir(PROC_FD_DIRECTORY):
+            _close_fds_strategy = 'proc'
+        else:
+            _close_fds_strategy = 'closerange'
+
+    return _close_fds_strategy
+
+
+def count_open_file_descriptors():
+    """ Return the number of open file descriptors of this process.
+
+        Returns ``None`` if the system has no `/proc` listing of open
+        file descriptors.
+    """
+    try:
+        # Less one for the descriptor used to read the listing.
+        return len(os.listdir(PROC_FD_DIRECTORY)) - 1
+    except OSError:
+        return None
+
+
+def close_all_open_files(exclude=set(), strategy=None):
+    """ Close all open file descriptors.
+
+        Closes every file descriptor (if open) of this process. If
+        specified, `exclude` is a set of file descriptors to *not*
+        close.
+
+        `strategy` selects how the descriptors are found and closed:
+        either the name of an entry in `close_fds_strategies`, or a
+        callable accepting `exclude` and the maximum file descriptor
+        count. If ``None``, the result of `get_close_fds_strategy` is
+        used.
+
+        Returns the number of file descriptors closed, or ``None`` if
+        the strategy cannot tell.
+    """
+    if strategy is None:
+        strategy = get_close_fds_strategy()
+
+    if isinstance(strategy, six.string_types):
+        try:
+            strategy = close_fds_strategies[strategy]
+        except KeyError:
+            raise ValueError('Unknown file closing strategy: {}'.format(strategy))
+
+    return strategy(set(exclude), get_maximum_file_descriptors())
+
 
 def set_std(destination, default, mode):
     attr_check = _default_std_info[mode]['attr']
@@ -786,6 +2740,20 @@ def set_std(destination, default, mode):
     return open(destination, mode, buffering=buffering) if isinstance(destination, six.string_types) and destination else get_default()
 
 
+def flush_system_streams():
+    """ Flush `sys.stdout` and `sys.stderr`, ignoring any errors. """
+    for name in ['stdout', 'stderr']:
+        stream = getattr(sys, name)
+        if stream is None:
+            continue
+
+        try:
+            stream.flush()
+        except (IOError, OSError, ValueError, RuntimeError):
+            # RuntimeError: reentrant call, from a signal handler.
+            pass
+
+
 def redirect_stream(name, target_stream):
     """ Redirect a system stream to a specified file.
 
@@ -834,6 +2802,39 @@ def make_default_signal_map():
     )
 
 
+def get_exit_status(exc):
+    """ Return the process exit status for the `SystemExit` `exc`.
+
+        As for the interpreter itself, a code of ``None`` means
+        success, and any other non-integer (such as a message) means
+        failure; the message is printed to `sys.stderr`.
+    """
+    code = exc.code
+    if code is None:
+        return 0
+    if isinstance(code, six.integer_types):
+        return code
+
+    try:
+        print(code, file=sys.stderr)
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    return 1
+
+
+def reset_signal_wakeup_fd():
+    """ Stop writing signal numbers to any signal wakeup file descriptor. """
+    set_wakeup_fd = getattr(signal, 'set_wakeup_fd', None)
+    if set_wakeup_fd is None:
+        return
+
+    try:
+        set_wakeup_fd(-1)
+    except ValueError:
+        # Not the main thread, which is the only one that can set it.
+        pass
+
+
 def set_signal_handlers(signal_handler_map):
     """ Set the signal handlers as specified.
 
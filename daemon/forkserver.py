@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+# daemon/forkserver.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Spawning daemons by forking an already running daemon.
+
+    Starting a daemon the usual way pays for the whole of
+    `DaemonContext.open` each time: two forks, closing every file
+    descriptor, and importing the application. A `ForkServer` runs in a
+    daemon process which has done all that once, with the application
+    modules preloaded; each spawn request received on its Unix socket
+    is served by a single fork, which is already a daemon.
+
+    A `ForkServerClient` sends the requests: each names a callable, as
+    a ``'module:attribute'`` reference, and the JSON arguments to call
+    it with. The forked process reports its PID back directly once it
+    is set up, or the error which prevented it.
+
+    Start a server with `start_fork_server`, or from the command line
+    with ``python -m daemon.forkserver serve PATH``. Compare spawn
+    latencies with ``benchmarks/forkserver.py`` in the source tree.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import argparse
+import errno
+import importlib
+import os
+import signal
+import socket
+import sys
+import traceback
+
+from setproctitle import setproctitle
+
+from .daemon import flush_system_streams, get_exit_status, prepare_for_fork, reset_signal_wakeup_fd
+from .handoff import HandoffError, bind_unix_socket, is_peer_trusted, receive_message, send_message
+from .reaper import ChildReaper
+from .runner import import_callable
+from .workers import clear_exit_handlers
+
+
+class ForkServerError(Exception):
+    """ Exception raised when the fork server fails to spawn a daemon. """
+
+
+class ForkServer(object):
+    """ Server spawning daemons by forking the current daemon process.
+
+        Call in a daemon process, whose context the spawned processes
+        share: working directory, file creation mask, owner, and
+        standard streams. `path` is the Unix socket to serve on,
+        accessible to its owner only; a client running as another user
+        (other than the superuser) is not served. The modules named in
+        `preload_modules` are imported before serving, and the memory
+        prepared to be shared with the spawned processes.
+
+        Each spawned process starts a new session, and is reaped by
+        the server when it exits; `reaper` records their exit statuses.
+        `after_fork`, if given, is called first thing in each spawned
+        process, such as to close descriptors it must not keep.
+
+        Requests are served one at a time; a client which sends no
+        complete request within `timeout` seconds is dropped, so that
+        it does not hold up the others.
+    """
+
+    def __init__(self, path, preload_modules=(), after_fork=None, timeout=1.0):
+        """ Set up a new instance. """
+        self.path = path
+        self.preload_modules = list(preload_modules)
+        self.after_fork = after_fork
+        self.timeout = timeout
+        self.socket = None
+        self.reaper = ChildReaper()
+        self.spawned = 0
+        self.failed = 0
+        self._inode = None
+
+    def start(self):
+        """ Preload the modules, and start listening on `path`. """
+        for name in self.preload_modules:
+            importlib.import_module(name)
+        prepare_for_fork()
+
+        self.socket, self._inode = bind_unix_socket(self.path, 128)
+
+        signal.signal(signal.SIGCHLD, self.reaper)
+
+    def serve_forever(self):
+        """ Serve spawn requests until the process is told to exit. """
+        if self.socket is None:
+            self.start()
+
+        try:
+            while True:
+                try:
+                    conn, _ = self.socket.accept()
+                except (socket.error, OSError) as exc:
+                    if exc.errno == errno.EINTR:
+                        continue
+                    raise
+
+                conn.settimeout(self.timeout)
+                try:
+                    if is_peer_trusted(conn):
+                        self._handle(conn)
+                except (socket.error, OSError, HandoffError, ValueError):
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            self.close()
+
+    def _handle(self, conn):
+        """ Serve one request from `conn`. """
+        message, _ = receive_message(conn)
+        if message is None:
+            return
+
+        command = message.get('command')
+        if command == 'ping':
+            send_message(conn, {'pid': os.getpid()})
+        elif command == 'status':
+            send_message(conn, self.as_dict())
+        elif command == 'spawn':
+            self._spawn(conn, message)
+        else:
+            send_message(conn, {'error': 'Unknown command: {}'.format(command)})
+
+    def _spawn(self, conn, message):
+        """ Fork a process to call the target of a spawn request. """
+        try:
+            target = import_callable(message['target'])
+            args = list(message.get('args', []))
+            kwargs = dict(message.get('kwargs', {}))
+        except Exception as exc:
+            self.failed += 1
+            send_message(conn, {'error': '{}: {!s}'.format(type(exc).__name__, exc)})
+            return
+
+        pid = os.fork()
+        if pid != 0:
+            self.spawned += 1
+            return
+
+        status = 1
+        try:
+            self.socket.close()
+            if self.after_fork is not None:
+                self.after_fork()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            reset_signal_wakeup_fd()
+            clear_exit_handlers()
+            os.setsid()
+            if message.get('process_name'):
+                setproctitle(message['process_name'])
+
+            send_message(conn, {'pid': os.getpid()})
+            conn.close()
+
+            status = target(*args, **kwargs) or 0
+        except SystemExit as exc:
+            status = get_exit_status(exc)
+        except BaseException as exc:
+            traceback.print_exc()
+            try:
+                send_message(conn, {'error': '{}: {!s}'.format(type(exc).__name__, exc)})
+            except (socket.error, OSError):
+                pass
+        finally:
+            flush_system_streams()
+            os._exit(status)
+
+    def close(self):
+        """ Stop listening, and remove the socket file. """
+        if self.socket is None:
+            return
+
+        self.socket.close()
+        self.socket = None
+        try:
+            if os.lstat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+    def as_dict(self):
+        """ Return the counts of processes spawned and failed, and reaped. """
+        return {
+            'pid': os.getpid(),
+            'spawned': self.spawned,
+            'failed': self.failed,
+            'reaped': self.reaper.as_dict(),
+        }
+
+
+class ForkServerClient(object):
+    """ Client asking a `ForkServer` to spawn daemons. """
+
+    def __init__(self, path, timeout=None):
+        """ Set up a new instance. """
+        self.path = path
+        self.timeout = timeout
+
+    def _request(self, message, timeout=None):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout if timeout is None else timeout)
+        try:
+            try:
+                sock.connect(self.path)
+                send_message(sock, message)
+                reply, _ = receive_message(sock)
+            except socket.timeout:
+                raise ForkServerError('No reply from fork server at {}'.format(self.path))
+            except (socket.error, OSError) as exc:
+                raise ForkServerError('Fork server at {} unavailable ({!s})'.format(self.path, exc))
+        finally:
+            sock.close()
+
+        if reply is None:
+            raise ForkServerError('Spawned process exited before becoming ready')
+        if 'error' in reply:
+            raise ForkServerError(reply['error'])
+        return reply
+
+    def spawn(self, target, args=(), kwargs=None, process_name=None, ready_timeout=None):
+        """ Spawn a daemon process calling ``target(*args, **kwargs)``.
+
+            `target` is a ``'module:attribute'`` reference, and the
+            arguments must be serialisable as JSON. Returns the PID of
+            the new process once it is set up. Raises `ForkServerError`
+            if the server could not spawn it, or no reply came within
+            `ready_timeout` seconds.
+        """
+        message = {
+            'command': 'spawn',
+            'target': target,
+            'args': list(args),
+            'kwargs': kwargs or {},
+            'process_name': process_name,
+        }
+        return self._request(message, ready_timeout)['pid']
+
+    def ping(self):
+        """ Return the PID of the fork server. """
+        return self._request({'command': 'ping'})['pid']
+
+    def status(self):
+        """ Return the counts of the fork server, as `ForkServer.as_dict`. """
+        return self._request({'command': 'status'})
+
+
+def start_fork_server(path, preload_modules=(), ready_timeout=None, **runner_kwargs):
+    """ Start a daemon serving a `ForkServer` on `path`.
+
+        The daemon is started with `create_daemon`, given
+        `runner_kwargs`; returns its PID once it is serving.
+    """
+    from . import create_daemon
+
+    def run(runner):
+        server = ForkServer(path, preload_modules, after_fork=runner.daemon_context.close_after_fork)
+        server.start()
+        runner.notify_ready()
+        server.serve_forever()
+
+    runner_kwargs.setdefault('force_detach', True)
+    runner = create_daemon(run, ready_on_open=False, **runner_kwargs)
+    return runner.start(wait_ready=True, ready_timeout=ready_timeout)
+
+
+def main(argv=None):
+    """ Serve a fork server from the command line.
+
+        Usage: ``python -m daemon.forkserver serve PATH [--preload MODULE]...``
+        daemonizes a fork server and prints its PID.
+    """
+    parser = argparse.ArgumentParser(prog='python -m daemon.forkserver', description='Spawn daemons by forking.')
+    subparsers = parser.add_subparsers(dest='action')
+    serve_parser = subparsers.add_parser('serve', help='start a fork server daemon')
+    serve_parser.add_argument('path', help='Unix socket to serve on')
+    serve_parser.add_argument('--pidfile', help='PID file of the fork server')
+    serve_parser.add_argument('--preload', action='append', default=[], metavar='MODULE',
+                              help='module to import before serving')
+    args = parser.parse_args(argv)
+
+    if args.action == 'serve':
+        pidfile = os.path.abspath(args.pidfile) if args.pidfile else None
+        print(start_fork_server(os.path.abspath(args.path), args.preload, ready_timeout=30, pidfile=pidfile))
+    else:
+        parser.error('an action is required')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
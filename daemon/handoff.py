@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+# daemon/handoff.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Handing listening sockets from a running daemon to its successor.
+
+    The running daemon serves a `HandoffServer` on a Unix socket. A
+    successor connects with a `HandoffClient` and, in order:
+
+    * receives the daemon's listening sockets, passed with
+      ``SCM_RIGHTS`` so that they stay open throughout;
+
+    * asks the daemon to release its PID file, so the successor can
+      take it over;
+
+    * once it is ready, tells the daemon to drain and exit.
+
+    If the successor disconnects before that last step, the daemon
+    takes its PID file back and carries on.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import array
+import errno
+import json
+import os
+import socket
+import stat
+import struct
+import threading
+
+
+class HandoffError(Exception):
+    """ Exception raised when a socket handoff fails. """
+
+
+_header = struct.Struct('!I')
+
+
+def _check_fd_passing():
+    if not hasattr(socket.socket, 'sendmsg'):
+        raise HandoffError('Passing file descriptors is not supported on this system')
+
+
+def send_message(sock, message, fds=()):
+    """ Send a JSON `message`, with the file descriptors `fds` attached. """
+    data = json.dumps(message).encode('utf-8')
+    data = _header.pack(len(data)) + data
+
+    ancillary = []
+    if fds:
+        ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds).tobytes()))
+
+    sent = sock.sendmsg([data], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def receive_message(sock, maxfds=0):
+    """ Receive a JSON message, and up to `maxfds` attached file descriptors.
+
+        Returns ``(message, fds)``; `message` is ``None`` if the peer
+        closed the connection.
+    """
+    fds = array.array('i')
+    ancillary_size = socket.CMSG_LEN(maxfds * fds.itemsize) if maxfds else 0
+    data, ancillary, _, _ = sock.recvmsg(65536, ancillary_size)
+
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - (len(payload) % fds.itemsize)])
+
+    if not data:
+        return None, list(fds)
+
+    while len(data) < _header.size or len(data) < _header.size + _header.unpack(data[:_header.size])[0]:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise HandoffError('Connection closed in the middle of a message')
+        data += chunk
+
+    size = _header.unpack(data[:_header.size])[0]
+    return json.loads(data[_header.size:_header.size + size].decode('utf-8')), list(fds)
+
+
+def bind_unix_socket(path, backlog):
+    """ Listen on a new Unix socket at `path`, accessible to its owner only.
+
+        A socket file left at `path` is replaced. The socket is bound
+        under a file creation mask which keeps it private, so it is
+        never open to other users, even briefly. Returns the listening
+        socket and the inode of its file.
+    """
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(old_umask)
+        inode = os.lstat(path).st_ino
+        sock.listen(backlog)
+    except BaseException:
+        sock.close()
+        raise
+
+    return sock, inode
+
+
+_peer_credentials = struct.Struct('3i')
+
+
+def is_peer_trusted(conn):
+    """ Determine whether the peer of `conn` may be served.
+
+        Return ``True`` if the peer process runs as the same user as
+        this process, or as the superuser, otherwise ``False``. Where
+        the peer's credentials are not available, the permissions of
+        the socket file are relied on, and ``True`` is returned.
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+
+    try:
+        credentials = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, _peer_credentials.size)
+    except (socket.error, OSError):
+        return False
+
+    _, uid, _ = _peer_credentials.unpack(credentials)
+    return uid in (0, os.geteuid())
+
+
+def _fileno(item):
+    """ Return the file descriptor of a socket, or `item` itself. """
+    if hasattr(item, 'fileno'):
+        return item.fileno()
+    return item
+
+
+class HandoffServer(object):
+    """ Server in a running daemon handing its listening sockets to a successor.
+
+        `sockets` maps names to the sockets (or file descriptors) to
+        hand over. `on_release` is called to release the PID file,
+        `on_reacquire` to take it back if the successor gives up, and
+        `on_drain` once the successor is ready.
+
+        Only a successor running as the same user (or the superuser)
+        is served; see `is_peer_trusted`. Successors are served one at
+        a time, so one which sends nothing for `timeout` seconds is
+        dropped, and the next served; except once the PID file is
+        released, while the successor starts up.
+    """
+
+    def __init__(self, path, sockets, on_release, on_reacquire, on_drain, timeout=10.0):
+        """ Set up a new instance. """
+        _check_fd_passing()
+        self.path = path
+        self.sockets = sockets
+        self.on_release = on_release
+        self.on_reacquire = on_reacquire
+        self.on_drain = on_drain
+        self.timeout = timeout
+        self.socket = None
+        self._inode = None
+        self._thread = None
+
+    def start(self):
+        """ Start listening for a successor in a background thread. """
+        self.socket, self._inode = bind_unix_socket(self.path, 8)
+
+        self._thread = threading.Thread(target=self._serve, name='daemon-handoff')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except (socket.error, OSError, AttributeError):
+                return
+
+            conn.settimeout(self.timeout)
+            try:
+                if is_peer_trusted(conn) and self._handle(conn):
+                    return
+            except (socket.timeout, socket.error, OSError, HandoffError, ValueError):
+                pass
+            finally:
+                conn.close()
+
+    def _handle(self, conn):
+        """ Serve one successor; return ``True`` once it has taken over. """
+        released = False
+        try:
+            while True:
+                message, _ = receive_message(conn)
+                if message is None:
+                    return False
+
+                command = message.get('command')
+                if command == 'sockets':
+                    names = sorted(self.sockets)
+                    fds = [_fileno(self.sockets[name]) for name in names]
+                    send_message(conn, {'names': names}, fds)
+                elif command == 'release':
+                    self.on_release()
+                    released = True
+                    send_message(conn, {'ok': True})
+                    # The successor starts up before asking to drain.
+                    conn.settimeout(None)
+                elif command == 'drain':
+                    send_message(conn, {'ok': True})
+                    released = False
+                    self.close()
+                    self.on_drain()
+                    return True
+                else:
+                    send_message(conn, {'error': 'Unknown command: {}'.format(command)})
+        finally:
+            if released:
+                self.on_reacquire()
+
+    def close(self):
+        """ Stop listening, and remove the socket file.
+
+            The file is left alone if a successor has already replaced
+            it with its own.
+        """
+        if self.socket is None:
+            return
+
+        self.socket.close()
+        self.socket = None
+        try:
+            if os.lstat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class HandoffClient(object):
+    """ Client in a successor, taking over from a running daemon. """
+
+    def __init__(self, path, timeout=None):
+        """ Set up a new instance. """
+        _check_fd_passing()
+        self.path = path
+        self.timeout = timeout
+        self.socket = None
+
+    def connect(self):
+        """ Connect to the running daemon; return ``False`` if there is none. """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except (socket.error, OSError):
+            sock.close()
+            return False
+
+        self.socket = sock
+        return True
+
+    def fileno(self):
+        """ Return the file descriptor of the connection. """
+        return self.socket.fileno()
+
+    def _request(self, command, maxfds=0):
+        send_message(self.socket, {'command': command})
+        message, fds = receive_message(self.socket, maxfds)
+        if message is None:
+            raise HandoffError('Running daemon closed the connection')
+        if 'error' in message:
+            raise HandoffError(message['error'])
+        return message, fds
+
+    def receive_sockets(self, maxfds=64):
+        """ Receive the running daemon's sockets, as a dict by name. """
+        message, fds = self._request('sockets', maxfds)
+        names = message.get('names', [])
+        if len(names) != len(fds):
+            for fd in fds:
+                os.close(fd)
+            raise HandoffError('Expected {:d} sockets, received {:d}'.format(len(names), len(fds)))
+
+        # The socket family and type are detected from the descriptor.
+        return dict((name, socket.socket(fileno=fd)) for name, fd in zip(names, fds))
+
+    def release_pidfile(self):
+        """ Ask the running daemon to release its PID file. """
+        self._request('release')
+
+    def drain(self):
+        """ Tell the running daemon to drain and exit. """
+        self._request('drain')
+
+    def close(self):
+        """ Close the connection. """
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+# daemon/metrics.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Runtime metrics of a daemon process.
+
+    `DaemonMetrics` reads the state of the daemon process and of the
+    parts of `DaemonContext` in use: memory, CPU time, open files,
+    threads, garbage collection, signals, reaped children, restarted
+    workers and buffered output. Nothing is recorded in advance; each
+    figure is read when the metrics are collected, so they cost nothing
+    until someone asks for them.
+
+    The metrics are rendered in the Prometheus text exposition format,
+    and read either from the ``'metrics'`` control command (see
+    `daemon.control`), or from a file rewritten every so often by a
+    `MetricsFileWriter`, such as for the node exporter's textfile
+    collector.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import gc
+import math
+import os
+import threading
+import time
+
+from .daemon import (
+    _read_process_stat_fields, count_open_file_descriptors, read_memory_usage, read_process_start_time,
+)
+from .streams import BufferedStreamSink
+
+
+class DaemonMetrics(object):
+    """ Metrics of the daemon process of `context`.
+
+        `worker_pool`, if set, is the `WorkerPool` the daemon process
+        supervises, whose restarts and workers are included.
+    """
+
+    def __init__(self, context, worker_pool=None):
+        """ Set up a new instance. """
+        self.context = context
+        self.worker_pool = worker_pool
+
+    def collect(self):
+        """ Read the metrics now.
+
+            Returns a list of metric families, each a tuple
+            ``(name, type, help, samples)``, where `samples` is a list
+            of ``(labels, value)`` pairs and `labels` a dict.
+        """
+        families = []
+
+        def add(name, kind, help, samples):
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if samples:
+                families.append((name, kind, help, samples))
+
+        now = time.time()
+        started = read_process_start_time(os.getpid())
+        if started is None:
+            started = self.context._opened_at
+        if started is not None:
+            add('process_start_time_seconds', 'gauge', 'Start time of the process since the epoch, in seconds.',
+                [({}, started)])
+            add('daemon_uptime_seconds', 'gauge', 'Time since the daemon process started, in seconds.',
+                [({}, now - started)])
+
+        times = os.times()
+        add('process_cpu_seconds_total', 'counter', 'CPU time used by the process, in seconds.',
+            [({}, times[0] + times[1])])
+        add('daemon_cpu_seconds_total', 'counter', 'CPU time used by the process by mode, in seconds.',
+            [({'mode': 'user'}, times[0]), ({'mode': 'system'}, times[1])])
+
+        memory = read_memory_usage() or {}
+        if 'rss' in memory:
+            add('process_resident_memory_bytes', 'gauge', 'Resident memory of the process, in bytes.',
+                [({}, memory['rss'])])
+        add('daemon_memory_bytes', 'gauge', 'Memory of the process by kind, in bytes; private is the USS.',
+            [({'kind': kind}, size) for kind, size in sorted(memory.items())])
+
+        add('process_open_fds', 'gauge', 'Number of open file descriptors.',
+            [({}, count_open_file_descriptors())])
+
+        fields = _read_process_stat_fields(os.getpid())
+        # Field 20 of the file is the number of threads.
+        threads = int(fields[17]) if fields and len(fields) > 17 else threading.active_count()
+        add('process_threads', 'gauge', 'Number of threads of the process.', [({}, threads)])
+
+        self._collect_gc(add)
+        self._collect_context(add)
+        if self.worker_pool is not None:
+            self._collect_workers(add)
+
+        return families
+
+    def _collect_gc(self, add):
+        counts = gc.get_count()
+        add('daemon_gc_allocations_pending', 'gauge',
+            'Count toward the collection threshold of each generation: allocations less deallocations'
+            ' since the last collection for generation 0, collections of the generation below for the others.',
+            [({'generation': str(generation)}, count) for generation, count in enumerate(counts)])
+
+        get_freeze_count = getattr(gc, 'get_freeze_count', None)
+        if get_freeze_count is not None:
+            add('daemon_gc_frozen_objects', 'gauge', 'Objects moved to the permanent generation.',
+                [({}, get_freeze_count())])
+
+        get_stats = getattr(gc, 'get_stats', None)
+        if get_stats is None:
+            return
+
+        stats = list(enumerate(get_stats()))
+        for key, name, help in [
+                ('collections', 'daemon_gc_collections_total', 'Garbage collections, by generation.'),
+                ('collected', 'daemon_gc_collected_objects_total', 'Objects collected, by generation.'),
+                ('uncollectable', 'daemon_gc_uncollectable_objects_total',
+                 'Objects found uncollectable, by generation.')]:
+            add(name, 'counter', help, [({'generation': str(generation)}, entry.get(key)) for generation, entry in stats])
+
+    def _collect_context(self, add):
+        context = self.context
+
+        if context.signal_dispatcher is not None:
+            counts = context.signal_dispatcher.as_dict()
+            for key, name, help in [
+                    ('received', 'daemon_signals_received_total', 'Signals received, by name.'),
+                    ('dispatched', 'daemon_signals_dispatched_total', 'Signal handler runs, by signal name.')]:
+                add(name, 'counter', help, [({'signal': signal}, count) for signal, count in sorted(counts[key].items())])
+
+        if context.child_reaper is not None:
+            counts = context.child_reaper.as_dict()
+            add('daemon_children_reaped_total', 'counter', 'Child processes reaped, by outcome.',
+                [({'outcome': outcome}, counts[outcome]) for outcome in ['exited', 'failed', 'killed']])
+
+        sinks = []
+        for name in ['stdout', 'stderr']:
+            stream = getattr(context, name)
+            for sink, names in sinks:
+                if sink is stream:
+                    names.append(name)
+                    break
+            else:
+                if isinstance(stream, BufferedStreamSink):
+                    sinks.append((stream, [name]))
+
+        counts = [({'stream': ','.join(names)}, sink.as_dict()) for sink, names in sinks]
+        for key, name, help in [
+                ('bytes_written', 'daemon_log_bytes_written_total', 'Bytes of output written to the log file.'),
+                ('bytes_dropped', 'daemon_log_bytes_dropped_total', 'Bytes of output dropped when the buffer was full.'),
+                ('rotations', 'daemon_log_rotations_total', 'Rotations of the log file.')]:
+            add(name, 'counter', help, [(labels, sink_counts[key]) for labels, sink_counts in counts])
+        add('daemon_log_bytes_pending', 'gauge', 'Bytes of output buffered, not yet written.',
+            [(labels, sink_counts['bytes_pending']) for labels, sink_counts in counts])
+
+    def _collect_workers(self, add):
+        pool = self.worker_pool
+        # The pool changes these in the master's main thread, while the
+        # metrics are collected in another.
+        workers = dict(pool.workers)
+        exit_codes = dict(pool.exit_codes)
+
+        add('daemon_workers', 'gauge', 'Worker processes running.', [({}, len(workers))])
+        add('daemon_worker_restarts_total', 'counter', 'Worker processes restarted.', [({}, pool.restarts)])
+        add('daemon_worker_exits_total', 'counter', 'Worker processes exited, by exit code.',
+            [({'code': str(code)}, count) for code, count in sorted(exit_codes.items())])
+        add('daemon_worker_crash_loop', 'gauge', 'Whether the pool gave up restarting workers.',
+            [({}, int(pool.crash_loop))])
+
+        samples = []
+        for pid, index in sorted(workers.items(), key=lambda item: item[1]):
+            memory = read_memory_usage(pid) or {}
+            samples.append(({'worker': str(index)}, memory.get('rss')))
+        add('daemon_worker_resident_memory_bytes', 'gauge', 'Resident memory of each worker, in bytes.', samples)
+
+    def as_text(self):
+        """ Return the metrics in the Prometheus text format. """
+        return render_prometheus(self.collect())
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return '{:d}'.format(value)
+
+
+def render_prometheus(families):
+    """ Render metric families, as from `DaemonMetrics.collect`, as text. """
+    lines = []
+    for name, kind, help, samples in families:
+        lines.append('# HELP {} {}'.format(name, _escape_help(help)))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in samples:
+            if labels:
+                name_labels = '{}{{{}}}'.format(name, ','.join(
+                    '{}="{}"'.format(key, _escape_label_value(labels[key])) for key in sorted(labels)))
+            else:
+                name_labels = name
+            lines.append('{} {}'.format(name_labels, _format_value(value)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_file_atomically(path, text):
+    """ Replace the file at `path` with `text`.
+
+        The text is written to a hidden file beside `path`, then renamed
+        over it, so a reader never sees a partly written file.
+    """
+    dirpath, basename = os.path.split(path)
+    temp_path = os.path.join(dirpath, '.{}.{:d}.tmp'.format(basename, os.getpid()))
+    with open(temp_path, 'wb') as fp:
+        fp.write(text.encode('utf-8'))
+    os.rename(temp_path, path)
+
+
+class MetricsFileWriter(object):
+    """ Thread rewriting a file with the metrics every `interval` seconds.
+
+        `collect` is called for the text of each write, such as
+        `DaemonMetrics.as_text`. The file is written once on `start`,
+        and removed on `close`, so that a stopped daemon reports
+        nothing rather than the last figures it had.
+    """
+
+    def __init__(self, path, collect, interval=15.0):
+        """ Set up a new instance. """
+        self.path = path
+        self.collect = collect
+        self.interval = interval
+        self.writes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Write the file, and start the thread rewriting it. """
+        self.write()
+        self._thread = threading.Thread(target=self._run, name='daemon-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self):
+        """ Write the file now. """
+        write_file_atomically(self.path, self.collect())
+        self.writes += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except (IOError, OSError):
+                pass
+
+    def close(self, remove=True):
+        """ Stop rewriting the file, and remove it if `remove` is true. """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        if remove:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+# daemon/notify.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Service manager notification via the `NOTIFY_SOCKET` protocol. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import socket
+import threading
+
+
+NOTIFY_SOCKET_ENV = 'NOTIFY_SOCKET'
+WATCHDOG_USEC_ENV = 'WATCHDOG_USEC'
+WATCHDOG_PID_ENV = 'WATCHDOG_PID'
+
+
+class ServiceNotifier(object):
+    """ Sender of state notifications to a service manager.
+
+        The service manager passes the address of a Unix datagram
+        socket in the `NOTIFY_SOCKET` environment variable; each
+        notification is a single datagram of newline-separated
+        ``KEY=value`` assignments, such as ``READY=1``.
+
+        The socket is created, and connected to the address if it can
+        be, when the instance is; so its file descriptor can be
+        preserved when the daemon context closes all other open files,
+        and notifications still reach the service manager after the
+        process changes its root directory.
+    """
+
+    def __init__(self, address, watchdog_usec=None, watchdog_pid=None):
+        """ Set up a new instance.
+
+            `address` is the value of `NOTIFY_SOCKET`; a leading ``@``
+            denotes an address in the abstract namespace.
+            `watchdog_usec` is the watchdog interval in microseconds
+            expected by the service manager, if any, and
+            `watchdog_pid` the PID of the process expected to send the
+            keep-alives, if the service manager named one.
+        """
+        if address.startswith('@'):
+            address = '\0' + address[1:]
+        self.address = address
+        self.watchdog_usec = watchdog_usec
+        self.watchdog_pid = watchdog_pid
+        self.created_pid = os.getpid()
+        self.main_pid = None
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.socket.connect(address)
+            self.connected = True
+        except (socket.error, OSError):
+            self.connected = False
+        self._watchdog_thread = None
+        self._watchdog_stop = threading.Event()
+
+    @classmethod
+    def from_environment(cls, environ=None, unset=False):
+        """ Create an instance from the process environment.
+
+            Returns ``None`` if `NOTIFY_SOCKET` is not set. The
+            watchdog interval is taken from `WATCHDOG_USEC`, and the
+            process expected to send keep-alives from `WATCHDOG_PID`;
+            see `watchdog_applies`. If `unset` is true, the variables
+            are removed from `environ` (by default, `os.environ`), so
+            that child processes do not take the socket as their own.
+        """
+        if environ is None:
+            environ = os.environ
+
+        address = environ.get(NOTIFY_SOCKET_ENV)
+        watchdog_usec = environ.get(WATCHDOG_USEC_ENV, '')
+        watchdog_pid = environ.get(WATCHDOG_PID_ENV, '')
+        if unset:
+            for key in [NOTIFY_SOCKET_ENV, WATCHDOG_USEC_ENV, WATCHDOG_PID_ENV]:
+                environ.pop(key, None)
+
+        if not address:
+            return None
+
+        try:
+            watchdog_usec = int(watchdog_usec) or None
+        except ValueError:
+            watchdog_usec = None
+        try:
+            watchdog_pid = int(watchdog_pid) or None
+        except ValueError:
+            watchdog_pid = None
+
+        return cls(address, watchdog_usec, watchdog_pid)
+
+    def fileno(self):
+        """ Return the file descriptor of the notification socket. """
+        return self.socket.fileno()
+
+    def notify(self, *states, **fields):
+        """ Send a notification to the service manager.
+
+            Each positional argument is a ``KEY=value`` string, and each
+            keyword argument is sent as ``KEY=value``; for example,
+            ``notify('READY=1', STATUS='Listening')``.
+
+            Returns ``True`` if the notification was sent, ``False`` if
+            the service manager could not be reached.
+        """
+        assignments = list(states)
+        assignments.extend('{}={}'.format(key, value) for key, value in sorted(fields.items()))
+        message = '\n'.join(assignments).encode('utf-8')
+
+        try:
+            if self.connected:
+                self.socket.send(message)
+            else:
+                self.socket.sendto(message, self.address)
+        except (socket.error, OSError):
+            return False
+
+        return True
+
+    def ready(self, status=None):
+        """ Notify the service manager that startup has finished. """
+        if status is None:
+            return self.notify('READY=1')
+        return self.notify('READY=1', STATUS=status)
+
+    def status(self, status):
+        """ Send a free-form status line to the service manager. """
+        return self.notify(STATUS=status)
+
+    def reloading(self):
+        """ Notify the service manager that configuration is reloading. """
+        return self.notify('RELOADING=1')
+
+    def stopping(self):
+        """ Notify the service manager that the service is stopping. """
+        return self.notify('STOPPING=1')
+
+    def mainpid(self, pid=None):
+        """ Tell the service manager the PID of the main process. """
+        self.main_pid = os.getpid() if pid is None else pid
+        return self.notify(MAINPID=self.main_pid)
+
+    def watchdog(self):
+        """ Send a watchdog keep-alive to the service manager. """
+        return self.notify('WATCHDOG=1')
+
+    def watchdog_applies(self, pid=None):
+        """ Return whether process `pid` (by default, this one) is to send keep-alives.
+
+            That is any process, unless `watchdog_pid` is set. The
+            process it names may have handed over to another as the
+            main process, as a daemon does by detaching: the new main
+            process then takes over the keep-alives. So this is
+            checked in the process which will send them, not in the
+            process reading the environment.
+        """
+        if pid is None:
+            pid = os.getpid()
+
+        if self.watchdog_pid is None or self.watchdog_pid == pid:
+            return True
+
+        return self.watchdog_pid == self.created_pid and self.main_pid == pid
+
+    def start_watchdog(self, interval=None):
+        """ Start a thread sending watchdog keep-alives.
+
+            If `interval` is ``None``, keep-alives are sent at half
+            the interval the service manager expects, if this process
+            is to send them (see `watchdog_applies`). Does nothing if
+            neither is known, or if the thread is already running.
+        """
+        if interval is None:
+            if not self.watchdog_usec or not self.watchdog_applies():
+                return
+            interval = self.watchdog_usec / 2000000.0
+
+        if self._watchdog_thread is not None:
+            return
+
+        def ping():
+            while not self._watchdog_stop.wait(interval):
+                self.watchdog()
+
+        self._watchdog_stop.clear()
+        self._watchdog_thread = threading.Thread(target=ping, name='daemon-watchdog')
+        self._watchdog_thread.daemon = True
+        self._watchdog_thread.start()
+        self.watchdog()
+
+    def stop_watchdog(self):
+        """ Stop the watchdog thread, if running. """
+        if self._watchdog_thread is None:
+            return
+
+        self._watchdog_stop.set()
+        if self._watchdog_thread is not threading.current_thread():
+            self._watchdog_thread.join()
+        self._watchdog_thread = None
+
+    def close(self):
+        """ Stop the watchdog thread and close the socket. """
+        self.stop_watchdog()
+        self.socket.close()
@@ -14,14 +14,58 @@
 
 from __future__ import unicode_literals, print_function, absolute_import
 
+import abc
 import errno
+import fcntl
+import hashlib
 import os
+import select
 import six
+import socket
 import stat
+import struct
+import threading
+import time
 
+from lockfile import LockBase, LockTimeout, NotLocked, NotMyLock
 from lockfile.linklockfile import LinkLockFile, LockFailed, AlreadyLocked
 
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
 
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+_inotify_event_header = struct.Struct('iIII')
+
+_inotify = None
+
+
+def _get_inotify():
+    """ Return the C library with inotify support, or ``None``. """
+    global _inotify
+
+    if _inotify is None:
+        _inotify = False
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            if hasattr(libc, 'inotify_init1') and hasattr(libc, 'inotify_add_watch'):
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                _inotify = libc
+        except (ImportError, OSError):
+            pass
+
+    return _inotify or None
+
+
 class PIDFileError(Exception):
     """ Abstract base class for errors specific to PID files. """
 
@@ -40,6 +84,9 @@ class PIDLockFile(LinkLockFile, object):
         The lock is acquired and maintained as per `LinkFileLock`.
     """
 
+    #: Seconds the last `acquire` spent waiting for the lock.
+    lock_wait = None
+
     def read_pid(self):
         """ Get the PID from the lock file. """
         return read_pid_from_pidfile(self.path)
@@ -51,7 +98,9 @@ class PIDLockFile(LinkLockFile, object):
             lock. The `timeout` parameter is used as for the
             `LinkFileLock` class.
         """
+        started = _monotonic()
         super(PIDLockFile, self).acquire(*args, **kwargs)
+        self.lock_wait = _monotonic() - started
         try:
             write_pid_to_pidfile(self.path)
         except OSError as exc:
@@ -86,20 +135,639 @@ class TimeoutPIDLockFile(PIDLockFile):
         * The `acquire_timeout` parameter to the initialiser will be
           used as the default `timeout` parameter for the `acquire`
           method.
+
+        * If the `event_wait` keyword parameter to the initialiser is
+          true (the default), a contended `acquire` sleeps until the
+          lock file is removed, as reported by the kernel, instead of
+          polling for it. See `PIDFileWaiter`.
     """
 
     def __init__(self, path, acquire_timeout=None, *args, **kwargs):
         """ Set up the parameters of a DaemonRunnerLock. """
         self.acquire_timeout = acquire_timeout
+        self.event_wait = kwargs.pop('event_wait', True)
         super(TimeoutPIDLockFile, self).__init__(path, *args, **kwargs)
 
+    def _try_link(self):
+        """ Make one attempt to take the link lock; return ``True`` on success. """
+        try:
+            # The link lock alone, without recording the PID yet.
+            super(PIDLockFile, self).acquire(0)
+        except AlreadyLocked:
+            return False
+
+        return True
+
     def acquire(self, timeout=None, *args, **kwargs):
         """ Acquire the lock. """
         if timeout is None:
             timeout = self.acquire_timeout
+
+        started = _monotonic()
+        if self.event_wait and (timeout is None or timeout > 0):
+            deadline = None if timeout is None else started + timeout
+            with PIDFileWaiter(self.lock_file) as waiter:
+                while not self._try_link():
+                    remaining = None if deadline is None else deadline - _monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise LockTimeout('Timeout waiting to acquire lock for {}'.format(self.path))
+                    waiter.wait(remaining)
+        waited = _monotonic() - started
+
+        # With the link already held, this only records the PID.
         super(TimeoutPIDLockFile, self).acquire(timeout, *args, **kwargs)
+        self.lock_wait += waited
 
 
+@six.add_metaclass(abc.ABCMeta)
+class KernelPIDLockFile(LockBase, object):
+    """ Abstract base class for PID files locked by the kernel.
+
+        Unlike `PIDLockFile`, the lock is held by an open file
+        descriptor, so acquiring an unheld lock is a single system call
+        and the kernel releases the lock when the holding process
+        exits, however it exits. A PID file left behind by a crashed
+        holder never needs to be broken.
+
+        The `acquire_timeout` parameter to the initialiser is used as
+        the default `timeout` parameter for the `acquire` method, and
+        `event_wait` selects waiting for a kernel notification rather
+        than polling, as for `TimeoutPIDLockFile`.
+    """
+
+    #: The lock is released by the kernel when the holding process exits.
+    releases_on_exit = True
+
+    #: Seconds between attempts while waiting for a held lock.
+    poll_interval = 0.1
+
+    #: Seconds the last `acquire` spent waiting for the lock.
+    lock_wait = None
+
+    def __init__(self, path, acquire_timeout=None, event_wait=True):
+        """ Set up a new instance. """
+        super(KernelPIDLockFile, self).__init__(path, threaded=False, timeout=acquire_timeout)
+        self.acquire_timeout = acquire_timeout
+        self.event_wait = event_wait
+        self._owner_pid = None
+
+    @abc.abstractmethod
+    def _try_lock(self, blocking):
+        """ Try to take the kernel lock; return ``True`` on success. """
+
+    @abc.abstractmethod
+    def _unlock(self):
+        """ Drop the kernel lock held by this instance. """
+
+    @abc.abstractmethod
+    def _write_pid(self):
+        """ Record the PID of this process for `read_pid`. """
+
+    @abc.abstractmethod
+    def _close_descriptors(self):
+        """ Close this process's copies of the lock's descriptors. """
+
+    def read_pid(self):
+        """ Get the PID from the lock file. """
+        return read_pid_from_pidfile(self.path)
+
+    def acquire(self, timeout=None):
+        """ Acquire the lock.
+
+            * If `timeout` is ``None`` (and there is no default), block
+              until the lock is free.
+
+            * If `timeout` is greater than zero, wait up to that many
+              seconds, then raise ``LockTimeout``.
+
+            * Otherwise, raise ``AlreadyLocked`` at once if the lock is
+              held.
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+
+        started = _monotonic()
+        if self.i_am_locking():
+            self.lock_wait = 0.0
+            return
+
+        if timeout is None:
+            self._try_lock(blocking=True)
+        elif not self._try_lock(blocking=False):
+            if timeout <= 0:
+                raise AlreadyLocked('{} is already locked'.format(self.path))
+
+            deadline = _monotonic() + timeout
+            with self._make_waiter() as waiter:
+                while not self._try_lock(blocking=False):
+                    remaining = deadline - _monotonic()
+                    if remaining <= 0:
+                        raise LockTimeout('Timeout waiting to acquire lock for {}'.format(self.path))
+                    waiter.wait(remaining)
+        self.lock_wait = _monotonic() - started
+
+        self._owner_pid = os.getpid()
+        try:
+            self._write_pid()
+        except (OSError, IOError) as exc:
+            self._unlock()
+            self._owner_pid = None
+            raise LockFailed('{!s}'.format(exc))
+
+    def _make_waiter(self):
+        """ Make the object used to wait for the lock to be released. """
+        if self.event_wait:
+            return PIDFileWaiter(self.path, self.poll_interval)
+        return PollWaiter(self.poll_interval)
+
+    def release(self):
+        """ Release the lock.
+
+            Removes the PID file then releases the lock, or raises an
+            error if the current process does not hold the lock.
+        """
+        if not self.i_am_locking():
+            if self.is_locked():
+                raise NotMyLock('{} is locked, but not by me'.format(self.path))
+            raise NotLocked('{} is not locked'.format(self.path))
+
+        remove_existing_pidfile(self.path)
+        self._unlock()
+        self._owner_pid = None
+
+    def i_am_locking(self):
+        """ Return ``True`` if this process holds the lock. """
+        return self._owner_pid == os.getpid()
+
+    def close_after_fork(self):
+        """ Close the copies of the lock's descriptors in a forked process.
+
+            Call in a process forked from the holder of the lock. The
+            lock stays held by the holder; without this, the forked
+            process would keep it held after the holder exits.
+        """
+        if self._owner_pid is None or self.i_am_locking():
+            return
+
+        self._close_descriptors()
+        self._owner_pid = None
+
+    def break_lock(self):
+        """ Remove a PID file left behind by a former holder.
+
+            A lock held by a running process cannot be broken; if the
+            lock is not held, the PID file is removed.
+        """
+        if not self.is_locked():
+            remove_existing_pidfile(self.path)
+
+
+class FcntlPIDLockFile(KernelPIDLockFile):
+    """ PID file locked with `flock` on the PID file itself.
+
+        The PID file is the lock: it is opened, locked exclusively,
+        then has the PID of the holding process written to it.
+
+        With no timeout, `acquire` blocks in `flock` itself, and is woken
+        by the kernel as soon as the lock is released.
+    """
+
+    def __init__(self, path, acquire_timeout=None, event_wait=True):
+        """ Set up a new instance. """
+        super(FcntlPIDLockFile, self).__init__(path, acquire_timeout, event_wait)
+        self._fd = None
+        self._pid_fd = None
+
+    def _try_lock(self, blocking):
+        while True:
+            # Open read-only where possible: waiters watch for the holder's
+            # writable descriptor being closed, and must not wake
+            # themselves with their own failed attempts.
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise LockFailed('{!s}'.format(exc))
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, stat.S_IREAD | stat.S_IWRITE | stat.S_IRGRP | stat.S_IROTH)
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except (IOError, OSError) as exc:
+                os.close(fd)
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return False
+                raise LockFailed('{!s}'.format(exc))
+
+            # The previous holder may have removed the file between our
+            # opening and locking it; the lock is then on an orphan.
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    self._fd = fd
+                    return True
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    os.close(fd)
+                    raise
+
+            os.close(fd)
+
+    def _unlock(self):
+        if self._pid_fd is not None:
+            os.close(self._pid_fd)
+            self._pid_fd = None
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def _close_descriptors(self):
+        # The lock belongs to the open file, shared with the holder, so
+        # closing this copy leaves it held.
+        for fd in [self._pid_fd, self._fd]:
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._pid_fd = None
+
+    def _write_pid(self):
+        # Held open until release, so that its closing on exit wakes waiters.
+        self._pid_fd = os.open(self.path, os.O_WRONLY)
+        os.ftruncate(self._pid_fd, 0)
+        os.write(self._pid_fd, '{:d}{}'.format(os.getpid(), os.linesep).encode('ascii'))
+
+    def is_locked(self):
+        """ Return ``True`` if any process holds the lock. """
+        if self._fd is not None:
+            return True
+
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                return False
+            raise
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except (IOError, OSError) as exc:
+            if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            raise
+        finally:
+            os.close(fd)
+
+        return False
+
+
+class SocketPIDLockFile(KernelPIDLockFile):
+    """ PID lock implemented as a bound abstract-namespace Unix socket.
+
+        The lock is the name in the abstract socket namespace derived
+        from `path`; no file needs to exist, so this works as a
+        singleton lock even without a writable filesystem. The PID of
+        the holder is read from the peer credentials of its listening
+        socket. A thread in the holder accepts each connection, so
+        that the backlog never fills, and keeps it open until the
+        peer closes it.
+
+        If `write_pidfile` is true, a PID file is also written at
+        `path` for the benefit of other tools.
+
+        A waiting `acquire` connects to the holder's socket, and is woken
+        when the holder closes it, by releasing the lock or exiting.
+
+        This requires the Linux abstract socket namespace.
+    """
+
+    #: Seconds to retry connecting to a holder whose backlog is full.
+    connect_timeout = 0.25
+
+    def __init__(self, path, acquire_timeout=None, event_wait=True, write_pidfile=False):
+        """ Set up a new instance. """
+        super(SocketPIDLockFile, self).__init__(path, acquire_timeout, event_wait)
+        self.write_pidfile = write_pidfile
+        self.address = make_abstract_socket_address(path)
+        self._socket = None
+        self._connections = []
+        self._wake_fds = None
+        self._thread = None
+
+    def _try_lock(self, blocking):
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.bind(self.address)
+                sock.listen(128)
+            except socket.error as exc:
+                sock.close()
+                if exc.errno != errno.EADDRINUSE:
+                    raise LockFailed('{!s}'.format(exc))
+                if not blocking:
+                    return False
+                with self._make_waiter() as waiter:
+                    waiter.wait(None)
+                continue
+
+            self._socket = sock
+            self._start_accepting()
+            return True
+
+    def _start_accepting(self):
+        self._wake_fds = os.pipe()
+        self._thread = threading.Thread(target=self._accept_connections, name='daemon-pidlock')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept_connections(self):
+        """ Accept connections to the lock, until told to stop.
+
+            Each connection is held open until its peer closes it: a
+            waiting `acquire` is then woken when the lock is released,
+            or this process exits. A `read_pid` closes its connection
+            at once.
+        """
+        listener = self._socket
+        wake_fd = self._wake_fds[0]
+        poller = select.poll()
+        poller.register(listener.fileno(), select.POLLIN)
+        poller.register(wake_fd, select.POLLIN)
+        connections = dict()
+
+        while True:
+            try:
+                events = poller.poll()
+            except (select.error, OSError) as exc:
+                if getattr(exc, 'errno', exc.args[0]) == errno.EINTR:
+                    continue
+                raise
+
+            for fd, _ in events:
+                if fd == wake_fd:
+                    return
+                if fd == listener.fileno():
+                    try:
+                        conn, _ = listener.accept()
+                    except socket.error:
+                        continue
+                    connections[conn.fileno()] = conn
+                    self._connections.append(conn)
+                    poller.register(conn.fileno(), select.POLLIN)
+                    continue
+
+                conn = connections.pop(fd)
+                poller.unregister(fd)
+                self._connections.remove(conn)
+                conn.close()
+
+    def _stop_accepting(self):
+        if self._thread is not None:
+            os.write(self._wake_fds[1], b'x')
+            self._thread.join()
+            self._thread = None
+        self._close_connections()
+
+    def _close_connections(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        if self._wake_fds is not None:
+            for fd in self._wake_fds:
+                os.close(fd)
+            self._wake_fds = None
+
+    def _unlock(self):
+        self._stop_accepting()
+        self._socket.close()
+        self._socket = None
+
+    def _close_descriptors(self):
+        # The accepting thread is not running in a forked process.
+        self._thread = None
+        self._close_connections()
+        self._socket.close()
+        self._socket = None
+
+    def _write_pid(self):
+        if self.write_pidfile:
+            remove_existing_pidfile(self.path)
+            write_pid_to_pidfile(self.path)
+
+    def _make_waiter(self):
+        if self.event_wait:
+            return SocketWaiter(self.address, self.poll_interval)
+        return PollWaiter(self.poll_interval)
+
+    def _read_holder_pid(self):
+        """ Return the PID of the holder, ``None`` if not held, or ``0`` if not known.
+
+            The connection is made without blocking. While the
+            holder's backlog is full, it is retried for up to
+            `connect_timeout` seconds; a holder which has stopped
+            accepting connections is then known to hold the lock, but
+            not by whom.
+        """
+        if self._socket is not None and self.i_am_locking():
+            return os.getpid()
+
+        deadline = _monotonic() + self.connect_timeout
+        delay = 0.001
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                sock.connect(self.address)
+                creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+            except socket.error as exc:
+                if exc.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    return None
+                if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                if _monotonic() >= deadline:
+                    return 0
+            else:
+                return struct.unpack('3i', creds)[0]
+            finally:
+                sock.close()
+
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def read_pid(self):
+        """ Get the PID of the process holding the lock.
+
+            Returns ``None`` if the lock is not held. If the holder
+            is not accepting connections, its PID is read from the PID
+            file if `write_pidfile` is true, and is otherwise ``None``.
+        """
+        pid = self._read_holder_pid()
+        if pid == 0:
+            return read_pid_from_pidfile(self.path) if self.write_pidfile else None
+
+        return pid
+
+    def is_locked(self):
+        """ Return ``True`` if any process holds the lock. """
+        return self._read_holder_pid() is not None
+
+    def break_lock(self):
+        """ Remove a PID file left behind by a former holder. """
+        if self.write_pidfile:
+            super(SocketPIDLockFile, self).break_lock()
+
+
+class PollWaiter(object):
+    """ Waiter for a lock to be released, by sleeping between attempts. """
+
+    def __init__(self, interval=0.1):
+        """ Set up a new instance. """
+        self.interval = interval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def wait(self, timeout):
+        """ Sleep for the polling interval, or `timeout` if less. """
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+
+    def close(self):
+        """ Release any resources held by the waiter. """
+
+
+class PIDFileWaiter(PollWaiter):
+    """ Waiter for a lock file to be removed or closed, using inotify.
+
+        Watches the directory containing `path`, and wakes when the
+        file is removed, renamed, has its attributes changed, or is
+        closed after writing; the last of these happens when a
+        holding process exits. The watch is set up when the instance
+        is created, so a release after that is never missed.
+
+        Where inotify is not available, falls back to polling.
+    """
+
+    def __init__(self, path, interval=0.1):
+        """ Set up a new instance. """
+        super(PIDFileWaiter, self).__init__(interval)
+        self.name = os.path.basename(path).encode('utf-8')
+        self._fd = None
+
+        libc = _get_inotify()
+        if libc is None:
+            return
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return
+
+        dirname = os.path.dirname(os.path.abspath(path)).encode('utf-8')
+        mask = IN_DELETE | IN_MOVED_FROM | IN_CLOSE_WRITE | IN_ATTRIB
+        if libc.inotify_add_watch(fd, dirname, mask) < 0:
+            os.close(fd)
+            return
+
+        self._fd = fd
+
+    def wait(self, timeout):
+        """ Wait until the file changes, or `timeout` seconds pass. """
+        if self._fd is None:
+            return super(PIDFileWaiter, self).wait(timeout)
+
+        deadline = None if timeout is None else _monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - _monotonic())
+            if not select.select([self._fd], [], [], remaining)[0]:
+                return
+
+            if self._read_events():
+                return
+
+    def _read_events(self):
+        """ Drain pending events; return ``True`` if any were for the file. """
+        matched = False
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError as exc:
+                if exc.errno == errno.EAGAIN:
+                    return matched
+                raise
+
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = _inotify_event_header.unpack_from(data, offset)
+                offset += _inotify_event_header.size
+                if data[offset:offset + length].rstrip(b'\0') == self.name:
+                    matched = True
+                offset += length
+
+    def close(self):
+        """ Close the inotify descriptor. """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class SocketWaiter(PollWaiter):
+    """ Waiter for the holder of a socket lock to close its socket.
+
+        Connects to the listening socket at `address`; the connection
+        is reset as soon as the listening socket is closed. If the
+        connection cannot be made, falls back to polling.
+    """
+
+    def __init__(self, address, interval=0.1):
+        """ Set up a new instance. """
+        super(SocketWaiter, self).__init__(interval)
+        self.address = address
+        self._socket = None
+        self._connect()
+
+    def _connect(self):
+        """ Connect to the holder; return ``True`` on success. """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            sock.connect(self.address)
+        except socket.error:
+            sock.close()
+            return False
+
+        self._socket = sock
+        return True
+
+    def wait(self, timeout):
+        """ Wait until the holder closes its socket, or `timeout` seconds pass. """
+        if self._socket is None and not self._connect():
+            return super(SocketWaiter, self).wait(timeout)
+
+        if select.select([self._socket], [], [], timeout)[0]:
+            self.close()
+
+    def close(self):
+        """ Close the connection to the holder. """
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def make_abstract_socket_address(path):
+    """ Make the abstract Unix socket address used to lock `path`. """
+    name = 'python-daemon:{}'.format(os.path.abspath(path))
+    if len(name.encode('utf-8')) > 100:
+        name = 'python-daemon:{}'.format(hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+    return '\0' + name
+
+
+#: PID lock file classes, by the name given as `backend` to `make_pidlockfile`.
+pidlockfile_backends = {
+    'link': TimeoutPIDLockFile,
+    'fcntl': FcntlPIDLockFile,
+    'socket': SocketPIDLockFile,
+}
+
+
 def read_pid_from_pidfile(pidfile_path):
     """ Read the PID recorded in the named PID file.
 
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# daemon/reaper.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Reaping exited child processes.
+
+    A process which exits remains in the process table, as a zombie,
+    until its parent waits for it. A daemon which is the first process
+    of a container, or a child subreaper, also becomes the parent of
+    every orphaned descendant; unless it waits for them, they use up
+    the process table. A `ChildReaper` waits for them as they exit.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import collections
+import errno
+import os
+
+
+def child_pids():
+    """ Return the set of PIDs of the children of this process.
+
+        Read from ``/proc``; the set is empty where that is not
+        available.
+    """
+    pid = os.getpid()
+    pids = set()
+    try:
+        tasks = os.listdir('/proc/{:d}/task'.format(pid))
+    except OSError:
+        return pids
+
+    for task in tasks:
+        try:
+            with open('/proc/{:d}/task/{}/children'.format(pid, task)) as children_file:
+                pids.update(int(child) for child in children_file.read().split())
+        except (IOError, OSError):
+            return _child_pids_from_stat(pid)
+
+    return pids
+
+
+def _child_pids_from_stat(parent_pid):
+    """ Return the PIDs of the children of `parent_pid`, scanning ``/proc``. """
+    pids = set()
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name), 'rb') as stat_file:
+                fields = stat_file.read().rsplit(b')', 1)[1].split()
+        except (IOError, OSError, IndexError):
+            continue
+        if len(fields) > 1 and int(fields[1]) == parent_pid:
+            pids.add(int(name))
+
+    return pids
+
+
+class ChildReaper(object):
+    """ Reaper collecting every exited child process.
+
+        Call `reap`, or the instance itself as the handler for
+        ``signal.SIGCHLD``. The exit status of each child reaped is
+        recorded as for `subprocess.Popen.returncode`: the exit status,
+        or the negated signal number if the child was killed by a
+        signal. The last `history` of these are kept in
+        `last_statuses` as ``(pid, returncode)`` pairs.
+
+        `exclude`, if given, is a callable returning the PIDs of
+        children to leave for their owner to wait for, such as the
+        workers of a `WorkerPool`. Any other child is reaped, including
+        those started with `subprocess`, whose own `wait` then no longer
+        learns the exit status.
+    """
+
+    def __init__(self, exclude=None, history=16):
+        """ Set up a new instance. """
+        self.exclude = exclude
+        self.reaped = 0
+        self.exited = 0
+        self.failed = 0
+        self.killed = 0
+        self.last_statuses = collections.deque(maxlen=history)
+
+    def __call__(self, signal_number, stack_frame):
+        self.reap()
+
+    def reap(self):
+        """ Wait for every child which has exited, without blocking.
+
+            Returns the number of children reaped.
+        """
+        exclude = set(self.exclude()) if self.exclude is not None else set()
+        if not hasattr(os, 'waitid'):
+            return self._reap_with_waitpid(exclude)
+
+        count = 0
+        while True:
+            if exclude:
+                # Look at the next exited child, leaving it in place
+                # if it belongs to someone else.
+                info = self._waitid(os.P_ALL, 0, os.WNOWAIT)
+                if info is None:
+                    break
+                if info.si_pid in exclude:
+                    # The same child is reported until its owner waits
+                    # for it; wait for each of the others by PID.
+                    for pid in child_pids() - exclude:
+                        count += self._collect(self._waitid(os.P_PID, pid))
+                    break
+                info = self._waitid(os.P_PID, info.si_pid)
+            else:
+                info = self._waitid(os.P_ALL, 0)
+
+            if info is None:
+                break
+            count += self._collect(info)
+
+        return count
+
+    def _collect(self, info):
+        """ Record the child reported by `info`; return the number recorded. """
+        if info is None:
+            return 0
+
+        if info.si_code == os.CLD_EXITED:
+            self._record(info.si_pid, info.si_status)
+        else:
+            self._record(info.si_pid, -info.si_status)
+        return 1
+
+    def _waitid(self, idtype, pid, options=0):
+        try:
+            info = os.waitid(idtype, pid, os.WEXITED | os.WNOHANG | options)
+        except OSError as exc:
+            if exc.errno == errno.EINTR:
+                return self._waitid(idtype, pid, options)
+            if exc.errno == errno.ECHILD:
+                return None
+            raise
+
+        if info is None or info.si_pid == 0:
+            return None
+
+        return info
+
+    def _reap_with_waitpid(self, exclude):
+        if exclude:
+            # Without `waitid`, other children cannot be told apart
+            # before they are reaped.
+            return 0
+
+        count = 0
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno == errno.ECHILD:
+                    break
+                raise
+
+            if pid == 0:
+                break
+
+            if os.WIFSIGNALED(status):
+                self._record(pid, -os.WTERMSIG(status))
+            else:
+                self._record(pid, os.WEXITSTATUS(status))
+            count += 1
+
+        return count
+
+    def _record(self, pid, returncode):
+        self.reaped += 1
+        if returncode == 0:
+            self.exited += 1
+        elif returncode > 0:
+            self.failed += 1
+        else:
+            self.killed += 1
+        self.last_statuses.append((pid, returncode))
+
+    def as_dict(self):
+        """ Return the counts of children reaped, and the last statuses. """
+        return {
+            'reaped': self.reaped,
+            'exited': self.exited,
+            'failed': self.failed,
+            'killed': self.killed,
+            'last_statuses': list(self.last_statuses),
+        }
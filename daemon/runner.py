@@ -19,14 +19,30 @@
 from __future__ import unicode_literals, print_function, absolute_import
 
 import errno
+import importlib
 import os
 import signal
 import six
 import sys
 import time
+import traceback
 
+from multiprocessing.pool import ThreadPool
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
 
 from . import pidlockfile, DaemonContext
+from .control import ControlClient, ControlError
+from .handoff import HandoffClient, HandoffError
+from .streams import BufferedStreamSink
+from .workers import WorkerPool
+from .daemon import (
+    DaemonOSEnvironmentError, DaemonReadinessError, DaemonReadinessTimeout, ReadinessPipe, get_exit_status,
+    is_process_running, prepare_for_fork, wait_for_process_exit,
+)
 
 
 class DaemonRunnerError(Exception):
@@ -41,10 +57,26 @@ class DaemonRunnerStartFailureError(RuntimeError, DaemonRunnerError):
     """ Raised when failure starting DaemonRunner. """
 
 
+class DaemonRunnerStartTimeoutError(DaemonRunnerStartFailureError):
+    """ Raised when the daemon does not become ready in time. """
+
+
 class DaemonRunnerStopFailureError(RuntimeError, DaemonRunnerError):
     """ Raised when failure stopping DaemonRunner. """
 
 
+class DaemonRunnerControlError(RuntimeError, DaemonRunnerError):
+    """ Raised when a control command to the daemon fails. """
+
+
+class DaemonRunnerResultError(RuntimeError, DaemonRunnerError):
+    """ Raised when the daemon did not produce a result. """
+
+
+class DaemonRunnerResultTimeoutError(DaemonRunnerResultError):
+    """ Raised when the daemon is still running when its result is wanted. """
+
+
 class DaemonRunner(object):
     """ Controller for a callable running in a separate background process.
 
@@ -57,7 +89,11 @@ class DaemonRunner(object):
 
     def __init__(self, stdout=None, stderr=None, stdin=None, pidfile=None,
                  pidfile_timeout=None, manage_pidfile=True,
-                 context_kwargs=None, force_detach=False, process_name=None):
+                 context_kwargs=None, force_detach=False, process_name=None,
+                 ready_on_open=True, pidfile_backend='link',
+                 buffered_output=False, rotate_size=None, workers=None,
+                 worker_stop_timeout=10.0, preload_modules=None, warm_up=None,
+                 listen=None, reuse_port=False, supervise=False, worker_pool_kwargs=None):
         """ Set up the parameters of a new runner.
 
             * `stdin`, `stdout`, `stderr`: Filesystem
@@ -75,12 +111,84 @@ class DaemonRunner(object):
 
             * `pidfile_timeout`: Used as the default acquisition
               timeout value supplied to the runner's PID lock file.
+
+            * `pidfile_backend`: How the PID file is locked; a key of
+              `pidlockfile.pidlockfile_backends`. ``'link'`` uses hard
+              links; ``'fcntl'`` and ``'socket'`` are kernel locks,
+              released automatically if the daemon dies.
+
+            * `ready_on_open`: If true, the daemon is considered ready
+              as soon as its context is open; otherwise `run()` must
+              call `self.notify_ready()`. See `start(wait_ready=True)`.
+
+            * `buffered_output`: If true, `stdout` and `stderr` paths
+              are opened for appending and written through a
+              `BufferedStreamSink`, which batches writes in a
+              background thread of the daemon process.
+
+            * `rotate_size`: If given, output is buffered as for
+              `buffered_output`, and each file is rotated once it
+              reaches this many bytes; see `BufferedStreamSink`.
+              Without it, output files are only ever reopened, by
+              `DaemonContext.reopen_streams`, after being moved aside.
+
+            * `workers`: If given, the daemon process becomes a master
+              which calls `preload()`, then forks this many worker
+              processes to call `run()`, sharing whatever the master set
+              up (such as the sockets in `files_preserve`). Workers that
+              crash are restarted. Signals in the context's `signal_map`
+              are passed on to the workers; those handled by
+              ``'terminate'`` stop the workers, waiting up to
+              `worker_stop_timeout` seconds before killing them, and
+              then the master. The PID file holds the PID of the
+              master. See `WorkerPool`.
+
+            * `preload_modules`, `warm_up`: Modules to import and a
+              callable to call in the daemon process once it has
+              detached, for its memory to be shared with the processes
+              it forks; see `DaemonContext`. With `workers`, the memory
+              set up by `preload()` is likewise prepared to be shared
+              by the workers.
+
+            * `listen`: Addresses to bind listening sockets to before
+              the daemon drops privileges; they are available as
+              `listening_sockets`. See `DaemonContext`.
+
+            * `reuse_port`: If true, and with `workers`, each worker
+              gets its own ``SO_REUSEPORT`` socket for each address in
+              `listen`, so the kernel spreads connections across them.
+
+            * `supervise`: If true, and without `workers`, the daemon
+              process supervises a single worker process calling
+              `run()`, as for ``workers=1``: if `run()` fails, it is
+              restarted by forking the supervisor again, which takes
+              milliseconds rather than starting the daemon anew.
+
+            * `worker_pool_kwargs`: Further keyword arguments for the
+              `WorkerPool`, such as its restart backoff and crash loop
+              limits. Its statistics are available from
+              `worker_pool.as_dict()` in the daemon process.
         """
         context_kwargs = context_kwargs or {}
         if force_detach:
             context_kwargs['detach_process'] = True
 
         context_kwargs.setdefault('process_name', process_name)
+        context_kwargs.setdefault('preload_modules', preload_modules)
+        context_kwargs.setdefault('warm_up', warm_up)
+        context_kwargs.setdefault('listen', listen)
+        if reuse_port:
+            context_kwargs.setdefault('reuse_port', True)
+            context_kwargs.setdefault('listen_count', workers or 1)
+        context_kwargs.setdefault('ready_on_open', ready_on_open)
+
+        if buffered_output or rotate_size:
+            sinks = {}
+            for name, path in [('stdout', stdout), ('stderr', stderr)]:
+                if isinstance(path, six.string_types) and path != os.devnull:
+                    if path not in sinks:
+                        sinks[path] = BufferedStreamSink(path, rotate_size=rotate_size)
+                    context_kwargs.setdefault(name, sinks[path])
 
         context_kwargs.setdefault('stdin', stdin or os.devnull)
         context_kwargs.setdefault('stdout', stdout or os.devnull)
@@ -88,12 +196,17 @@ class DaemonRunner(object):
 
         self.daemon_context = DaemonContext(**context_kwargs)
         self.daemonized = False
+        self.workers = workers or (1 if supervise else None)
+        self.worker_stop_timeout = worker_stop_timeout
+        self.worker_pool_kwargs = worker_pool_kwargs or {}
+        self.worker_pool = None
+        self.worker_id = None
 
         self.pidfile = pidfile
         self.manage_pidfile = manage_pidfile
 
         if self.pidfile and manage_pidfile:
-            self.pidfile = make_pidlockfile(pidfile, pidfile_timeout)
+            self.pidfile = make_pidlockfile(pidfile, pidfile_timeout, pidfile_backend)
 
         self.daemon_context.pidfile = self.pidfile
         self.daemon_context.manage_pidfile = self.manage_pidfile
@@ -104,75 +217,536 @@ class DaemonRunner(object):
     def run(self):
         pass
 
-    def start(self, delay_after_fork=None):
-        """ Open the daemon context and run the application. """
-        if self.manage_pidfile and is_pidfile_stale(self.pidfile):
+    def preload(self):
+        """ Prepare state to share with the workers, in the master process.
+
+            Called once, before the workers are forked, if `workers`
+            is set.
+        """
+
+    def start(self, delay_after_fork=None, wait_ready=False, ready_timeout=None, handle=False):
+        """ Open the daemon context and run the application.
+
+            If `wait_ready` is true, block until the daemon reports
+            that it is ready and return its PID. Raises
+            `DaemonRunnerStartFailureError` if the daemon fails to
+            start, or `DaemonRunnerStartTimeoutError` if it is not
+            ready within `ready_timeout` seconds.
+
+            If `handle` is true, return a `DaemonHandle` on the daemon
+            process instead, through which it reports its exit status
+            and the value returned by `run()`; waiting for it to be
+            ready first if `wait_ready` is true.
+
+            Otherwise return ``None``. The pipe the daemon reports
+            through is only created when one of these is asked for, and
+            the daemon process detaches; without detaching, `start`
+            does not return.
+        """
+        readiness = self.spawn(delay_after_fork, wait_ready=wait_ready or handle)
+        if readiness is None:
+            return None
+
+        readiness.close_write_end()
+        pid = None
+        if wait_ready:
+            try:
+                pid = wait_until_ready(readiness, ready_timeout, keep_open=handle)
+            except DaemonRunnerError:
+                readiness.close()
+                raise
+
+        if not handle:
+            return pid
+
+        return DaemonHandle(readiness, pid)
+
+    def spawn(self, delay_after_fork=None, wait_ready=False):
+        """ Start the daemon process, without waiting for it to be ready.
+
+            Returns the `ReadinessPipe` to wait on if `wait_ready` is
+            true and the daemon process detaches, otherwise ``None``.
+            See `start`.
+        """
+        if self.manage_pidfile and not releases_on_exit(self.pidfile) and is_pidfile_stale(self.pidfile):
             self.pidfile.break_lock()
 
+        launcher_pid = os.getpid()
+        readiness = None
+        if wait_ready and self.daemon_context.detach_process:
+            readiness = ReadinessPipe()
+            self.daemon_context.readiness = readiness
+
         try:
             with self.daemon_context:
                 if delay_after_fork:
                     time.sleep(delay_after_fork)
                 try:
                     self.daemonized = True
-                    os._exit(self.run() or 0)
+                    result = self._run_daemon()
                 except SystemExit as err:
-                    code = err.code or 0
-                    if isinstance(code, six.string_types):
-                        code = 1
-                    os._exit(code)
+                    self._exit_daemon(get_exit_status(err))
+                else:
+                    code = result if isinstance(result, six.integer_types) else 0
+                    self._exit_daemon(code, result)
         except pidlockfile.AlreadyLocked:
+            if os.getpid() != launcher_pid:
+                self._exit_daemon(1)
             raise DaemonRunnerStartFailureError('PID file {} already locked'.format(self.pidfile.path))
-        except SystemExit:
-            pass
+        except SystemExit as err:
+            if os.getpid() != launcher_pid:
+                # Such as a signal to stop, before `run()` was reached.
+                self._exit_daemon(get_exit_status(err))
+        except Exception as exc:
+            if os.getpid() != launcher_pid:
+                if readiness is not None:
+                    readiness.notify_error(exc)
+                traceback.print_exc()
+                self._exit_daemon(1, error='{}: {!s}'.format(type(exc).__name__, exc))
+            raise
+        finally:
+            self.daemon_context.readiness = None
+
+        return readiness
+
+    def _run_daemon(self):
+        """ Run the application in the daemon process. """
+        if not self.workers:
+            return self.run()
+
+        self.preload()
+        prepare_for_fork(malloc_trim=self.daemon_context.malloc_trim)
+
+        context = self.daemon_context
+        handlers = context._make_signal_handler_map()
+        stop_signals = [
+            signal_number for signal_number, target in context.signal_map.items()
+            if target == 'terminate' or handlers[signal_number] == context.terminate
+        ]
+
+        self.worker_pool = WorkerPool(
+            self._run_worker, self.workers, signal_handlers=handlers, stop_signals=stop_signals,
+            stop_timeout=self.worker_stop_timeout, exit_handler=self._exit_daemon,
+            **self.worker_pool_kwargs)
+        context.metrics.worker_pool = self.worker_pool
+        context.control_commands.setdefault('workers', self.worker_pool.as_dict)
+        if context.control_commands.get('reload') == context._control_reload:
+            context.control_commands['reload'] = self._reload_workers
+        if context.child_reaper is not None:
+            # Workers are waited for by the pool, which restarts them.
+            context.child_reaper.exclude = lambda: self.worker_pool.workers
+        return self.worker_pool.run()
+
+    def _reload_workers(self):
+        """ Send the workers ``SIGHUP``, then reload the master, for the ``'reload'`` command. """
+        if signal.SIGHUP not in self.worker_pool.signal_handlers:
+            raise ValueError('No handler for SIGHUP in signal_map')
+        self.worker_pool.reload()
+
+    def _run_worker(self, index):
+        """ Run the application in worker process `index`. """
+        self.worker_id = index
+        self.daemon_context.close_after_fork()
+        self.daemon_context.use_worker_sockets(index)
+        self.daemon_context.install_signal_handlers()
+        return self.run()
+
+    def _exit_daemon(self, code, result=None, error=None):
+        """ Leave the daemon process, without unwinding the launcher's stack.
+
+            In the daemon process itself (not in a worker), closes the
+            daemon context, releasing the PID file, then reports the
+            exit status and `result` or `error` to the launcher.
+        """
+        context = self.daemon_context
+        context.flush_streams()
+        if os.getpid() == context.main_pid:
+            context.close()
+            context.report_exit(code, result, error)
+        os._exit(code)
+
+    def control(self, command, timeout=None, **args):
+        """ Send `command` to the control server of the running daemon.
+
+            Returns the command's result. Raises
+            `DaemonRunnerControlError` if the daemon serves no control
+            commands, or the command failed or was not answered within
+            `timeout` seconds. See the `control` option of
+            `DaemonContext`.
+        """
+        try:
+            path = self.daemon_context.control_socket_path
+        except DaemonOSEnvironmentError as exc:
+            raise DaemonRunnerControlError('{!s}'.format(exc))
+
+        try:
+            return ControlClient(path, timeout).request(command, **args)
+        except ControlError as exc:
+            raise DaemonRunnerControlError('{!s}'.format(exc))
+
+    def _try_control(self, command, timeout=None):
+        """ Send `command` if the daemon serves control commands.
+
+            Returns ``True`` if the command was carried out, or
+            ``False`` if it could not be, so a signal must be sent
+            instead.
+        """
+        try:
+            if not os.path.exists(self.daemon_context.control_socket_path):
+                return False
+            self.control(command, timeout)
+        except (DaemonOSEnvironmentError, DaemonRunnerControlError):
+            return False
+
+        return True
+
+    def metrics(self, timeout=None):
+        """ Return the runtime metrics of the running daemon.
+
+            The metrics are read with the ``'metrics'`` control
+            command, in the Prometheus text format; see `control`.
+        """
+        return self.control('metrics', timeout)
+
+    def reload(self, timeout=None):
+        """ Tell the running daemon to reload.
+
+            Uses the ``'reload'`` control command if the daemon serves
+            one, and returns ``True`` once the reload has finished.
+            Otherwise sends ``SIGHUP`` and returns ``False``, as there
+            is no telling when it has been handled.
+        """
+        if self._try_control('reload', timeout):
+            return True
+
+        pid = self.pid
+        if not pid:
+            raise DaemonRunnerControlError('No daemon process to reload')
+
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except OSError as exc:
+            raise DaemonRunnerControlError('Failed to signal {:d}: {!s}'.format(pid, exc))
+
+        return False
 
     def __terminate_daemon_process(self, sig=None):
-        """ Terminate the daemon process specified in the current PID file. """
+        """ Terminate the daemon process specified in the current PID file.
+
+            Unless a particular signal is given, the ``'stop'``
+            control command is used if the daemon serves one.
+        """
         if not self.pidfile:
             return
 
         pid = self.pid
 
+        if sig is None and self._try_control('stop', timeout=5.0):
+            return
+
         try:
             os.kill(pid, signal.SIGTERM if sig is None else sig)
         except OSError as exc:
             raise DaemonRunnerStopFailureError('Failed to terminate {:d}: {!s}'.format(pid, exc))
 
-    def stop(self, sig=None):
-        """ Exit the daemon process specified in the current PID file. """
+    def stop(self, sig=None, wait=False, timeout=None, escalate_to=signal.SIGKILL):
+        """ Exit the daemon process specified in the current PID file.
+
+            If `wait` is true, block until the daemon process has
+            exited and return the number of seconds that took. If it
+            is still running after `timeout` seconds, send it
+            `escalate_to` and wait up to `timeout` seconds again;
+            raise `DaemonRunnerStopFailureError` if it still has not
+            exited, or if `escalate_to` is ``None``.
+
+            Returns ``None`` if not waiting, or if there was no
+            daemon process to stop.
+        """
         if not self.pidfile:
             raise DaemonRunnerStopFailureError('Cannot stop daemon with no PID file')
 
         if not self.alive:
-            return
+            return None
+
+        pid = self.pid
 
         if not self.manage_pidfile:
             self.__terminate_daemon_process(sig)
-            return
-
-        if not self.pidfile.is_locked():
+        elif not self.pidfile.is_locked():
             raise DaemonRunnerStopFailureError('PID file {} not locked'.format(self.pidfile.path))
-
-        if is_pidfile_stale(self.pidfile):
+        elif is_pidfile_stale(self.pidfile):
             self.pidfile.break_lock()
+            return None
         else:
             self.__terminate_daemon_process(sig)
 
-    def restart(self):
-        """ Stop, then start. """
-        self.stop()
-        self.start()
+        if not wait:
+            return None
+
+        started = _monotonic()
+        elapsed = None
+        steps = stop_waits(self, pid, timeout, escalate_to)
+        exited = None
+        while True:
+            try:
+                steps.send(exited)
+            except StopIteration:
+                return elapsed
+            exited = wait_for_process_exit(pid, timeout)
+            elapsed = _monotonic() - started
+
+    def restart(self, timeout=None, graceful=False, ready_timeout=None):
+        """ Stop, wait for the daemon process to exit, then start.
+
+            `timeout` is passed to `stop`.
+
+            If `graceful` is true and the running daemon serves its
+            listening sockets for handoff (see the `handoff_sockets`
+            option of `DaemonContext`), restart without closing them:
+            the new daemon takes over the sockets and the PID file, and
+            the old one drains and exits once the new one is ready.
+            Returns the PID of the new daemon. If the running daemon
+            does not serve a handoff, fall back to stopping then
+            starting.
+        """
+        if graceful:
+            client = HandoffClient(self.daemon_context.handoff_socket_path, ready_timeout)
+            if client.connect():
+                return self._take_over(client, ready_timeout)
+
+        self.stop(wait=True, timeout=timeout)
+        return self.start()
+
+    def astart(self, delay_after_fork=None, ready_timeout=None):
+        """ Start the daemon from an `asyncio` event loop.
+
+            Returns an awaitable which completes, once the daemon is
+            ready, with an `aio.AsyncDaemonHandle` whose `wait()` and
+            `result()` await its exit. Raises as for `start`.
+        """
+        from . import aio
+        return aio.start(self, delay_after_fork, ready_timeout)
+
+    def astop(self, sig=None, timeout=None, escalate_to=signal.SIGKILL):
+        """ Stop the daemon from an `asyncio` event loop.
+
+            Returns an awaitable for the result of `stop` with `wait`
+            true.
+        """
+        from . import aio
+        return aio.stop(self, sig, timeout, escalate_to)
+
+    def astatus(self):
+        """ Return an awaitable for the PID and state of the daemon. """
+        from . import aio
+        return aio.status(self)
+
+    def _take_over(self, client, ready_timeout):
+        """ Start a daemon taking over from the one connected to `client`. """
+        context = self.daemon_context
+        try:
+            sockets = client.receive_sockets()
+            try:
+                client.release_pidfile()
+                context.inherited_sockets.update(sockets)
+                if not context.handoff_sockets:
+                    context.handoff_sockets = dict(sockets)
+                context.handoff_client = client
+
+                return self.start(wait_ready=True, ready_timeout=ready_timeout)
+            finally:
+                # The daemon has its own copies of these; the launcher's
+                # copies must not keep the connection or sockets open.
+                for sock in sockets.values():
+                    sock.close()
+                context.inherited_sockets.clear()
+        except HandoffError as exc:
+            raise DaemonRunnerStartFailureError('Handoff from running daemon failed: {!s}'.format(exc))
+        finally:
+            context.handoff_client = None
+            client.close()
+
+
+class DaemonHandle(object):
+    """ Handle on a daemon process started by `DaemonRunner.start`.
+
+        The daemon process reports through a `ReadinessPipe` set up
+        before it detached: first that it is ready, then, as it exits,
+        its exit status and the value returned by `run()`. A `run()`
+        returning an integer (or ``None``) exits with that status;
+        any other value is its result, with status 0.
+
+        A handle no longer needed should be closed. One dropped without
+        closing is closed when it is garbage collected, so that the
+        daemon process does not wait to report its exit to a reader
+        which will never read it.
+
+        Ask for one with the `handle` argument of `DaemonRunner.start`.
+    """
+
+    def __init__(self, readiness, pid=None):
+        """ Set up a new instance. """
+        self.readiness = readiness
+        self._pid = pid
+        self._exit_code = None
+        self._result = None
+        self._error = None
+        self._reported = False
+
+    def __repr__(self):
+        return '<{}: pid {}>'.format(self.__class__.__name__, self._pid)
+
+    def _receive(self, timeout):
+        """ Process the next report; return ``False`` on timeout. """
+        if self._reported:
+            return True
+
+        try:
+            message = self.readiness.receive(timeout)
+        except DaemonReadinessTimeout:
+            return False
+
+        if message is None:
+            kind, value = 'exit', (None, None, None)
+        else:
+            kind, value = message
+
+        if kind == 'ready':
+            self._pid = value
+        elif kind == 'error':
+            self._error = value
+        elif kind == 'exit':
+            self._exit_code, self._result, error = value
+            self._error = self._error or error
+            self._reported = True
+            self.readiness._close_read_end()
+
+        return True
+
+    @property
+    def pid(self):
+        """ PID of the daemon process, once it has reported ready.
+
+            Blocks until then, if `start` did not wait for it; ``None``
+            if the daemon exited without reporting ready.
+        """
+        while self._pid is None and not self._reported:
+            self._receive(None)
+        return self._pid
+
+    @property
+    def alive(self):
+        """ ``True`` if the daemon process is running. """
+        self._poll()
+        return not self._reported or (self._pid is not None and is_process_running(self._pid))
+
+    @property
+    def exit_code(self):
+        """ Exit status of the daemon process.
+
+            ``None`` while it is running, or if it exited without
+            reporting one (such as when killed by a signal).
+        """
+        self._poll()
+        return self._exit_code
+
+    def _poll(self):
+        while not self._reported and self._receive(0):
+            pass
+
+    def wait(self, timeout=None):
+        """ Wait for the daemon process to exit.
+
+            Returns ``True`` once it has exited, or ``False`` if it is
+            still running after `timeout` seconds.
+        """
+        deadline = None if timeout is None else _monotonic() + timeout
+        while not self._reported:
+            remaining = None if deadline is None else max(0, deadline - _monotonic())
+            if not self._receive(remaining):
+                return False
+
+        if self._pid is None:
+            return True
+
+        remaining = None if deadline is None else max(0, deadline - _monotonic())
+        return wait_for_process_exit(self._pid, remaining)
+
+    def result(self, timeout=None):
+        """ Wait for the daemon process to exit, and return its result.
+
+            Raises `DaemonRunnerResultTimeoutError` if it is still
+            running after `timeout` seconds, or
+            `DaemonRunnerResultError` if it failed, or exited without
+            reporting a result.
+        """
+        if not self.wait(timeout):
+            raise DaemonRunnerResultTimeoutError('Daemon process still running after {} seconds'.format(timeout))
+
+        return self._reported_result()
+
+    def _reported_result(self):
+        """ Return the result reported by the exited daemon process. """
+        if self._error is not None:
+            raise DaemonRunnerResultError('Daemon process failed ({})'.format(self._error))
+        if self._exit_code is None:
+            raise DaemonRunnerResultError('Daemon process exited without reporting a result')
+
+        return self._result
+
+    def close(self):
+        """ Stop listening for reports from the daemon process. """
+        self._reported = True
+        self.readiness.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except (AttributeError, OSError):
+            # Partly set up, or the interpreter is shutting down.
+            pass
+
+
+def wait_until_ready(readiness, timeout=None, keep_open=False):
+    """ Wait for a daemon started by `DaemonRunner.spawn` to be ready.
+
+        Returns the PID of the daemon; raises as for
+        `DaemonRunner.start`. See `ReadinessPipe.wait` for `keep_open`.
+    """
+    try:
+        return readiness.wait(timeout, keep_open)
+    except DaemonReadinessTimeout as exc:
+        raise DaemonRunnerStartTimeoutError('{!s}'.format(exc))
+    except DaemonReadinessError as exc:
+        raise DaemonRunnerStartFailureError('{!s}'.format(exc))
+
 
+def make_pidlockfile(path, acquire_timeout, backend='link'):
+    """ Make a PIDLockFile instance with the given filesystem path.
 
-def make_pidlockfile(path, acquire_timeout):
-    """ Make a PIDLockFile instance with the given filesystem path. """
+        `backend` names the locking implementation to use; see
+        `pidlockfile.pidlockfile_backends`.
+    """
     if not isinstance(path, six.string_types):
         raise ValueError('Not a filesystem path: {}'.format(path))
 
     if not os.path.isabs(path):
         raise ValueError('Not an absolute path: {}'.format(path))
 
-    return pidlockfile.TimeoutPIDLockFile(path, acquire_timeout)
+    try:
+        lockfile_class = pidlockfile.pidlockfile_backends[backend]
+    except KeyError:
+        raise ValueError('Unknown PID file backend: {}'.format(backend))
+
+    return lockfile_class(path, acquire_timeout)
+
+
+def releases_on_exit(pidfile):
+    """ Determine whether a PID file lock is released when its holder dies.
+
+        Such a lock cannot be left stale, so needs no breaking.
+    """
+    return getattr(pidfile, 'releases_on_exit', False)
 
 
 def is_pidfile_stale(pidfile):
@@ -186,12 +760,232 @@ def is_pidfile_stale(pidfile):
         return False
 
     pidfile_pid = pidfile.read_pid()
-    if pidfile_pid is not None:
+    if pidfile_pid is not None and not is_process_running(pidfile_pid):
+        # The specified PID does not exist
+        return True
+
+    return False
+
+
+def stop_waits(runner, pid, timeout=None, escalate_to=signal.SIGKILL):
+    """ Wait for the daemon `pid` of `runner` to exit, once told to stop.
+
+        A generator, so that `DaemonRunner.stop` and `aio.stop` share
+        it, driving it with blocking and asynchronous waits: each time
+        it yields, wait up to `timeout` seconds for the process to
+        exit, and send it whether it did. If it has not, it is sent
+        `escalate_to` and waited for again; raises
+        `DaemonRunnerStopFailureError` if it still has not exited, or
+        if `escalate_to` is ``None``. Once the process has exited, a
+        PID file it left behind is broken.
+    """
+    exited = yield
+    if not exited:
+        if escalate_to is None:
+            raise DaemonRunnerStopFailureError('Process {:d} did not exit within {} seconds'.format(pid, timeout))
+
         try:
-            os.kill(pidfile_pid, signal.SIG_DFL)
+            os.kill(pid, escalate_to)
         except OSError as exc:
-            if exc.errno == errno.ESRCH:
-                # The specified PID does not exist
-                return True
+            if exc.errno != errno.ESRCH:
+                raise DaemonRunnerStopFailureError('Failed to terminate {:d}: {!s}'.format(pid, exc))
+
+        exited = yield
+        if not exited:
+            raise DaemonRunnerStopFailureError('Process {:d} did not exit after signal {:d}'.format(pid, escalate_to))
+
+    # A process that was killed outright left its PID file behind.
+    if runner.manage_pidfile and not releases_on_exit(runner.pidfile) and is_pidfile_stale(runner.pidfile):
+        runner.pidfile.break_lock()
+
+
+def list_running_pids():
+    """ Return the set of PIDs of all running processes.
+
+        Reads the `/proc` directory once, which is far cheaper than
+        signalling each of many processes in turn. Returns ``None`` if
+        there is no `/proc` to read.
+    """
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return None
+
+    return set(int(name) for name in names if name.isdigit())
+
+
+def import_callable(reference):
+    """ Import the callable named by a ``'module:attribute'`` reference. """
+    module_name, _, attribute = reference.partition(':')
+    if not module_name or not attribute:
+        raise ValueError('Not a callable reference: {}'.format(reference))
+
+    target = importlib.import_module(module_name)
+    for name in attribute.split('.'):
+        target = getattr(target, name)
+
+    if not callable(target):
+        raise TypeError('{} is not callable'.format(reference))
+
+    return target
+
+
+class DaemonFleet(object):
+    """ Controller for many daemons at once.
+
+        `runners` is a mapping from names to `DaemonRunner` instances,
+        or a sequence of runners, named by their PID file paths. Each
+        action runs across all of them concurrently, on at most
+        `parallelism` threads, and returns a single report::
+
+            {
+                'action': 'stop',
+                'ok': True,
+                'elapsed': 0.25,
+                'daemons': {
+                    '/run/spam-1.pid': {'ok': True, 'pid': 1234, 'elapsed': 0.25},
+                    ...
+                },
+            }
+
+        An entry whose action failed has ``'ok': False`` and the
+        message in ``'error'``; the report is ``'ok'`` only if every
+        entry is.
+    """
+
+    def __init__(self, runners, parallelism=16):
+        """ Set up a new instance. """
+        if isinstance(runners, dict):
+            self.runners = dict(runners)
+        else:
+            self.runners = dict((fleet_member_name(runner), runner) for runner in runners)
+        self.parallelism = parallelism
+
+    def _map(self, func, names):
+        """ Call `func` on each of `names` concurrently; return results by name. """
+        if not names:
+            return {}
+
+        pool = ThreadPool(min(self.parallelism, len(names)))
+        try:
+            return dict(zip(names, pool.map(func, names)))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _report(self, action, started, results):
+        return {
+            'action': action,
+            'ok': all(result['ok'] for result in results.values()),
+            'elapsed': _monotonic() - started,
+            'daemons': results,
+        }
+
+    def status(self):
+        """ Report the PID and state of each daemon.
+
+            Each entry has ``'pid'`` (``0`` if none is recorded),
+            ``'alive'``, and ``'stale'`` (a PID is recorded, but that
+            process is not running). An entry is ``'ok'`` if the daemon
+            is alive.
+
+            Which processes are running is read from one listing of
+            `/proc`, taken before the PID files are read, rather than
+            by checking each process; without `/proc`, each runner's
+            `alive` is checked instead.
+        """
+        started = _monotonic()
+        running = list_running_pids()
+
+        def check(name):
+            runner = self.runners[name]
+            try:
+                pid = runner.pid
+            except Exception as exc:
+                return {'ok': False, 'pid': 0, 'alive': False, 'stale': False, 'error': '{!s}'.format(exc)}
+
+            if running is None:
+                alive = runner.alive
+            else:
+                alive = pid in running
+
+            return {'ok': alive, 'pid': pid, 'alive': alive, 'stale': bool(pid) and not alive}
+
+        return self._report('status', started, self._map(check, sorted(self.runners)))
+
+    def start(self, ready_timeout=None):
+        """ Start every daemon, and wait for all of them to be ready.
+
+            The daemons are forked one after another from the calling
+            thread; only the waiting is done concurrently.
+        """
+        started = _monotonic()
+        pending = {}
+        results = {}
+        for name in sorted(self.runners):
+            try:
+                pending[name] = (_monotonic(), self.runners[name].spawn(wait_ready=True))
+            except Exception as exc:
+                results[name] = {'ok': False, 'pid': 0, 'error': '{!s}'.format(exc), 'elapsed': 0.0}
+
+        def wait(name):
+            spawned, readiness = pending[name]
+            try:
+                pid = wait_until_ready(readiness, ready_timeout)
+            except DaemonRunnerError as exc:
+                return {'ok': False, 'pid': 0, 'error': '{!s}'.format(exc), 'elapsed': _monotonic() - spawned}
+            return {'ok': True, 'pid': pid, 'elapsed': _monotonic() - spawned}
+
+        results.update(self._map(wait, sorted(pending)))
+        return self._report('start', started, results)
+
+    def stop(self, sig=None, timeout=None, escalate_to=signal.SIGKILL):
+        """ Stop every daemon, and wait for all of them to exit.
+
+            Arguments are as for `DaemonRunner.stop`. Each entry has
+            the ``'pid'`` stopped, and ``'elapsed'``, the time it took
+            to exit.
+        """
+        started = _monotonic()
+
+        def stop(name):
+            runner = self.runners[name]
+            try:
+                pid = runner.pid
+                elapsed = runner.stop(sig, wait=True, timeout=timeout, escalate_to=escalate_to)
+            except Exception as exc:
+                return {'ok': False, 'pid': 0, 'error': '{!s}'.format(exc), 'elapsed': None}
+            return {'ok': True, 'pid': pid, 'elapsed': elapsed}
+
+        return self._report('stop', started, self._map(stop, sorted(self.runners)))
+
+    def restart(self, timeout=None, ready_timeout=None):
+        """ Stop every daemon, then start every one that stopped.
+
+            Each entry has the ``'stopped'`` and ``'started'`` results.
+        """
+        started = _monotonic()
+        stopped = self.stop(timeout=timeout)['daemons']
+        restartable = dict((name, self.runners[name]) for name, result in stopped.items() if result['ok'])
+        restarted = DaemonFleet(restartable, self.parallelism).start(ready_timeout)['daemons']
+
+        results = {}
+        for name, result in stopped.items():
+            start_result = restarted.get(name, {'ok': False, 'error': 'Not started'})
+            results[name] = {
+                'ok': start_result['ok'],
+                'pid': start_result.get('pid', 0),
+                'stopped': result,
+                'started': start_result,
+            }
+
+        return self._report('restart', started, results)
+
+
+def fleet_member_name(runner):
+    """ Return the name of a runner in a `DaemonFleet`: its PID file path. """
+    pidfile = runner.pidfile
+    if isinstance(pidfile, six.string_types):
+        return pidfile
+    return getattr(pidfile, 'path', None) or repr(runner)
 
-    return False
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+# daemon/signals.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Running signal handlers outside of signal context.
+
+    A Python signal handler runs in the main thread, between any two
+    bytecodes, and only once the main thread gets back to running
+    bytecode. A `SignalDispatcher` instead only notes which signals
+    arrived, by having each signal number written to a pipe (the
+    "self-pipe" technique); the handlers are then run in normal
+    context, either by a dedicated thread or from an event loop
+    watching the pipe.
+
+    Signals arriving in a burst are coalesced: each handler runs once
+    for however many of its signal arrived since it last ran.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import errno
+import fcntl
+import os
+import select
+import signal
+import sys
+import threading
+import traceback
+
+
+# Since Python 3.5 the wakeup descriptor receives the signal number;
+# before, a null byte only.
+_WAKEUP_FD_WRITES_SIGNUM = sys.version_info >= (3, 5)
+
+
+def signal_name(signal_number):
+    """ Return the name of `signal_number`, such as ``'SIGTERM'``. """
+    for name in dir(signal):
+        if name.startswith('SIG') and not name.startswith('SIG_') and getattr(signal, name) == signal_number:
+            return name
+    return str(signal_number)
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class SignalDispatcher(object):
+    """ Dispatcher running signal handlers from a self-pipe.
+
+        `handlers` maps signal numbers to handlers, as for
+        `set_signal_handlers`; each handler is called as
+        ``handler(signal_number, None)``. Handlers that are
+        ``signal.SIG_IGN`` or ``signal.SIG_DFL`` are installed
+        directly.
+
+        `exit_handler`, if given, is called with the exit status when
+        a handler raises `SystemExit` in the dispatcher thread, which
+        would otherwise end only that thread; it should not return.
+
+        The signal wakeup descriptor is process-wide: an event loop
+        which installs its own (as `asyncio` does for
+        `loop.add_signal_handler`) replaces this one.
+    """
+
+    def __init__(self, handlers, exit_handler=None):
+        """ Set up a new instance. """
+        self.handlers = dict(handlers)
+        self.exit_handler = exit_handler
+        self.read_fd = None
+        self.write_fd = None
+        self.received = {}
+        self.dispatched = {}
+        self._previous_wakeup_fd = -1
+        self._previous_handlers = {}
+        self._thread = None
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def fileno(self):
+        """ Return the file descriptor of the read end of the pipe. """
+        return self.read_fd
+
+    def file_descriptors(self):
+        """ Return the file descriptors to keep open while installed. """
+        if self.read_fd is None:
+            return []
+
+        return [self.read_fd, self.write_fd]
+
+    def install(self):
+        """ Create the pipe, and install the signal handlers.
+
+            Must be called from the main thread; raises `ValueError`
+            otherwise, rather than leaving the signals unhandled.
+        """
+        if self.read_fd is not None:
+            return
+
+        self.read_fd, self.write_fd = os.pipe()
+        _set_nonblocking(self.read_fd)
+        _set_nonblocking(self.write_fd)
+
+        if _WAKEUP_FD_WRITES_SIGNUM:
+            try:
+                self._previous_wakeup_fd = signal.set_wakeup_fd(self.write_fd, warn_on_full_buffer=False)
+            except TypeError:
+                self._previous_wakeup_fd = signal.set_wakeup_fd(self.write_fd)
+            note = _ignore_signal
+        else:
+            note = self._write_signal
+
+        for signal_number, handler in self.handlers.items():
+            if handler in (signal.SIG_IGN, signal.SIG_DFL):
+                previous = signal.signal(signal_number, handler)
+            else:
+                previous = signal.signal(signal_number, note)
+            self._previous_handlers[signal_number] = previous
+
+    def _write_signal(self, signal_number, stack_frame):
+        try:
+            os.write(self.write_fd, bytearray([signal_number]))
+        except OSError:
+            # The pipe is full, so the dispatcher will run anyway.
+            pass
+
+    def post(self, signal_number):
+        """ Queue `signal_number` to be dispatched, as if it had arrived.
+
+            Safe to call from any thread while installed.
+        """
+        self._write_signal(signal_number, None)
+
+    def dispatch(self):
+        """ Run the handlers for the signals received since the last call.
+
+            Returns the number of signals read from the pipe.
+        """
+        with self._lock:
+            data = bytearray()
+            while True:
+                try:
+                    chunk = os.read(self.read_fd, 4096)
+                except OSError as exc:
+                    if exc.errno == errno.EINTR:
+                        continue
+                    if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    raise
+                if not chunk:
+                    break
+                data.extend(chunk)
+
+            pending = []
+            for signal_number in data:
+                if signal_number == 0:
+                    continue
+                self.received[signal_number] = self.received.get(signal_number, 0) + 1
+                if signal_number not in pending:
+                    pending.append(signal_number)
+
+        for signal_number in pending:
+            handler = self.handlers.get(signal_number)
+            if not callable(handler):
+                continue
+            self.dispatched[signal_number] = self.dispatched.get(signal_number, 0) + 1
+            handler(signal_number, None)
+
+        return len(data)
+
+    def start(self):
+        """ Start a thread running the handlers as signals arrive. """
+        if self._thread is not None:
+            return
+
+        self._stopping = False
+        self._thread = threading.Thread(target=self._serve, name='daemon-signals')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stopping:
+            try:
+                select.select([self.read_fd], [], [])
+            except (select.error, OSError) as exc:
+                if getattr(exc, 'errno', exc.args[0] if exc.args else None) == errno.EINTR:
+                    continue
+                return
+
+            if self._stopping:
+                return
+
+            try:
+                self.dispatch()
+            except SystemExit as exc:
+                if self.exit_handler is None:
+                    raise
+                from .daemon import get_exit_status
+                self.exit_handler(get_exit_status(exc))
+            except Exception:
+                traceback.print_exc()
+
+    def attach(self, loop):
+        """ Run the handlers from `loop`, as signals arrive.
+
+            `loop` is an `asyncio` event loop, or any object with an
+            ``add_reader(fd, callback)`` method. A handler raising
+            `SystemExit` stops the loop in the usual way.
+        """
+        loop.add_reader(self.read_fd, self.dispatch)
+
+    def detach(self, loop):
+        """ Stop running the handlers from `loop`. """
+        loop.remove_reader(self.read_fd)
+
+    def close(self):
+        """ Stop the thread, if running, and restore the signal handlers
+            and wakeup descriptor in place before `install`.
+        """
+        if self.read_fd is None:
+            return
+
+        if self._thread is not None:
+            self._stopping = True
+            self._write_signal(0, None)
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+
+        if _WAKEUP_FD_WRITES_SIGNUM:
+            try:
+                current = signal.set_wakeup_fd(self._previous_wakeup_fd)
+                if current != self.write_fd:
+                    # Another wakeup descriptor has been installed since.
+                    signal.set_wakeup_fd(current)
+            except ValueError:
+                pass
+
+        for signal_number, previous in self._previous_handlers.items():
+            try:
+                signal.signal(signal_number, previous if previous is not None else signal.SIG_DFL)
+            except ValueError:
+                pass
+        self._previous_handlers = {}
+
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        self.read_fd = self.write_fd = None
+
+    def as_dict(self):
+        """ Return the counts of signals received and dispatched, by name. """
+        return {
+            'received': dict((signal_name(number), count) for number, count in self.received.items()),
+            'dispatched': dict((signal_name(number), count) for number, count in self.dispatched.items()),
+        }
+
+
+def _ignore_signal(signal_number, stack_frame):
+    """ Python-level handler for a signal noted through the wakeup descriptor. """
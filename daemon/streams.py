@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+
+# daemon/streams.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Buffered output sinks for the standard streams of a daemon.
+
+    A `BufferedStreamSink` stands in for a file as the `stdout` or
+    `stderr` of a `DaemonContext`. The daemon's standard output
+    descriptors are pointed at a pipe, so that everything written to
+    them (including by C extensions and child processes) goes through
+    the same path; a background thread collects what arrives and
+    writes it to the real file in batches, rather than with one system
+    call per write.
+
+    The sink can also reopen its file after it has been moved aside,
+    and rotate it by size itself, compressing old files in another
+    background thread.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import collections
+import errno
+import fcntl
+import gzip
+import os
+import select
+import shutil
+import sys
+import threading
+import time
+
+from six.moves import queue
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
+
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031 if sys.platform.startswith('linux') else None)
+
+
+def set_pipe_size(fd, size):
+    """ Ask the kernel to resize the pipe `fd` to `size` bytes.
+
+        Returns ``False`` if the system does not support it, or
+        refuses (for example, above the limit for unprivileged
+        processes).
+    """
+    if F_SETPIPE_SZ is None:
+        return False
+
+    try:
+        fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+    except (IOError, OSError):
+        return False
+
+    return True
+
+
+def _above_standard_streams(fd):
+    """ Return `fd`, moved if need be to a descriptor above 2.
+
+        The standard stream descriptors may be free when the sink is
+        opened, but are about to be replaced.
+    """
+    if fd > 2:
+        return fd
+
+    moved = fcntl.fcntl(fd, getattr(fcntl, 'F_DUPFD_CLOEXEC', fcntl.F_DUPFD), 3)
+    os.close(fd)
+    return moved
+
+
+def compress_file(path):
+    """ Compress the file `path` to `path` + ``'.gz'``, and remove it. """
+    with open(path, 'rb') as source:
+        with gzip.open(path + '.gz', 'wb') as destination:
+            shutil.copyfileobj(source, destination, 1024 * 1024)
+    os.unlink(path)
+
+
+def shift_rotated_files(path, count):
+    """ Move the rotated files of `path` up by one, keeping `count` of them.
+
+        ``path.1`` (or ``path.1.gz``) becomes ``path.2``, and so on;
+        the file numbered `count` is removed, leaving ``path.1`` free.
+    """
+    for index in range(count, 0, -1):
+        for suffix in ['', '.gz']:
+            old = '{}.{:d}{}'.format(path, index, suffix)
+            try:
+                if index == count:
+                    os.unlink(old)
+                else:
+                    os.rename(old, '{}.{:d}{}'.format(path, index + 1, suffix))
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+
+
+class BufferedStreamSink(object):
+    """ Sink batching writes to a file, through a pipe and a flusher thread.
+
+        `target` is a filesystem path (opened for appending), an open
+        file object, or a file descriptor. Data written to the pipe is
+        collected in memory and written to `target` once
+        `batch_size` bytes are waiting, or `flush_interval` seconds
+        after the oldest of them arrived, whichever comes first.
+
+        If `target` cannot keep up (or writing to it fails), up to
+        `capacity` bytes are held back to retry; beyond that, the
+        oldest complete lines are dropped, and counted in
+        `bytes_dropped` and `lines_dropped`. The pipe itself is
+        resized to `pipe_size` bytes where the system allows, so
+        writers rarely wait for the flusher thread.
+
+        If `target` is a path and `rotate_size` is given, once the file
+        reaches that many bytes it is renamed to `target` + ``'.1'``
+        (older files moving up to ``'.2'``, and so on, keeping
+        `rotate_count` of them) and a new file opened; if `compress`
+        is true, the old file is then compressed with `gzip`. Only
+        moving the file aside holds up the writers: renumbering and
+        compressing the old files happen in a background thread. See
+        also `reopen`.
+
+        The sink is opened by `DaemonContext.open` (or by calling
+        `open` and `start`), which must happen in the process that
+        will write to it: the flusher thread does not survive a fork.
+    """
+
+    def __init__(self, target, batch_size=65536, flush_interval=0.5,
+                 capacity=4 * 1024 * 1024, pipe_size=1024 * 1024,
+                 rotate_size=None, rotate_count=5, compress=True):
+        """ Set up a new instance. """
+        self.target = target
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.pipe_size = pipe_size
+        self.rotate_size = rotate_size
+        self.rotate_count = rotate_count
+        self.compress = compress
+
+        self.read_fd = None
+        self.write_fd = None
+        self.target_fd = None
+        self._stop_read_fd = None
+        self._stop_write_fd = None
+        self._owns_target = False
+        self._target_size = 0
+        self._reopen_pending = False
+        self._rotator = None
+        self._rotated = queue.Queue()
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._pending = collections.deque()
+        self._pending_size = 0
+        self._pending_since = None
+
+        self.bytes_received = 0
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+        self.lines_dropped = 0
+        self.flushes = 0
+        self.reopens = 0
+        self.rotations = 0
+
+    def __repr__(self):
+        return '<{}: {!r}>'.format(self.__class__.__name__, self.target)
+
+    @property
+    def is_open(self):
+        """ ``True`` if the pipe has been opened, and not yet closed. """
+        return self.write_fd is not None
+
+    def open(self):
+        """ Open `target` and create the pipe. Does nothing if already open. """
+        if self.is_open:
+            return
+
+        if isinstance(self.target, int):
+            self.target_fd = self.target
+        elif hasattr(self.target, 'fileno'):
+            self.target_fd = self.target.fileno()
+        else:
+            self.target_fd = self._open_target()
+            self._owns_target = True
+
+        self.read_fd, self.write_fd = [_above_standard_streams(fd) for fd in os.pipe()]
+        if self.pipe_size:
+            set_pipe_size(self.write_fd, self.pipe_size)
+        # Written to by `close`, to wake the flusher thread to exit.
+        self._stop_read_fd, self._stop_write_fd = [_above_standard_streams(fd) for fd in os.pipe()]
+
+        flags = fcntl.fcntl(self.read_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._closed = False
+
+    def _open_target(self):
+        fd = _above_standard_streams(os.open(self.target, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666))
+        self._target_size = os.fstat(fd).st_size
+        return fd
+
+    def fileno(self):
+        """ Return the file descriptor of the write end of the pipe. """
+        return self.write_fd
+
+    def file_descriptors(self):
+        """ Return the file descriptors to keep open while the sink is in use. """
+        if not self.is_open:
+            return []
+
+        return [self.read_fd, self.write_fd, self.target_fd, self._stop_read_fd, self._stop_write_fd]
+
+    def write(self, data):
+        """ Write `data` (bytes, or text encoded as UTF-8) to the pipe. """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.write_fd, view):]
+
+    def start(self):
+        """ Start the flusher thread, if not already running. """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self.open()
+        self._thread = threading.Thread(target=self._run, name='daemon-streams')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        # `close` joins this thread before closing these.
+        read_fd, stop_fd = self.read_fd, self._stop_read_fd
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                timeout = None
+                if self._pending_since is not None:
+                    timeout = max(0, self._pending_since + self.flush_interval - _monotonic())
+
+            try:
+                readable, _, _ = select.select([read_fd, stop_fd], [], [], timeout)
+            except (select.error, OSError, ValueError) as exc:
+                if getattr(exc, 'errno', exc.args[0] if exc.args else None) == errno.EINTR:
+                    continue
+                return
+
+            with self._lock:
+                if self._closed:
+                    return
+                if read_fd in readable:
+                    self._drain()
+                if self._pending_size >= self.batch_size or self._is_due():
+                    self._write_pending()
+
+    def _is_due(self):
+        return self._pending_since is not None and _monotonic() - self._pending_since >= self.flush_interval
+
+    def _drain(self):
+        """ Move everything waiting in the pipe into the pending buffer. """
+        while True:
+            try:
+                chunk = os.read(self.read_fd, 65536)
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            if not chunk:
+                break
+
+            self._pending.append(chunk)
+            self._pending_size += len(chunk)
+            self.bytes_received += len(chunk)
+            if self._pending_since is None:
+                self._pending_since = _monotonic()
+
+        self._trim()
+
+    def _trim(self):
+        """ Drop the oldest lines held beyond `capacity`. """
+        excess = self._pending_size - self.capacity
+        if excess <= 0:
+            return
+
+        data = b''.join(self._pending)
+        # Resume at the start of a line, so that no line is half lost.
+        cut = data.find(b'\n', excess - 1)
+        cut = len(data) if cut < 0 else cut + 1
+
+        dropped = data[:cut]
+        self.bytes_dropped += len(dropped)
+        self.lines_dropped += dropped.count(b'\n') or 1
+
+        self._pending.clear()
+        if cut < len(data):
+            self._pending.append(data[cut:])
+        self._pending_size = len(data) - cut
+
+    def _write_pending(self):
+        """ Write the pending buffer to `target`, in as few calls as possible. """
+        if self._reopen_pending:
+            self._reopen()
+
+        if not self._pending:
+            self._pending_since = None
+            return
+
+        view = memoryview(b''.join(self._pending))
+        written = 0
+        try:
+            while written < len(view):
+                try:
+                    written += os.write(self.target_fd, view[written:])
+                except OSError as exc:
+                    if exc.errno != errno.EINTR:
+                        raise
+        except OSError:
+            # Hold the remainder back, and try again after an interval.
+            remainder = view[written:].tobytes()
+            self._pending.clear()
+            self._pending.append(remainder)
+            self._pending_size = len(remainder)
+            self._pending_since = _monotonic()
+        else:
+            self._pending.clear()
+            self._pending_size = 0
+            self._pending_since = None
+            self.flushes += 1
+
+        self.bytes_written += written
+        self._target_size += written
+
+        # Rotate only between lines, so that no line is split across files.
+        if (self._owns_target and self.rotate_size and self._target_size >= self.rotate_size
+                and not self._pending and view[-1:].tobytes() == b'\n'):
+            self._rotate()
+
+    def reopen(self):
+        """ Reopen `target` by its path, such as after it has been moved aside.
+
+            Safe to call from a signal handler: if the sink is busy,
+            the file is reopened before the next write instead. Does
+            nothing unless `target` is a path.
+        """
+        self._reopen_pending = True
+        if self._lock.acquire(False):
+            try:
+                if self.is_open:
+                    self._reopen()
+            finally:
+                self._lock.release()
+
+    def _reopen(self):
+        self._reopen_pending = False
+        if not self._owns_target:
+            return
+
+        try:
+            fd = self._open_target()
+        except OSError:
+            # Carry on writing to the file already open.
+            return
+
+        os.close(self.target_fd)
+        self.target_fd = fd
+        self.reopens += 1
+
+    def _rotate(self):
+        """ Move `target` aside and reopen it, leaving the rest to the rotator thread. """
+        staged = '{}.rotating.{:d}.{:d}'.format(self.target, os.getpid(), self.rotations)
+        try:
+            os.rename(self.target, staged)
+        except OSError:
+            return
+
+        self._reopen()
+        self.rotations += 1
+
+        if self._rotator is None:
+            self._rotator = threading.Thread(target=self._run_rotator, name='daemon-streams-rotate')
+            self._rotator.daemon = True
+            self._rotator.start()
+        self._rotated.put(staged)
+
+    def _run_rotator(self):
+        """ Number, and compress, each file moved aside by `_rotate`, in turn. """
+        while True:
+            staged = self._rotated.get()
+            if staged is None:
+                return
+
+            rotated = self.target + '.1'
+            try:
+                shift_rotated_files(self.target, self.rotate_count)
+                os.rename(staged, rotated)
+                if self.compress:
+                    compress_file(rotated)
+            except (IOError, OSError):
+                continue
+
+    def flush(self):
+        """ Write everything received so far to `target`. """
+        with self._lock:
+            if not self.is_open:
+                return
+            self._drain()
+            self._write_pending()
+
+    def close(self, redirect_fds=()):
+        """ Flush, stop the flusher thread, and close the pipe.
+
+            Each descriptor in `redirect_fds`, which should be a copy
+            of the write end of the pipe (such as the standard output
+            descriptor), is first pointed directly at `target`, so that
+            writes to it after the sink is closed are not lost.
+        """
+        with self._lock:
+            if not self.is_open:
+                return
+
+            self._drain()
+            self._write_pending()
+            for fd in redirect_fds:
+                os.dup2(self.target_fd, fd)
+            self._drain()
+            self._write_pending()
+            self._closed = True
+
+        # Wake the flusher thread, and let it exit before its descriptors close.
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            os.write(self._stop_write_fd, b'x')
+            thread.join()
+
+        with self._lock:
+            if not self.is_open:
+                return
+            for fd in [self.write_fd, self.read_fd, self._stop_write_fd, self._stop_read_fd]:
+                os.close(fd)
+            if self._owns_target:
+                os.close(self.target_fd)
+            self.read_fd = self.write_fd = self.target_fd = None
+            self._stop_read_fd = self._stop_write_fd = None
+            self._owns_target = False
+            rotator, self._rotator = self._rotator, None
+
+        if rotator is not None:
+            # Let the old files be numbered and compressed before exit.
+            self._rotated.put(None)
+            rotator.join()
+
+    def as_dict(self):
+        """ Return the counters of the sink as a dict. """
+        return {
+            'bytes_received': self.bytes_received,
+            'bytes_written': self.bytes_written,
+            'bytes_dropped': self.bytes_dropped,
+            'lines_dropped': self.lines_dropped,
+            'bytes_pending': self._pending_size,
+            'flushes': self.flushes,
+            'reopens': self.reopens,
+            'rotations': self.rotations,
+        }
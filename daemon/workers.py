@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+# daemon/workers.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Pre-forked worker processes under a master daemon process.
+
+    The daemon process becomes a master: it forks a number of workers,
+    which inherit everything it set up beforehand (such as listening
+    sockets, and any application state loaded in advance), restarts
+    those that crash, and passes signals on to them.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import atexit
+import collections
+import errno
+import os
+import random
+import select
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from .daemon import get_exit_status, reset_signal_wakeup_fd
+from .signals import SignalDispatcher
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
+
+def clear_exit_handlers():
+    """ Forget the functions registered with `atexit` in this process.
+
+        A forked worker must not run its master's exit handlers, which
+        would (for example) release the master's PID file.
+    """
+    clear = getattr(atexit, '_clear', None)
+    if clear is not None:
+        clear()
+    else:
+        del atexit._exithandlers[:]
+
+
+def _describe_status(status):
+    if os.WIFSIGNALED(status):
+        return 'killed by signal {:d}'.format(os.WTERMSIG(status))
+    return 'exited with status {:d}'.format(os.WEXITSTATUS(status))
+
+
+def _returncode(status):
+    """ Return the exit status as for `subprocess.Popen.returncode`. """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class WorkerPool(object):
+    """ Master supervising a pool of forked worker processes.
+
+        `target` is called in each worker as ``target(index)``, where
+        `index` identifies the worker's slot (from 0 to `count` - 1),
+        and returns the worker's exit status. A worker which exits
+        other than with status 0 while the pool is running is replaced
+        by a new one in the same slot. The first restart of a slot
+        waits `restart_delay` seconds; the delay doubles for each
+        further failure of that slot within `crash_loop_interval`
+        seconds, up to `max_restart_delay`, and is varied at random by
+        up to `restart_jitter` of itself, so that restarts do not
+        happen in lockstep.
+
+        If the pool restarts workers `crash_loop_restarts` times within
+        `crash_loop_interval` seconds, it is in a crash loop: it stops
+        the workers and `run` returns 1, rather than keep restarting.
+        ``None`` never gives up.
+
+        `signal_handlers` maps signal numbers to the master's own
+        handlers. Each signal with a callable handler is sent on to the
+        workers, then handled by the master; except ``signal.SIGCHLD``,
+        handled by the master once it has collected any exited workers. The signals in
+        `stop_signals` stop the pool instead: they are sent on to the
+        workers, which are given `stop_timeout` seconds to exit before
+        being killed, and only then handled by the master. Other
+        threads of the master ask for ``SIGHUP`` handling with `reload`.
+
+        `exit_handler` is called with the exit status to leave a
+        worker process; if ``None``, `os._exit` is used.
+
+        `report` is called with a line of text on each restart, and on
+        giving up in a crash loop; if ``None``, the line is written to
+        `sys.stderr`, which in a daemon process is its `stderr` file.
+        The latest line is kept as `last_message`.
+    """
+
+    def __init__(self, target, count, signal_handlers=None, stop_signals=(),
+                 stop_timeout=10.0, restart_delay=1.0, exit_handler=None,
+                 max_restart_delay=30.0, restart_jitter=0.1,
+                 crash_loop_restarts=10, crash_loop_interval=60.0, report=None):
+        """ Set up a new instance. """
+        self.target = target
+        self.count = count
+        self.signal_handlers = dict(signal_handlers or {})
+        self.stop_signals = set(stop_signals)
+        self.stop_timeout = stop_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.restart_jitter = restart_jitter
+        self.crash_loop_restarts = crash_loop_restarts
+        self.crash_loop_interval = crash_loop_interval
+        self.exit_handler = exit_handler or os._exit
+        self.report = report or _write_to_stderr
+
+        self.workers = {}
+        self.restarts = 0
+        self.last_status = {}
+        self.exit_codes = {}
+        self.crash_loop = False
+        self.last_message = None
+
+        self._failures = {}
+        self._restart_times = collections.deque()
+
+        self._started = {}
+        self._restart_at = {}
+        self._stopping = False
+        self._stop_deadline = None
+        self._stop_signal = None
+        self._dispatcher = None
+        self._reload_waiters = []
+        self._lock = threading.Lock()
+
+    def run(self):
+        """ Fork the workers, and supervise them until the pool stops.
+
+            Returns 0 once every worker has exited successfully, or 1
+            if the pool gave up in a crash loop. If a stop signal
+            arrives, returns the result of the master's handler for it,
+            once the workers have exited (the default
+            `DaemonContext.terminate` raises `SystemExit` instead).
+        """
+        handlers = {signal.SIGCHLD: _ignore_signal}
+        for signal_number, handler in self.signal_handlers.items():
+            if not callable(handler):
+                handlers[signal_number] = handler
+            elif signal_number == signal.SIGCHLD:
+                # The workers' own children are theirs to handle.
+                handlers[signal_number] = self._child_exited
+            elif signal_number in self.stop_signals:
+                handlers[signal_number] = self._stop
+            elif signal_number == signal.SIGHUP:
+                handlers[signal_number] = self._reload
+            else:
+                handlers[signal_number] = self._forward
+
+        self._dispatcher = SignalDispatcher(handlers)
+        self._dispatcher.install()
+        try:
+            for index in range(self.count):
+                self._spawn(index)
+
+            while self.workers or self._restart_at:
+                try:
+                    select.select([self._dispatcher.fileno()], [], [], self._next_timeout())
+                except (select.error, OSError) as exc:
+                    if getattr(exc, 'errno', exc.args[0] if exc.args else None) != errno.EINTR:
+                        raise
+
+                self._dispatcher.dispatch()
+                self._reap()
+
+                if self._stopping:
+                    if self.workers and _monotonic() >= self._stop_deadline:
+                        self._signal_workers(signal.SIGKILL)
+                        self._stop_deadline = float('inf')
+                    continue
+
+                now = _monotonic()
+                for index, when in list(self._restart_at.items()):
+                    if when <= now:
+                        del self._restart_at[index]
+                        self.restarts += 1
+                        self._restart_times.append(now)
+                        self._spawn(index)
+        finally:
+            self._dispatcher.close()
+            self._dispatcher = None
+            if self.workers:
+                self._terminate_workers()
+            self._wake_reload_waiters()
+
+        handler = self.signal_handlers.get(self._stop_signal)
+        if callable(handler):
+            return handler(self._stop_signal, None)
+
+        if self.crash_loop:
+            return 1
+
+        return 0
+
+    def _next_timeout(self):
+        deadlines = list(self._restart_at.values())
+        if self._stopping and self.workers:
+            deadlines = [self._stop_deadline]
+        if not deadlines:
+            return None
+        return min(max(0, min(deadlines) - _monotonic()), 3600)
+
+    def _spawn(self, index):
+        """ Fork a worker process for slot `index`. """
+        pid = os.fork()
+        if pid != 0:
+            self.workers[pid] = index
+            self._started[pid] = _monotonic()
+            return pid
+
+        status = 1
+        try:
+            self._dispatcher.close()
+            reset_signal_wakeup_fd()
+            clear_exit_handlers()
+            self.workers = {}
+            status = self.target(index) or 0
+        except SystemExit as exc:
+            status = get_exit_status(exc)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            self.exit_handler(status)
+
+    def _reap(self):
+        """ Collect exited workers, scheduling restarts for those that failed. """
+        for pid in list(self.workers):
+            try:
+                waited, status = os.waitpid(pid, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno != errno.ECHILD:
+                    raise
+                waited, status = pid, 0
+
+            if waited == 0:
+                continue
+
+            index = self.workers.pop(pid)
+            self._started.pop(pid, None)
+            self.last_status[index] = status
+            code = _returncode(status)
+            self.exit_codes[code] = self.exit_codes.get(code, 0) + 1
+
+            if code != 0 and not self._stopping:
+                self._schedule_restart(index, pid, status)
+
+    def _schedule_restart(self, index, pid, status):
+        """ Schedule a new worker for slot `index`, unless in a crash loop. """
+        now = _monotonic()
+        window_start = now - self.crash_loop_interval
+
+        restart_times = self._restart_times
+        while restart_times and restart_times[0] < window_start:
+            restart_times.popleft()
+        if self.crash_loop_restarts is not None and len(restart_times) >= self.crash_loop_restarts:
+            self._report('Worker {:d} (pid {:d}) {}; {:d} restarts in {} seconds, giving up'.format(
+                index, pid, _describe_status(status), len(restart_times), self.crash_loop_interval))
+            self.crash_loop = True
+            self._shut_down(signal.SIGTERM)
+            return
+
+        failures = [when for when in self._failures.get(index, []) if when >= window_start]
+        failures.append(now)
+        self._failures[index] = failures
+
+        delay = min(self.restart_delay * 2 ** (len(failures) - 1), self.max_restart_delay)
+        delay *= 1 + random.uniform(-self.restart_jitter, self.restart_jitter)
+        self._report('Worker {:d} (pid {:d}) {}; restarting in {:.3f} seconds'.format(
+            index, pid, _describe_status(status), delay))
+        self._restart_at[index] = now + delay
+
+    def _report(self, message):
+        self.last_message = message
+        self.report(message)
+
+    def _child_exited(self, signal_number, stack_frame):
+        """ Collect exited workers, then run the master's own handler. """
+        self._reap()
+        self.signal_handlers[signal_number](signal_number, stack_frame)
+
+    def _signal_workers(self, signal_number):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal_number)
+            except OSError as exc:
+                if exc.errno != errno.ESRCH:
+                    raise
+
+    def _forward(self, signal_number, stack_frame):
+        """ Send a signal on to the workers, then handle it in the master. """
+        self._signal_workers(signal_number)
+        self.signal_handlers[signal_number](signal_number, stack_frame)
+
+    def _reload(self, signal_number, stack_frame):
+        """ Forward ``SIGHUP``, then wake the callers of `reload` waiting for it. """
+        with self._lock:
+            waiters, self._reload_waiters = self._reload_waiters, []
+        try:
+            self._forward(signal_number, stack_frame)
+        finally:
+            for waiter in waiters:
+                waiter.set()
+
+    def _wake_reload_waiters(self):
+        with self._lock:
+            waiters, self._reload_waiters = self._reload_waiters, []
+        for waiter in waiters:
+            waiter.set()
+
+    def _stop(self, signal_number, stack_frame):
+        """ Stop the pool, sending a stop signal on to the workers. """
+        if not self._stopping:
+            self._stop_signal = signal_number
+        self._shut_down(signal_number)
+
+    def _shut_down(self, signal_number):
+        """ Stop restarting workers, and send `signal_number` to them. """
+        if not self._stopping:
+            self._stopping = True
+            self._stop_deadline = _monotonic() + self.stop_timeout
+            self._restart_at = {}
+        self._signal_workers(signal_number)
+
+    def _terminate_workers(self):
+        """ Terminate remaining workers, waiting for them to exit. """
+        self._signal_workers(signal.SIGTERM)
+        deadline = _monotonic() + self.stop_timeout
+        delay = 0.001
+        while self.workers:
+            self._stopping = True
+            self._reap()
+            if not self.workers:
+                break
+            if _monotonic() >= deadline:
+                self._signal_workers(signal.SIGKILL)
+                deadline = float('inf')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def reload(self, timeout=None):
+        """ Reload the workers and the master, as if sent ``SIGHUP``.
+
+            Safe to call from any thread while the pool is running:
+            ``SIGHUP`` is queued on the pool's self-pipe, and handled
+            by the master as it would be if it had arrived, then this
+            waits up to `timeout` seconds (``None`` for no limit) for
+            that to finish. Returns ``False`` if it has not, otherwise
+            ``True`` (including when the pool stopped first).
+
+            Raises `ValueError` if the pool is not running, or has no
+            handler to reload with.
+        """
+        dispatcher = self._dispatcher
+        if dispatcher is None:
+            raise ValueError('Worker pool is not running')
+        if dispatcher.handlers.get(signal.SIGHUP) != self._reload:
+            raise ValueError('No handler for SIGHUP in signal_handlers')
+
+        waiter = threading.Event()
+        with self._lock:
+            self._reload_waiters.append(waiter)
+        dispatcher.post(signal.SIGHUP)
+        return waiter.wait(timeout)
+
+    def stop(self, signal_number=signal.SIGTERM):
+        """ Stop the pool from the master, as if sent `signal_number`. """
+        self._stop(signal_number, None)
+
+    def as_dict(self):
+        """ Return the worker PIDs, restart count and exit code counts.
+
+            Exit codes are as for `subprocess.Popen.returncode`. Also
+            includes `last_message`, as ``'last_message'``.
+        """
+        return {
+            'workers': dict((index, pid) for pid, index in dict(self.workers).items()),
+            'restarts': self.restarts,
+            'exit_codes': dict(self.exit_codes),
+            'crash_loop': self.crash_loop,
+            'last_message': self.last_message,
+        }
+
+
+def _write_to_stderr(message):
+    """ Write `message` as a line to `sys.stderr`, ignoring any errors. """
+    try:
+        sys.stderr.write(message + '\n')
+        sys.stderr.flush()
+    except (AttributeError, IOError, OSError, ValueError):
+        pass
+
+
+def _ignore_signal(signal_number, stack_frame):
+    """ Handler for `SIGCHLD`, which only needs to wake the master. """
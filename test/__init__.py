@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# test/__init__.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for the `daemon` package.
+
+    Run with ``python -m unittest discover -t . -s test`` (or ``pytest test``)
+    on Linux; the tests fork processes of their own.
+"""
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import contextlib
+import os
+import signal
+import sys
+import traceback
+
+
+def fork_child(function):
+    """ Fork a process which calls `function`, then exits.
+
+        The child exits with status 0 if `function` returns, or 1 if
+        it raises. Returns the PID of the child.
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    status = 1
+    try:
+        function()
+        status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(status)
+
+
+def kill_child(pid):
+    """ Kill the child process `pid`, if still running, and reap it. """
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    try:
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def system_streams():
+    """ Put the original standard streams back in `sys` while in the context.
+
+        A test runner capturing output may have replaced them with
+        objects a daemon cannot redirect.
+    """
+    streams = sys.stdin, sys.stdout, sys.stderr
+    sys.stdin, sys.stdout, sys.stderr = sys.__stdin__, sys.__stdout__, sys.__stderr__
+    try:
+        yield
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = streams
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# test/test_aio.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.aio`, on daemons started by `DaemonRunner`. """
+
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+from daemon.daemon import is_process_running
+from daemon.runner import DaemonRunner, DaemonRunnerResultError, DaemonRunnerStopFailureError
+
+from . import kill_child, system_streams
+
+
+class SleepingRunner(DaemonRunner):
+    """ Runner whose daemon sleeps until stopped. """
+
+    def run(self):
+        time.sleep(60)
+
+
+class ResultRunner(DaemonRunner):
+    """ Runner whose daemon returns a result. """
+
+    def run(self):
+        time.sleep(0.2)
+        return {'answer': 42}
+
+
+class FailingRunner(DaemonRunner):
+    """ Runner whose daemon fails. """
+
+    def run(self):
+        raise RuntimeError('daemon failed')
+
+
+class aio_TestCase(unittest.TestCase):
+    """ Test cases for `DaemonRunner.astart`, `astop` and `astatus`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.pidfile_path = os.path.join(self.directory, 'daemon.pid')
+        self.pids = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.pids:
+            kill_child(pid)
+        shutil.rmtree(self.directory)
+
+    def runner(self, runner_class=SleepingRunner, **context_kwargs):
+        return runner_class(pidfile=self.pidfile_path, force_detach=True, context_kwargs=context_kwargs)
+
+    async def start(self, runner):
+        with system_streams():
+            handle = await runner.astart(ready_timeout=10)
+        self.pids.append(handle.pid)
+        return handle
+
+    def test_start_and_stop(self):
+        """ Should start a daemon, and stop it once it is waited for. """
+        async def scenario():
+            runner = self.runner()
+            handle = await self.start(runner)
+            self.assertTrue(handle.alive)
+            status = await runner.astatus()
+            self.assertEqual(status, {'pid': handle.pid, 'alive': True, 'stale': False})
+
+            self.assertFalse(await handle.wait(0.05))
+            elapsed = await runner.astop(timeout=10)
+            self.assertIsInstance(elapsed, float)
+            self.assertLess(elapsed, 10)
+            self.assertTrue(await handle.wait(1))
+            self.assertFalse(is_process_running(handle.pid))
+            self.assertIsNone(await runner.astop())
+
+        asyncio.run(scenario())
+
+    def test_stop_escalates(self):
+        """ Should kill a daemon which ignores the stop signal, once the timeout passes. """
+        async def scenario():
+            runner = self.runner(signal_map={signal.SIGTERM: None})
+            handle = await self.start(runner)
+            elapsed = await runner.astop(timeout=0.3)
+            self.assertGreaterEqual(elapsed, 0.3)
+            self.assertTrue(await handle.wait(1))
+            self.assertFalse(os.path.exists(self.pidfile_path))
+
+        asyncio.run(scenario())
+
+    def test_stop_without_escalation(self):
+        """ Should raise `DaemonRunnerStopFailureError` if the daemon stays and may not be killed. """
+        async def scenario():
+            runner = self.runner(signal_map={signal.SIGTERM: None})
+            handle = await self.start(runner)
+            with self.assertRaises(DaemonRunnerStopFailureError):
+                await runner.astop(timeout=0.2, escalate_to=None)
+            self.assertTrue(handle.alive)
+
+        asyncio.run(scenario())
+
+    def test_result(self):
+        """ Should await the daemon's exit status and result. """
+        async def scenario():
+            handle = await self.start(self.runner(ResultRunner))
+            self.assertIsNone(handle.exit_code)
+            self.assertEqual(await handle.result(timeout=10), {'answer': 42})
+            self.assertEqual(handle.exit_code, 0)
+            self.assertFalse(handle.alive)
+            self.assertIsNone(handle.readiness.read_fd)
+
+        asyncio.run(scenario())
+
+    def test_result_of_failed_daemon(self):
+        """ Should raise `DaemonRunnerResultError` if the daemon fails. """
+        async def scenario():
+            handle = await self.start(self.runner(FailingRunner))
+            with self.assertRaises(DaemonRunnerResultError):
+                await handle.result(timeout=10)
+
+        asyncio.run(scenario())
+
+    def test_stop_by_control_keeps_loop_running(self):
+        """ Should run other tasks while asking the control server to stop the daemon. """
+        async def scenario():
+            runner = self.runner(control=True)
+            handle = await self.start(runner)
+            ticks = []
+
+            async def tick():
+                while True:
+                    ticks.append(time.time())
+                    await asyncio.sleep(0.001)
+
+            ticker = asyncio.ensure_future(tick())
+            try:
+                await asyncio.sleep(0)
+                before = len(ticks)
+                await runner.astop(timeout=10)
+                self.assertGreater(len(ticks), before)
+            finally:
+                ticker.cancel()
+            self.assertTrue(await handle.wait(1))
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# test/test_control.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.control`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from daemon.control import ControlClient, ControlError, ControlServer, ControlUnavailableError
+from daemon.handoff import receive_message, send_message
+
+
+class ControlServer_TestCase(unittest.TestCase):
+    """ Test cases for `ControlServer` and `ControlClient`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'control.sock')
+        self.deferred = []
+        self.commands = {
+            'echo': lambda **args: args,
+            'fail': self.fail_command,
+            'sleep': lambda seconds: time.sleep(seconds),
+            'defer': lambda: self.server.defer(lambda: self.deferred.append('done')),
+        }
+        self.server = ControlServer(self.path, self.commands, timeout=0.5)
+        self.server.start()
+        self.client = ControlClient(self.path, timeout=5)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def fail_command(self):
+        raise ValueError('bad argument')
+
+    def test_round_trip(self):
+        """ Should return the command's result. """
+        self.assertEqual(self.client.request('echo', name='value', count=2), {'name': 'value', 'count': 2})
+
+    def test_socket_accessible_to_owner_only(self):
+        """ Should create the socket readable and writable by its owner only. """
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), stat.S_IRUSR | stat.S_IWUSR)
+
+    def test_unknown_command(self):
+        """ Should raise `ControlError` for an unknown command. """
+        with self.assertRaises(ControlError) as context:
+            self.client.request('bogus')
+        self.assertIn('Unknown command: bogus', '{!s}'.format(context.exception))
+
+    def test_failed_command(self):
+        """ Should raise `ControlError` with the command's exception. """
+        with self.assertRaises(ControlError) as context:
+            self.client.request('fail')
+        self.assertIn('ValueError: bad argument', '{!s}'.format(context.exception))
+
+    def test_command_timeout(self):
+        """ Should answer with an error once a command runs past the timeout. """
+        with self.assertRaises(ControlError) as context:
+            self.client.request('sleep', seconds=2)
+        self.assertIn('did not finish', '{!s}'.format(context.exception))
+
+    def test_commands_added_later(self):
+        """ Should serve commands added to the mapping after starting. """
+        self.commands['later'] = lambda: 'served'
+        self.assertEqual(self.client.request('later'), 'served')
+
+    def test_deferred_action(self):
+        """ Should run a deferred action once the answer is sent. """
+        self.client.request('defer')
+        deadline = time.time() + 5
+        while not self.deferred and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.deferred, ['done'])
+
+    def test_requests_on_one_connection(self):
+        """ Should answer each request on a connection until it closes. """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        try:
+            sock.connect(self.path)
+            for count in range(3):
+                send_message(sock, {'command': 'echo', 'args': {'count': count}})
+                reply, _ = receive_message(sock)
+                self.assertEqual(reply, {'ok': True, 'result': {'count': count}})
+        finally:
+            sock.close()
+
+    def test_idle_client_does_not_block(self):
+        """ Should answer others while a client sends nothing, then drop it. """
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.settimeout(5)
+        try:
+            idle.connect(self.path)
+            started = time.time()
+            self.assertEqual(self.client.request('echo'), {})
+            self.assertLess(time.time() - started, self.server.timeout)
+            self.assertEqual(idle.recv(1), b'')
+        finally:
+            idle.close()
+
+    def test_concurrent_clients(self):
+        """ Should answer clients on several threads. """
+        results = []
+
+        def request(index):
+            results.append(ControlClient(self.path, timeout=5).request('echo', index=index))
+
+        threads = [threading.Thread(target=request, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(result['index'] for result in results), list(range(8)))
+
+    def test_close_removes_socket(self):
+        """ Should remove the socket file on close, and then be unavailable. """
+        self.server.close()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertRaises(ControlUnavailableError, self.client.request, 'echo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+
+# test/test_daemon.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.daemon`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import errno
+import gc
+import json
+import os
+import pty
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+from daemon.daemon import (
+    DaemonContext, ProcessEnvironment, ProcessHandle, StartupTimings, _get_libc_close_range, close_all_open_files,
+    close_fds_strategies, detect_process_environment, prepare_for_fork,
+)
+from daemon.pidlockfile import FcntlPIDLockFile
+from daemon.workers import WorkerPool
+
+from . import fork_child, kill_child, system_streams
+
+
+class ProcessEnvironment_detach_mode_TestCase(unittest.TestCase):
+    """ Test cases for `ProcessEnvironment.detach_mode`. """
+
+    scenarios = [
+        ('interactive', {}, 'double'),
+        ('init', {'started_by_init': True}, 'none'),
+        ('inetd', {'started_by_superserver': True}, 'none'),
+        ('container', {'container_init': True}, 'none'),
+        ('notify socket', {'notify_socket': True}, 'none'),
+        ('socket activated', {'socket_activated': True}, 'none'),
+        ('group member', {'process_group_leader': False, 'controlling_terminal': False}, 'single'),
+        ('group member with terminal', {'process_group_leader': False}, 'double'),
+        ('group leader without terminal', {'controlling_terminal': False}, 'double'),
+        ('managed group member', {'process_group_leader': False, 'controlling_terminal': False,
+                                  'started_by_init': True}, 'none'),
+    ]
+
+    def test_detach_mode(self):
+        """ Should detach unless the process is managed, with one fork if no terminal is involved. """
+        for name, properties, expected_mode in self.scenarios:
+            environment = ProcessEnvironment(**properties)
+            self.assertEqual(environment.detach_mode, expected_mode, name)
+            self.assertEqual(environment.as_dict()['detach_mode'], expected_mode, name)
+
+
+class detect_process_environment_TestCase(unittest.TestCase):
+    """ Test cases for `detect_process_environment` function. """
+
+    variables = ['NOTIFY_SOCKET', 'LISTEN_PID', 'INVOCATION_ID', 'UPSTART_JOB', 'SUPERVISOR_ENABLED']
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.saved = dict((name, os.environ.pop(name)) for name in self.variables if name in os.environ)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for name in self.variables:
+            os.environ.pop(name, None)
+        os.environ.update(self.saved)
+        detect_process_environment(refresh=True)
+
+    def detect(self, **environ):
+        os.environ.update(environ)
+        return detect_process_environment(refresh=True)
+
+    def test_notify_socket(self):
+        """ Should not detach when given a notification socket as the main process. """
+        environment = self.detect(NOTIFY_SOCKET='/run/systemd/notify', LISTEN_PID='{:d}'.format(os.getpid()))
+        self.assertTrue(environment.notify_socket)
+        self.assertEqual(environment.detach_mode, 'none')
+
+    def test_inherited_notify_socket(self):
+        """ Should detach when the notification socket is inherited from a service. """
+        self.assertNotEqual(os.getppid(), 1)
+        environment = self.detect(NOTIFY_SOCKET='/run/systemd/notify')
+        self.assertFalse(environment.notify_socket)
+        self.assertNotEqual(environment.detach_mode, 'none')
+        self.assertNotEqual(DaemonContext().detach_mode, 'none')
+
+    def test_socket_activated(self):
+        """ Should not detach when passed sockets meant for this process. """
+        environment = self.detect(LISTEN_PID='{:d}'.format(os.getpid()))
+        self.assertTrue(environment.socket_activated)
+        self.assertEqual(environment.detach_mode, 'none')
+
+    def test_sockets_for_another_process(self):
+        """ Should ignore sockets meant for another process. """
+        environment = self.detect(LISTEN_PID='{:d}'.format(os.getpid() + 1))
+        self.assertFalse(environment.socket_activated)
+
+    def test_inherited_markers(self):
+        """ Should ignore variables inherited by every descendant of a service. """
+        environment = self.detect(INVOCATION_ID='0123', UPSTART_JOB='job', SUPERVISOR_ENABLED='1')
+        self.assertFalse(environment.notify_socket)
+        self.assertFalse(environment.socket_activated)
+
+    def detect_in_new_session(self, terminal):
+        """ Return the detach mode detected in a new session, by a process not leading its group. """
+        read_fd, write_fd = os.pipe()
+
+        def grandchild():
+            null_fd = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(null_fd, 0)
+            os.write(write_fd, detect_process_environment(refresh=True).detach_mode.encode('ascii'))
+
+        def child():
+            pid = fork_child(grandchild)
+            assert os.waitpid(pid, 0)[1] == 0
+
+        master_fd = None
+        if terminal:
+            # The child leads a new session, with the terminal as its controlling terminal.
+            pid, master_fd = pty.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    child()
+                    status = 0
+                finally:
+                    os._exit(status)
+        else:
+            pid = fork_child(lambda: (os.setsid(), child()))
+
+        try:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        finally:
+            if master_fd is not None:
+                os.close(master_fd)
+        os.close(write_fd)
+        try:
+            return os.read(read_fd, 100).decode('ascii')
+        finally:
+            os.close(read_fd)
+
+    def test_single(self):
+        """ Should detach with one fork when not a process group leader, with no controlling terminal. """
+        self.assertEqual(self.detect_in_new_session(terminal=False), 'single')
+
+    def test_controlling_terminal(self):
+        """ Should detach with two forks when there is a controlling terminal. """
+        self.assertEqual(self.detect_in_new_session(terminal=True), 'double')
+
+    def test_cached(self):
+        """ Should detect once, until refreshed. """
+        environment = self.detect()
+        self.assertIs(detect_process_environment(), environment)
+        os.environ['NOTIFY_SOCKET'] = '/run/systemd/notify'
+        self.assertIs(detect_process_environment(), environment)
+        self.assertIsNot(detect_process_environment(refresh=True), environment)
+
+
+class DaemonContext_detach_mode_TestCase(unittest.TestCase):
+    """ Test cases for the `detach_process` option of `DaemonContext`. """
+
+    scenarios = [
+        (True, True, 'double'),
+        ('double', 'double', 'double'),
+        ('single', 'single', 'single'),
+        (False, False, 'none'),
+    ]
+
+    def test_explicit_detach_process(self):
+        """ Should set `detach_mode` from an explicit `detach_process`. """
+        for detach_process, expected_detach_process, expected_mode in self.scenarios:
+            context = DaemonContext(detach_process=detach_process)
+            self.assertEqual(context.detach_process, expected_detach_process)
+            self.assertEqual(context.detach_mode, expected_mode)
+
+    def test_unknown_detach_process(self):
+        """ Should raise `ValueError` for an unknown way to detach. """
+        self.assertRaises(ValueError, DaemonContext, detach_process='triple')
+
+    def test_detected_detach_process(self):
+        """ Should follow the detected environment by default. """
+        context = DaemonContext()
+        expected_mode = detect_process_environment().detach_mode
+        self.assertEqual(context.detach_mode, expected_mode)
+        self.assertEqual(bool(context.detach_process), expected_mode != 'none')
+
+
+class DaemonContext_notifier_TestCase(unittest.TestCase):
+    """ Test cases for the `notifier` created by `DaemonContext.open`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'notify')
+        self.manager = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.manager.settimeout(5)
+        self.manager.bind(self.address)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.manager.close()
+        shutil.rmtree(self.directory)
+
+    def open_in_child(self, service_main, **kwargs):
+        """ Open a context in a child with `NOTIFY_SOCKET` set, and return its status. """
+        def child():
+            os.environ['NOTIFY_SOCKET'] = self.address
+            os.environ.pop('LISTEN_PID', None)
+            if service_main:
+                # As if the service manager passed no sockets to this process.
+                os.environ['LISTEN_PID'] = '{:d}'.format(os.getpid())
+                os.environ['LISTEN_FDS'] = '0'
+
+            # Opened here, as there may be no `os.devnull` in a new root.
+            null = open(os.devnull, 'w+')
+            context = DaemonContext(detach_process=False, stdin=null, stdout=null, stderr=null, **kwargs)
+            with system_streams():
+                context.open()
+            if service_main:
+                assert context.notifier
+                assert 'NOTIFY_SOCKET' not in os.environ
+            else:
+                assert context.notifier is None
+                assert os.environ['NOTIFY_SOCKET'] == self.address
+
+        pid = fork_child(child)
+        return os.waitpid(pid, 0)[1]
+
+    def test_service_main(self):
+        """ Should notify the service manager, and unset `NOTIFY_SOCKET`. """
+        self.assertEqual(self.open_in_child(True), 0)
+        self.assertEqual(self.manager.recv(4096), b'READY=1')
+
+    def test_inherited(self):
+        """ Should not notify through a `NOTIFY_SOCKET` inherited from an ancestor. """
+        self.assertEqual(self.open_in_child(False), 0)
+        self.manager.settimeout(0.2)
+        self.assertRaises(socket.timeout, self.manager.recv, 4096)
+
+    @unittest.skipUnless(os.geteuid() == 0, 'requires root to change root directory')
+    def test_chroot(self):
+        """ Should reach a `NOTIFY_SOCKET` outside the new root directory. """
+        root = os.path.join(self.directory, 'root')
+        os.mkdir(root)
+        self.assertEqual(self.open_in_child(True, chroot_directory=root), 0)
+        self.assertEqual(self.manager.recv(4096), b'READY=1')
+
+
+class StartupTimings_TestCase(unittest.TestCase):
+    """ Test cases for `StartupTimings`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'timings.json')
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        """ Should record each phase, and the figures reported with them. """
+        timings = StartupTimings()
+        timings('umask', 0.001)
+        timings('close_files', 0.002, fds_closed=7)
+        timings('pidfile', 0.5, lock_wait=0.4)
+        timings('open', 0.6)
+        self.assertEqual(timings.as_dict(), {
+            'pid': os.getpid(),
+            'phases': [
+                {'phase': 'umask', 'seconds': 0.001},
+                {'phase': 'close_files', 'seconds': 0.002},
+                {'phase': 'pidfile', 'seconds': 0.5},
+            ],
+            'total': 0.6,
+            'fds_closed': 7,
+            'lock_wait': 0.4,
+        })
+
+    def test_write(self):
+        """ Should append the record as a line of JSON once `open` completes. """
+        timings = StartupTimings(self.path)
+        timings('umask', 0.001)
+        timings('open', 0.002)
+        timings('open', 0.003)
+        with open(self.path) as fp:
+            records = [json.loads(line) for line in fp]
+        self.assertEqual([record['total'] for record in records], [0.002, 0.003])
+        self.assertEqual(records[0]['phases'], [{'phase': 'umask', 'seconds': 0.001}])
+
+
+class DaemonContext_startup_timings_TestCase(unittest.TestCase):
+    """ Test cases for the `startup_timings` option of `DaemonContext`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.pidfile_path = os.path.join(self.directory, 'test.pid')
+        self.timings_path = os.path.join(self.directory, 'timings.json')
+        self.calls_path = os.path.join(self.directory, 'calls.json')
+        self.children = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.children:
+            kill_child(pid)
+        shutil.rmtree(self.directory)
+
+    def open_in_child(self, extra_fds=0):
+        """ Open a context in a child, with a `StartupTimings` and a callback, and wait for it. """
+        def child():
+            for _ in range(extra_fds):
+                os.open(os.devnull, os.O_RDONLY)
+
+            calls = []
+            timings = StartupTimings(self.timings_path)
+
+            def record(phase, seconds, **info):
+                calls.append([phase, seconds, info])
+                timings(phase, seconds, **info)
+
+            null = open(os.devnull, 'w+')
+            context = DaemonContext(
+                detach_process=False, stdin=null, stdout=null, stderr=null,
+                pidfile=FcntlPIDLockFile(self.pidfile_path, acquire_timeout=10), startup_timings=record)
+            with system_streams():
+                context.open()
+            with open(self.calls_path, 'w') as fp:
+                json.dump(calls, fp)
+
+        pid = fork_child(child)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        with open(self.calls_path) as fp:
+            calls = json.load(fp)
+        with open(self.timings_path) as fp:
+            record, = [json.loads(line) for line in fp]
+        return calls, record
+
+    def test_phases(self):
+        """ Should report each phase in order, then the total. """
+        calls, record = self.open_in_child(extra_fds=3)
+        phases = [phase for phase, _, _ in calls]
+        self.assertEqual(phases, [
+            'prevent_core', 'umask', 'chdir', 'owner', 'signals', 'close_files', 'streams', 'pidfile', 'open'])
+        for _, seconds, _ in calls:
+            self.assertGreaterEqual(seconds, 0)
+        self.assertGreaterEqual(calls[-1][1], sum(seconds for _, seconds, _ in calls[:-1]))
+
+        info = dict((phase, call_info) for phase, _, call_info in calls)
+        self.assertGreaterEqual(info['close_files']['fds_closed'], 3)
+        self.assertLess(info['pidfile']['lock_wait'], 0.2)
+
+        self.assertEqual([entry['phase'] for entry in record['phases']], phases[:-1])
+        self.assertEqual(record['fds_closed'], info['close_files']['fds_closed'])
+        self.assertEqual(record['lock_wait'], info['pidfile']['lock_wait'])
+        self.assertEqual(record['total'], calls[-1][1])
+        self.assertNotEqual(record['pid'], os.getpid())
+
+    def test_lock_wait(self):
+        """ Should report the time spent waiting for the PID file lock, not the whole phase. """
+        def hold():
+            lock = FcntlPIDLockFile(self.pidfile_path)
+            lock.acquire()
+            time.sleep(0.3)
+
+        holder = fork_child(hold)
+        self.children.append(holder)
+        lock = FcntlPIDLockFile(self.pidfile_path)
+        while not lock.is_locked():
+            time.sleep(0.01)
+
+        calls, record = self.open_in_child()
+        pidfile_seconds = [seconds for phase, seconds, _ in calls if phase == 'pidfile'][0]
+        self.assertGreaterEqual(record['lock_wait'], 0.1)
+        self.assertLessEqual(record['lock_wait'], pidfile_seconds)
+
+
+class DaemonContext_preload_TestCase(unittest.TestCase):
+    """ Test cases for the `preload_modules` and `warm_up` options of `DaemonContext`. """
+
+    module_name = 'daemon_test_preloaded'
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.imports_path = os.path.join(self.directory, 'imports')
+        self.warm_ups_path = os.path.join(self.directory, 'warm_ups')
+        with open(os.path.join(self.directory, self.module_name + '.py'), 'w') as fp:
+            fp.write('import os\n')
+            fp.write('with open({!r}, "a") as fp:\n'.format(self.imports_path))
+            fp.write('    fp.write("{:d}\\n".format(os.getpid()))\n')
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.directory)
+
+    def read_pids(self, path):
+        with open(path) as fp:
+            return [int(line) for line in fp]
+
+    def test_preloaded_before_workers_fork(self):
+        """ Should import the modules and warm up once in the master, before workers fork. """
+        def warm_up():
+            with open(self.warm_ups_path, 'a') as fp:
+                fp.write('{:d}\n'.format(os.getpid()))
+
+        def work(index):
+            report = {
+                'pid': os.getpid(),
+                'imported': self.module_name in sys.modules,
+                'frozen': getattr(gc, 'get_freeze_count', lambda: None)(),
+            }
+            with open(os.path.join(self.directory, 'worker-{:d}.json'.format(index)), 'w') as fp:
+                json.dump(report, fp)
+            return 0
+
+        def master():
+            sys.path.insert(0, self.directory)
+            null = open(os.devnull, 'w+')
+            context = DaemonContext(
+                detach_process=False, stdin=null, stdout=null, stderr=null,
+                preload_modules=[self.module_name], warm_up=warm_up)
+            with system_streams():
+                context.open()
+            with open(os.path.join(self.directory, 'master'), 'w') as fp:
+                fp.write('{:d}\n'.format(os.getpid()))
+            assert WorkerPool(work, 2).run() == 0
+
+        pid = fork_child(master)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+        master_pid, = self.read_pids(os.path.join(self.directory, 'master'))
+        self.assertEqual(self.read_pids(self.imports_path), [master_pid])
+        self.assertEqual(self.read_pids(self.warm_ups_path), [master_pid])
+        for index in range(2):
+            with open(os.path.join(self.directory, 'worker-{:d}.json'.format(index))) as fp:
+                report = json.load(fp)
+            self.assertNotEqual(report['pid'], master_pid)
+            self.assertTrue(report['imported'])
+            if hasattr(gc, 'freeze'):
+                self.assertGreater(report['frozen'], 0)
+
+
+class prepare_for_fork_TestCase(unittest.TestCase):
+    """ Test cases for `prepare_for_fork`. """
+
+    @unittest.skipUnless(hasattr(gc, 'freeze'), 'requires gc.freeze')
+    def test_freeze(self):
+        """ Should move the surviving objects to the permanent generation. """
+        def child():
+            gc.unfreeze()
+            prepare_for_fork(malloc_trim=True)
+            assert gc.get_freeze_count() > 0
+
+        pid = fork_child(child)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+
+class close_all_open_files_TestCase(unittest.TestCase):
+    """ Test cases for the strategies of `close_all_open_files`. """
+
+    max_fds = 256
+
+    def is_open(self, fd):
+        try:
+            os.fstat(fd)
+        except OSError as exc:
+            if exc.errno == errno.EBADF:
+                return False
+            raise
+        return True
+
+    def close_in_child(self, strategy):
+        """ Close descriptors with `strategy` in a child; check what is left open.
+
+            The child lowers its limit to `max_fds`, and opens
+            descriptors next to and between the excluded ones, in the
+            gaps and up to the top of the range.
+        """
+        def check():
+            resource.setrlimit(resource.RLIMIT_NOFILE, (self.max_fds, self.max_fds))
+            top = self.max_fds - 1
+            exclude = set([0, 1, 2, 7, 8, 100, top - 1])
+
+            base = os.open(os.devnull, os.O_RDONLY)
+            for fd in [3, 6, 7, 8, 9, 99, 100, 101, 150, top - 2, top - 1, top]:
+                if fd != base:
+                    os.dup2(base, fd)
+            if base not in exclude:
+                os.close(base)
+                os.dup2(7, base)
+
+            close_all_open_files(exclude=exclude, strategy=strategy)
+
+            still_open = set(fd for fd in range(self.max_fds) if self.is_open(fd))
+            assert still_open == exclude, 'open after closing: {!r}'.format(sorted(still_open))
+
+        pid = fork_child(check)
+        _, status = os.waitpid(pid, 0)
+        self.assertTrue(os.WIFEXITED(status), strategy)
+        self.assertEqual(os.WEXITSTATUS(status), 0, strategy)
+
+    def test_close_range(self):
+        """ Should close all but the excluded descriptors with `close_range`. """
+        if _get_libc_close_range() is None:
+            self.skipTest('close_range is not supported')
+        self.close_in_child('close_range')
+
+    def test_proc(self):
+        """ Should close all but the excluded descriptors listed in `/proc`. """
+        if not os.path.isdir('/proc/self/fd'):
+            self.skipTest('/proc/self/fd is not available')
+        self.close_in_child('proc')
+
+    def test_closerange(self):
+        """ Should close all but the excluded descriptors with `os.closerange` over the gaps. """
+        self.close_in_child('closerange')
+
+    def test_sweep(self):
+        """ Should close all but the excluded descriptors, trying each one. """
+        self.close_in_child('sweep')
+
+    def test_default(self):
+        """ Should close all but the excluded descriptors with the detected strategy. """
+        self.close_in_child(None)
+
+    def test_every_strategy_covered(self):
+        """ Should have a test for each strategy. """
+        for name in close_fds_strategies:
+            self.assertTrue(hasattr(self, 'test_{}'.format(name)), name)
+
+    def test_unknown_strategy(self):
+        """ Should raise `ValueError` for an unknown strategy. """
+        self.assertRaises(ValueError, close_all_open_files, strategy='bogus')
+
+
+
+class ProcessHandle_TestCase(unittest.TestCase):
+    """ Test cases for `ProcessHandle`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.pid')
+        self.reads = 0
+        self.pid = fork_child(lambda: time.sleep(60))
+        self.pids = [self.pid]
+        self.write_pid(self.pid)
+        self.handle = ProcessHandle(self.path, self.read_pid)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.handle.close()
+        for pid in self.pids:
+            kill_child(pid)
+        shutil.rmtree(self.directory)
+
+    def read_pid(self):
+        self.reads += 1
+        with open(self.path) as fp:
+            return int(fp.read())
+
+    def write_pid(self, pid, mtime=None):
+        with open(self.path, 'w') as fp:
+            fp.write('{:d}\n'.format(pid))
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_alive(self):
+        """ Should find the process named in the PID file running. """
+        self.handle.refresh()
+        self.assertEqual(self.handle.pid, self.pid)
+        self.assertTrue(self.handle.alive)
+
+    def test_exited(self):
+        """ Should find the process not running once it exits. """
+        self.handle.refresh()
+        kill_child(self.pid)
+        self.assertFalse(self.handle.alive)
+
+    def test_cached(self):
+        """ Should not read the PID file again while it is unchanged. """
+        for _ in range(3):
+            self.handle.refresh()
+            self.assertTrue(self.handle.alive)
+        self.assertEqual(self.reads, 1)
+
+    def test_rewritten(self):
+        """ Should read the PID file again once it changes. """
+        self.handle.refresh()
+        other_pid = fork_child(lambda: time.sleep(60))
+        self.pids.append(other_pid)
+        self.write_pid(other_pid, mtime=time.time() + 5)
+        self.handle.refresh()
+        self.assertEqual(self.reads, 2)
+        self.assertEqual(self.handle.pid, other_pid)
+        self.assertTrue(self.handle.alive)
+
+    def test_reused_pid(self):
+        """ Should treat a process started after the PID file was written as not running. """
+        self.write_pid(self.pid, mtime=time.time() - 100)
+        self.handle.refresh()
+        self.assertEqual(self.handle.pid, self.pid)
+        self.assertFalse(self.handle.alive)
+
+    def test_reused_pid_without_process_fd(self):
+        """ Should compare start times where there is no process file descriptor. """
+        self.handle.refresh()
+        self.handle.close()
+        self.assertTrue(self.handle.alive)
+
+        # As if the process exited and another took its PID.
+        self.handle.start_time -= 10
+        self.assertFalse(self.handle.alive)
+
+
+if __name__ == '__main__':
+    unittest.main()
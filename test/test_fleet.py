@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# test/test_fleet.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `DaemonFleet`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from daemon.runner import DaemonFleet, DaemonRunner, fleet_member_name
+
+from . import kill_child, system_streams
+
+
+class SleepingRunner(DaemonRunner):
+    """ Runner whose daemon sleeps until stopped. """
+
+    def run(self):
+        time.sleep(60)
+
+
+class StubRunner(object):
+    """ Stand-in for a runner, recording how many stop at once. """
+
+    def __init__(self, name, tracker, pid=100, error=None):
+        self.pidfile = name
+        self.pid = pid
+        self.alive = False
+        self.tracker = tracker
+        self.error = error
+
+    def stop(self, sig=None, wait=False, timeout=None, escalate_to=None):
+        self.tracker.enter()
+        try:
+            time.sleep(0.2)
+            if self.error is not None:
+                raise self.error
+            return 0.2
+        finally:
+            self.tracker.leave()
+
+
+class ConcurrencyTracker(object):
+    """ Counter of calls in progress, and the most at any one time. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.most = 0
+
+    def enter(self):
+        with self.lock:
+            self.current += 1
+            self.most = max(self.most, self.current)
+
+    def leave(self):
+        with self.lock:
+            self.current -= 1
+
+
+class DaemonFleet_TestCase(unittest.TestCase):
+    """ Test cases for `DaemonFleet` with stand-in runners. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.tracker = ConcurrencyTracker()
+
+    def test_names(self):
+        """ Should name runners by their PID file paths, unless given names. """
+        runners = [StubRunner('/run/a.pid', self.tracker), StubRunner('/run/b.pid', self.tracker)]
+        self.assertEqual(sorted(DaemonFleet(runners).runners), ['/run/a.pid', '/run/b.pid'])
+        self.assertEqual(sorted(DaemonFleet({'a': runners[0]}).runners), ['a'])
+        self.assertEqual(fleet_member_name(runners[0]), '/run/a.pid')
+
+    def test_concurrent(self):
+        """ Should run the action on up to `parallelism` runners at once. """
+        runners = [StubRunner('/run/{:d}.pid'.format(index), self.tracker) for index in range(8)]
+        started = time.time()
+        report = DaemonFleet(runners, parallelism=4).stop()
+        self.assertLess(time.time() - started, 0.2 * 8 / 2)
+        self.assertEqual(self.tracker.most, 4)
+        self.assertTrue(report['ok'])
+        self.assertEqual(len(report['daemons']), 8)
+
+    def test_report(self):
+        """ Should report each entry, and be ``'ok'`` only if every one is. """
+        runners = {
+            'good': StubRunner('/run/good.pid', self.tracker, pid=10),
+            'bad': StubRunner('/run/bad.pid', self.tracker, pid=20, error=RuntimeError('no way')),
+        }
+        report = DaemonFleet(runners).stop()
+        self.assertEqual(report['action'], 'stop')
+        self.assertFalse(report['ok'])
+        self.assertGreaterEqual(report['elapsed'], 0.2)
+        self.assertEqual(report['daemons']['good'], {'ok': True, 'pid': 10, 'elapsed': 0.2})
+        self.assertEqual(report['daemons']['bad'], {'ok': False, 'pid': 0, 'error': 'no way', 'elapsed': None})
+
+    def test_empty(self):
+        """ Should report success for no daemons. """
+        report = DaemonFleet([]).status()
+        self.assertTrue(report['ok'])
+        self.assertEqual(report['daemons'], {})
+
+
+class DaemonFleet_daemons_TestCase(unittest.TestCase):
+    """ Test cases for `DaemonFleet` controlling real daemons. """
+
+    count = 3
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.fleet = DaemonFleet([
+            SleepingRunner(pidfile=os.path.join(self.directory, '{:d}.pid'.format(index)), force_detach=True)
+            for index in range(self.count)
+        ])
+        self.pids = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.pids:
+            kill_child(pid)
+        shutil.rmtree(self.directory)
+
+    def start(self):
+        with system_streams():
+            report = self.fleet.start(ready_timeout=10)
+        self.pids.extend(entry['pid'] for entry in report['daemons'].values() if entry['pid'])
+        return report
+
+    def test_start_status_stop(self):
+        """ Should start, report and stop every daemon. """
+        report = self.start()
+        self.assertTrue(report['ok'], report)
+        pids = dict((name, entry['pid']) for name, entry in report['daemons'].items())
+        self.assertEqual(len(set(pids.values())), self.count)
+
+        status = self.fleet.status()
+        self.assertTrue(status['ok'])
+        for name, entry in status['daemons'].items():
+            self.assertEqual(entry, {'ok': True, 'pid': pids[name], 'alive': True, 'stale': False})
+
+        report = self.fleet.stop(timeout=10)
+        self.assertTrue(report['ok'], report)
+        for name, entry in report['daemons'].items():
+            self.assertEqual(entry['pid'], pids[name])
+            self.assertIsInstance(entry['elapsed'], float)
+
+        status = self.fleet.status()
+        self.assertFalse(status['ok'])
+        for entry in status['daemons'].values():
+            self.assertEqual(entry, {'ok': False, 'pid': 0, 'alive': False, 'stale': False})
+
+    def test_restart(self):
+        """ Should start each daemon anew once it has stopped. """
+        before = self.start()
+        with system_streams():
+            report = self.fleet.restart(timeout=10, ready_timeout=10)
+        self.pids.extend(entry['pid'] for entry in report['daemons'].values() if entry['pid'])
+        self.assertTrue(report['ok'], report)
+        for name, entry in report['daemons'].items():
+            self.assertTrue(entry['stopped']['ok'])
+            self.assertEqual(entry['stopped']['pid'], before['daemons'][name]['pid'])
+            self.assertNotEqual(entry['pid'], before['daemons'][name]['pid'])
+        self.fleet.stop(timeout=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
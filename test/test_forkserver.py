@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# test/test_forkserver.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.forkserver`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import shutil
+import signal
+import socket
+import stat
+import tempfile
+import time
+import unittest
+
+from daemon.forkserver import ForkServer, ForkServerClient, ForkServerError
+
+from . import fork_child, kill_child
+
+
+class ForkServer_TestCase(unittest.TestCase):
+    """ Test cases for `ForkServer` and `ForkServerClient`. """
+
+    timeout = 0.5
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'forkserver.sock')
+        server = ForkServer(self.path, timeout=self.timeout)
+        saved_handler = signal.getsignal(signal.SIGCHLD)
+        server.start()
+        self.server_pid = fork_child(server.serve_forever)
+        server.socket.close()
+        # Only the server process should reap its children.
+        signal.signal(signal.SIGCHLD, saved_handler)
+        self.client = ForkServerClient(self.path, timeout=5)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        kill_child(self.server_pid)
+        shutil.rmtree(self.directory)
+
+    def test_ping(self):
+        """ Should answer with the PID of the server. """
+        self.assertEqual(self.client.ping(), self.server_pid)
+
+    def test_socket_accessible_to_owner_only(self):
+        """ Should create the socket readable and writable by its owner only. """
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), stat.S_IRUSR | stat.S_IWUSR)
+
+    def test_spawn(self):
+        """ Should return the PID of a new process in its own session. """
+        pid = self.client.spawn('time:sleep', [0.2])
+        self.assertNotEqual(pid, self.server_pid)
+        self.assertEqual(os.getsid(pid), pid)
+
+    def test_spawn_unknown_target(self):
+        """ Should raise `ForkServerError` for a target that cannot be imported. """
+        self.assertRaises(ForkServerError, self.client.spawn, 'no.such.module:run')
+        self.assertEqual(self.client.status()['failed'], 1)
+
+    def test_idle_client_dropped(self):
+        """ Should drop a client which sends nothing, and serve the next. """
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.settimeout(5)
+        try:
+            idle.connect(self.path)
+            started = time.time()
+            self.assertEqual(self.client.ping(), self.server_pid)
+            self.assertLess(time.time() - started, self.timeout + 2)
+            self.assertEqual(idle.recv(1), b'')
+        finally:
+            idle.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+# test/test_handoff.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.handoff`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from daemon.handoff import (
+    HandoffClient, HandoffError, HandoffServer, bind_unix_socket, is_peer_trusted, receive_message,
+    send_message,
+)
+
+
+class message_TestCase(unittest.TestCase):
+    """ Test cases for `send_message` and `receive_message`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.left, self.right = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.left.close()
+        self.right.close()
+
+    def test_round_trip(self):
+        """ Should receive the message sent. """
+        send_message(self.left, {'command': 'sockets', 'args': [1, 'two']})
+        self.assertEqual(receive_message(self.right), ({'command': 'sockets', 'args': [1, 'two']}, []))
+
+    def test_large_message(self):
+        """ Should receive a message larger than one read. """
+        message = {'data': 'x' * 200000}
+        thread = threading.Thread(target=send_message, args=(self.left, message))
+        thread.start()
+        self.assertEqual(receive_message(self.right)[0], message)
+        thread.join()
+
+    def test_file_descriptors(self):
+        """ Should pass file descriptors attached to the message. """
+        read_fd, write_fd = os.pipe()
+        try:
+            send_message(self.left, {'names': ['pipe']}, [write_fd])
+            message, fds = receive_message(self.right, maxfds=4)
+            self.assertEqual(message, {'names': ['pipe']})
+            self.assertEqual(len(fds), 1)
+            self.assertNotEqual(fds[0], write_fd)
+            os.write(fds[0], b'ok')
+            os.close(fds[0])
+            self.assertEqual(os.read(read_fd, 2), b'ok')
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_closed(self):
+        """ Should return ``None`` once the peer closes the connection. """
+        self.left.close()
+        self.assertEqual(receive_message(self.right), (None, []))
+
+    def test_closed_mid_message(self):
+        """ Should raise `HandoffError` if the peer closes in the middle of a message. """
+        self.left.sendall(b'\0\0\0\x10{"a"')
+        self.left.close()
+        self.assertRaises(HandoffError, receive_message, self.right)
+
+    def test_peer_trusted(self):
+        """ Should trust a peer running as the same user. """
+        self.assertTrue(is_peer_trusted(self.right))
+
+
+class bind_unix_socket_TestCase(unittest.TestCase):
+    """ Test cases for `bind_unix_socket` function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server.sock')
+        self.saved_umask = os.umask(0)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        os.umask(self.saved_umask)
+        shutil.rmtree(self.directory)
+
+    def test_private(self):
+        """ Should create the socket accessible to its owner only, whatever the umask. """
+        sock, inode = bind_unix_socket(self.path, 1)
+        try:
+            self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), stat.S_IRUSR | stat.S_IWUSR)
+            self.assertEqual(os.stat(self.path).st_ino, inode)
+            self.assertEqual(os.umask(0), 0)
+        finally:
+            sock.close()
+
+    def test_replaces_stale_socket(self):
+        """ Should replace a socket file left behind. """
+        stale, _ = bind_unix_socket(self.path, 1)
+        stale.close()
+        sock, _ = bind_unix_socket(self.path, 1)
+        sock.close()
+
+    def test_keeps_other_files(self):
+        """ Should not remove a file other than a socket. """
+        open(self.path, 'w').close()
+        self.assertRaises(socket.error, bind_unix_socket, self.path, 1)
+        self.assertTrue(os.path.isfile(self.path))
+
+
+class HandoffServer_TestCase(unittest.TestCase):
+    """ Test cases for `HandoffServer` and `HandoffClient`. """
+
+    timeout = 0.5
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'handoff.sock')
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.events = []
+        self.drained = threading.Event()
+        self.server = HandoffServer(
+            self.path, {'http': self.listener},
+            on_release=lambda: self.events.append('release'),
+            on_reacquire=lambda: self.events.append('reacquire'),
+            on_drain=self.on_drain, timeout=self.timeout)
+        self.server.start()
+        self.client = HandoffClient(self.path, timeout=5)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.client.close()
+        self.server.close()
+        self.listener.close()
+        shutil.rmtree(self.directory)
+
+    def on_drain(self):
+        self.events.append('drain')
+        self.drained.set()
+
+    def test_no_server(self):
+        """ Should fail to connect when no daemon is serving. """
+        self.server.close()
+        self.assertFalse(self.client.connect())
+
+    def test_receive_sockets(self):
+        """ Should receive the daemon's listening sockets through `SCM_RIGHTS`. """
+        self.assertTrue(self.client.connect())
+        sockets = self.client.receive_sockets()
+        try:
+            self.assertEqual(sorted(sockets), ['http'])
+            received = sockets['http']
+            self.assertEqual(received.getsockname(), self.listener.getsockname())
+            self.assertEqual(received.type, socket.SOCK_STREAM)
+
+            connection = socket.create_connection(self.listener.getsockname(), timeout=5)
+            try:
+                received.settimeout(5)
+                accepted, _ = received.accept()
+                accepted.close()
+            finally:
+                connection.close()
+        finally:
+            for sock in sockets.values():
+                sock.close()
+
+    def test_drain(self):
+        """ Should release the PID file, then drain and stop serving. """
+        self.assertTrue(self.client.connect())
+        self.client.release_pidfile()
+        self.client.drain()
+        self.assertTrue(self.drained.wait(5))
+        self.assertEqual(self.events, ['release', 'drain'])
+        self.assertIsNone(self.server.socket)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_successor_gives_up(self):
+        """ Should take the PID file back if the successor disconnects after the release. """
+        self.assertTrue(self.client.connect())
+        self.client.release_pidfile()
+        self.client.close()
+
+        self.assertTrue(self.client.connect())
+        self.client.receive_sockets()['http'].close()
+        self.assertEqual(self.events, ['release', 'reacquire'])
+
+    def test_idle_client(self):
+        """ Should drop a client which sends nothing, and serve the next. """
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            idle.connect(self.path)
+            self.assertTrue(self.client.connect())
+            self.client.receive_sockets()['http'].close()
+        finally:
+            idle.close()
+
+    def test_successor_starting_up(self):
+        """ Should wait for a successor to drain once the PID file is released. """
+        self.assertTrue(self.client.connect())
+        self.client.release_pidfile()
+        time.sleep(self.timeout * 2)
+        self.client.drain()
+        self.assertTrue(self.drained.wait(5))
+        self.assertEqual(self.events, ['release', 'drain'])
+
+    def test_unknown_command(self):
+        """ Should raise `HandoffError` for an unknown command. """
+        self.assertTrue(self.client.connect())
+        self.assertRaises(HandoffError, self.client._request, 'bogus')
+
+
+if __name__ == '__main__':
+    unittest.main()
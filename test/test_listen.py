@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+# test/test_listen.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for listening sockets, bound or passed by a service manager. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import fcntl
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from daemon.daemon import (
+    LISTEN_FDS_START, DaemonContext, DaemonOSEnvironmentError, bind_listening_socket, format_socket_address,
+    read_listen_fds,
+)
+
+from . import fork_child
+
+
+class format_socket_address_TestCase(unittest.TestCase):
+    """ Test cases for `format_socket_address`. """
+
+    def test_formats(self):
+        """ Should name TCP addresses ``'host:port'``, and Unix sockets by path. """
+        self.assertEqual(format_socket_address(('127.0.0.1', 8080)), '127.0.0.1:8080')
+        self.assertEqual(format_socket_address(('::1', 8080, 0, 0)), '[::1]:8080')
+        self.assertEqual(format_socket_address('/run/test.sock'), '/run/test.sock')
+
+
+class bind_listening_socket_TestCase(unittest.TestCase):
+    """ Test cases for `bind_listening_socket`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.sockets = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for sock in self.sockets:
+            sock.close()
+        shutil.rmtree(self.directory)
+
+    def bind(self, *args, **kwargs):
+        sock = bind_listening_socket(*args, **kwargs)
+        self.sockets.append(sock)
+        return sock
+
+    def test_tcp(self):
+        """ Should listen on a TCP address. """
+        sock = self.bind(('127.0.0.1', 0))
+        client = socket.create_connection(sock.getsockname())
+        self.addCleanup(client.close)
+        conn, _ = sock.accept()
+        conn.close()
+
+    def test_unix_replaces_stale_socket(self):
+        """ Should remove a stale Unix socket file before binding. """
+        path = os.path.join(self.directory, 'test.sock')
+        self.bind(path).close()
+        self.assertTrue(os.path.exists(path))
+
+        sock = self.bind(path)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(client.close)
+        client.connect(path)
+        conn, _ = sock.accept()
+        conn.close()
+
+    def test_address_in_use(self):
+        """ Should raise `DaemonOSEnvironmentError` if the address is taken. """
+        sock = self.bind(('127.0.0.1', 0))
+        with self.assertRaises(DaemonOSEnvironmentError):
+            self.bind(sock.getsockname())
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'requires SO_REUSEPORT')
+    def test_reuse_port(self):
+        """ Should bind several sockets to one address with `reuse_port`. """
+        first = self.bind(('127.0.0.1', 0), reuse_port=True)
+        second = self.bind(first.getsockname(), reuse_port=True)
+        self.assertEqual(first.getsockname(), second.getsockname())
+        self.assertTrue(second.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT))
+
+
+class DaemonContext_listen_TestCase(unittest.TestCase):
+    """ Test cases for the `listen` option of `DaemonContext`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.sock')
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.directory)
+
+    def bind(self, context):
+        context._bind_listening_sockets()
+        sockets = list(context.listening_sockets.values())
+        for copies in context._listening_socket_copies.values():
+            sockets.extend(copies)
+        for sock in sockets:
+            self.addCleanup(sock.close)
+
+    def test_names(self):
+        """ Should name the sockets by address, or by the given names. """
+        context = DaemonContext(listen=[self.path])
+        self.bind(context)
+        self.assertEqual(list(context.listening_sockets), [self.path])
+
+        context = DaemonContext(listen={'web': ('127.0.0.1', 0)})
+        self.bind(context)
+        self.assertEqual(list(context.listening_sockets), ['web'])
+        self.assertEqual(context.listening_sockets['web'].getsockname()[0], '127.0.0.1')
+
+    def test_inherited(self):
+        """ Should use an inherited socket of the same name instead of binding. """
+        inherited = bind_listening_socket(('127.0.0.1', 0))
+        self.addCleanup(inherited.close)
+        context = DaemonContext(listen={'web': ('127.0.0.1', 0)})
+        context.inherited_sockets['web'] = inherited
+        self.bind(context)
+        self.assertIs(context.listening_sockets['web'], inherited)
+
+    def test_preserved(self):
+        """ Should keep every listening socket open. """
+        context = DaemonContext(listen={'web': ('127.0.0.1', 0)}, reuse_port=True, listen_count=2)
+        self.bind(context)
+        exclude = context._get_exclude_file_descriptors()
+        for sock in context._listening_socket_copies['web']:
+            self.assertIn(sock.fileno(), exclude)
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'requires SO_REUSEPORT')
+    def test_reuse_port_unix(self):
+        """ Should bind one socket per Unix socket path, even with `reuse_port`. """
+        context = DaemonContext(listen=[self.path], reuse_port=True, listen_count=2)
+        self.bind(context)
+        self.assertEqual(context._listening_socket_copies, {})
+
+    def test_listen_count_without_reuse_port(self):
+        """ Should bind one socket per address unless `reuse_port` is set. """
+        context = DaemonContext(listen={'web': ('127.0.0.1', 0)}, listen_count=4)
+        self.bind(context)
+        self.assertEqual(context._listening_socket_copies, {})
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'requires SO_REUSEPORT')
+    def test_reuse_port_worker_sockets(self):
+        """ Should bind `listen_count` copies, and keep one per worker. """
+        context = DaemonContext(listen={'web': ('127.0.0.1', 0)}, reuse_port=True, listen_count=3)
+        self.bind(context)
+        copies = context._listening_socket_copies['web']
+        self.assertEqual(len(copies), 3)
+        self.assertEqual(len(set(sock.getsockname() for sock in copies)), 1)
+
+        context.use_worker_sockets(4)
+        self.assertIs(context.listening_sockets['web'], copies[1])
+        self.assertEqual(context._listening_socket_copies, {})
+        self.assertEqual([sock.fileno() for sock in copies if sock is not copies[1]], [-1, -1])
+        self.assertNotEqual(copies[1].fileno(), -1)
+
+
+
+def launch(files, names, function, listen_pid=None):
+    """ Launch `function` in a child, as a service manager would.
+
+        The child gets the descriptors of `files` from
+        `LISTEN_FDS_START` on, with ``LISTEN_FDS``, ``LISTEN_PID`` (its
+        own PID, unless `listen_pid` is given) and ``LISTEN_FDNAMES``
+        (`names`, joined) set. Returns what `function` returns, passed
+        back as JSON.
+    """
+    read_fd, write_fd = os.pipe()
+
+    def child():
+        os.close(read_fd)
+        # Move every descriptor clear of those it is passed as.
+        report_fd = fcntl.fcntl(write_fd, fcntl.F_DUPFD, 100)
+        fds = [fcntl.fcntl(item if isinstance(item, int) else item.fileno(), fcntl.F_DUPFD, 100) for item in files]
+        for index, fd in enumerate(fds):
+            os.dup2(fd, LISTEN_FDS_START + index)
+            os.close(fd)
+
+        os.environ['LISTEN_FDS'] = '{:d}'.format(len(files))
+        os.environ['LISTEN_PID'] = '{:d}'.format(os.getpid() if listen_pid is None else listen_pid)
+        if names is not None:
+            os.environ['LISTEN_FDNAMES'] = ':'.join(names)
+        else:
+            os.environ.pop('LISTEN_FDNAMES', None)
+
+        with os.fdopen(report_fd, 'w') as fp:
+            json.dump(function(), fp)
+
+    pid = fork_child(child)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as fp:
+        result = fp.read()
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise AssertionError('launched child failed with status {:d}'.format(status))
+    return json.loads(result)
+
+
+def describe_listen_fds():
+    """ Describe what `read_listen_fds` returns, and the environment after. """
+    described = []
+    for name, item in read_listen_fds():
+        if isinstance(item, int):
+            described.append([name, 'fd', item, os.get_inheritable(item)])
+        else:
+            kind = 'unix' if item.family == socket.AF_UNIX else 'inet'
+            described.append([name, kind, item.fileno(), item.get_inheritable()])
+    environ = sorted(key for key in os.environ if key.startswith('LISTEN_'))
+    return {'fds': described, 'environ': environ}
+
+
+class read_listen_fds_TestCase(unittest.TestCase):
+    """ Test cases for `read_listen_fds`, in a child launched as a service manager would. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.tcp = bind_listening_socket(('127.0.0.1', 0))
+        self.unix = bind_listening_socket(os.path.join(self.directory, 'test.sock'))
+        self.pipe = os.pipe()
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.tcp.close()
+        self.unix.close()
+        for fd in self.pipe:
+            os.close(fd)
+        shutil.rmtree(self.directory)
+
+    def test_named(self):
+        """ Should return each descriptor by name, and unset the variables. """
+        result = launch([self.tcp, self.unix, self.pipe[0]], ['web', 'admin', 'log'], describe_listen_fds)
+        self.assertEqual(result['fds'], [
+            ['web', 'inet', 3, False],
+            ['admin', 'unix', 4, False],
+            ['log', 'fd', 5, False],
+        ])
+        self.assertEqual(result['environ'], [])
+
+    def test_unnamed(self):
+        """ Should name descriptors without names by number, and keep names unique. """
+        result = launch([self.tcp, self.unix, self.pipe[0]], ['web', 'unknown', 'web'], describe_listen_fds)
+        self.assertEqual([entry[0] for entry in result['fds']], ['web', 'fd4', 'web.fd5'])
+
+        result = launch([self.tcp, self.unix], None, describe_listen_fds)
+        self.assertEqual([entry[0] for entry in result['fds']], ['fd3', 'fd4'])
+
+    def test_other_process(self):
+        """ Should ignore descriptors meant for another process. """
+        result = launch([self.tcp], ['web'], describe_listen_fds, listen_pid=1)
+        self.assertEqual(result['fds'], [])
+        self.assertEqual(result['environ'], [])
+
+    def test_socket_usable(self):
+        """ Should return a socket that accepts connections on the passed address. """
+        address = self.tcp.getsockname()
+
+        def accept():
+            (_, sock), = read_listen_fds()
+            client = socket.create_connection(address)
+            conn, _ = sock.accept()
+            client.sendall(b'hello')
+            return conn.recv(5).decode('ascii')
+
+        self.assertEqual(launch([self.tcp], ['web'], accept), 'hello')
+
+    def test_environ(self):
+        """ Should read a given mapping, and keep it unchanged if told to. """
+        environ = {'LISTEN_PID': '1', 'LISTEN_FDS': '1'}
+        self.assertEqual(read_listen_fds(environ, unset=False), [])
+        self.assertEqual(environ, {'LISTEN_PID': '1', 'LISTEN_FDS': '1'})
+        self.assertEqual(read_listen_fds({'LISTEN_PID': 'x', 'LISTEN_FDS': '1'}), [])
+        self.assertEqual(read_listen_fds({}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
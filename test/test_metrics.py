@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# test/test_metrics.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.metrics`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from daemon.daemon import DaemonContext
+from daemon.metrics import DaemonMetrics, MetricsFileWriter, render_prometheus
+
+
+# A sample line of the text exposition format.
+sample_pattern = re.compile(
+    r'^[a-zA-Z_:][a-zA-Z0-9_:]*'
+    r'(\{[a-zA-Z_][a-zA-Z0-9_]*="([^"\\\n]|\\.)*"(,[a-zA-Z_][a-zA-Z0-9_]*="([^"\\\n]|\\.)*")*\})?'
+    r' (NaN|[+-]Inf|-?[0-9.e+-]+)$')
+
+
+class render_prometheus_TestCase(unittest.TestCase):
+    """ Test cases for `render_prometheus`. """
+
+    def test_family(self):
+        """ Should render the help, type and each sample of a family. """
+        text = render_prometheus([
+            ('daemon_workers', 'gauge', 'Worker processes running.', [({}, 4)]),
+            ('daemon_worker_exits_total', 'counter', 'Worker processes exited, by exit code.',
+             [({'code': '0'}, 2), ({'code': '1'}, 1)]),
+        ])
+        self.assertEqual(text, '\n'.join([
+            '# HELP daemon_workers Worker processes running.',
+            '# TYPE daemon_workers gauge',
+            'daemon_workers 4',
+            '# HELP daemon_worker_exits_total Worker processes exited, by exit code.',
+            '# TYPE daemon_worker_exits_total counter',
+            'daemon_worker_exits_total{code="0"} 2',
+            'daemon_worker_exits_total{code="1"} 1',
+        ]) + '\n')
+
+    def test_labels_sorted(self):
+        """ Should render labels in order of name. """
+        text = render_prometheus([('m', 'gauge', 'M.', [({'zeta': 'z', 'alpha': 'a', 'mid': 'm'}, 1)])])
+        self.assertIn('m{alpha="a",mid="m",zeta="z"} 1\n', text)
+
+    def test_label_escaping(self):
+        """ Should escape backslashes, double quotes and newlines in label values. """
+        text = render_prometheus([('m', 'gauge', 'M.', [({'path': 'C:\\logs\n"x"'}, 1)])])
+        self.assertIn('m{path="C:\\\\logs\\n\\"x\\""} 1\n', text)
+        self.assertEqual(len(text.splitlines()), 3)
+
+    def test_help_escaping(self):
+        """ Should escape backslashes and newlines in help text. """
+        text = render_prometheus([('m', 'gauge', 'Back\\slash\nand "quotes".', [({}, 1)])])
+        self.assertEqual(text.splitlines()[0], '# HELP m Back\\\\slash\\nand "quotes".')
+
+    def test_values(self):
+        """ Should render integers exactly, and floats in full. """
+        samples = [
+            ({'v': 'int'}, 12345678901234),
+            ({'v': 'bool'}, True),
+            ({'v': 'float'}, 0.1),
+            ({'v': 'whole'}, 2.0),
+            ({'v': 'nan'}, float('nan')),
+            ({'v': 'inf'}, float('inf')),
+            ({'v': '-inf'}, float('-inf')),
+        ]
+        lines = render_prometheus([('m', 'gauge', 'M.', samples)]).splitlines()[2:]
+        self.assertEqual([line.split(' ')[1] for line in lines], [
+            '12345678901234', '1', '0.1', '2.0', 'NaN', '+Inf', '-Inf'])
+        for line in lines:
+            self.assertRegex(line, sample_pattern)
+
+    def test_empty(self):
+        """ Should render no families as an empty line. """
+        self.assertEqual(render_prometheus([]), '\n')
+
+
+class DaemonMetrics_TestCase(unittest.TestCase):
+    """ Test cases for `DaemonMetrics`. """
+
+    def test_as_text(self):
+        """ Should render the metrics of this process in the text format. """
+        text = DaemonMetrics(DaemonContext()).as_text()
+        names = set()
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                names.add(line.split(' ')[2])
+            elif not line.startswith('# HELP '):
+                self.assertRegex(line, sample_pattern)
+
+        for name in ['process_cpu_seconds_total', 'process_open_fds', 'process_threads',
+                     'daemon_gc_allocations_pending']:
+            self.assertIn(name, names)
+
+
+class MetricsFileWriter_TestCase(unittest.TestCase):
+    """ Test cases for `MetricsFileWriter`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'daemon.prom')
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.directory)
+
+    def test_write_and_remove(self):
+        """ Should write the file on start, and remove it on close. """
+        writer = MetricsFileWriter(self.path, lambda: 'm 1\n', interval=60)
+        writer.start()
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), 'm 1\n')
+        self.assertEqual(os.listdir(self.directory), ['daemon.prom'])
+
+        writer.close()
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
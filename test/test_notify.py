@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# test/test_notify.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.notify`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from daemon.notify import ServiceNotifier
+
+
+class ServiceNotifier_TestCase(unittest.TestCase):
+    """ Test cases for `ServiceNotifier` against a local datagram socket. """
+
+    variables = ['NOTIFY_SOCKET', 'WATCHDOG_USEC', 'WATCHDOG_PID']
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.saved = dict((name, os.environ.pop(name)) for name in self.variables if name in os.environ)
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, 'notify')
+        self.manager = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.manager.settimeout(5)
+        self.manager.bind(self.address)
+        self.notifiers = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for notifier in self.notifiers:
+            notifier.close()
+        self.manager.close()
+        shutil.rmtree(self.directory)
+        for name in self.variables:
+            os.environ.pop(name, None)
+        os.environ.update(self.saved)
+
+    def notifier(self, **environ):
+        os.environ['NOTIFY_SOCKET'] = self.address
+        os.environ.update(environ)
+        notifier = ServiceNotifier.from_environment()
+        self.notifiers.append(notifier)
+        return notifier
+
+    def receive(self):
+        return self.manager.recv(4096).decode('utf-8')
+
+    def test_not_configured(self):
+        """ Should create no notifier without `NOTIFY_SOCKET`. """
+        self.assertIsNone(ServiceNotifier.from_environment({}))
+
+    def test_unset(self):
+        """ Should remove the variables from the environment if told to. """
+        environ = {'NOTIFY_SOCKET': self.address, 'WATCHDOG_USEC': '100000', 'WATCHDOG_PID': '1'}
+        notifier = ServiceNotifier.from_environment(environ, unset=True)
+        self.notifiers.append(notifier)
+        self.assertEqual(environ, {})
+        self.assertEqual(notifier.watchdog_usec, 100000)
+        self.assertEqual(notifier.watchdog_pid, 1)
+
+    def test_connected(self):
+        """ Should reach the service manager through the socket connected on creation. """
+        notifier = self.notifier()
+        self.assertTrue(notifier.connected)
+        os.rename(self.address, self.address + '.moved')
+        self.assertTrue(notifier.ready())
+        self.assertEqual(self.receive(), 'READY=1')
+
+    def test_ready(self):
+        """ Should send ``READY=1``. """
+        self.assertTrue(self.notifier().ready())
+        self.assertEqual(self.receive(), 'READY=1')
+
+    def test_ready_with_status(self):
+        """ Should send ``READY=1`` and the status in one datagram. """
+        self.notifier().ready('Listening')
+        self.assertEqual(self.receive(), 'READY=1\nSTATUS=Listening')
+
+    def test_status(self):
+        """ Should send ``STATUS=`` with the free-form status. """
+        self.notifier().status('Serving 3 clients')
+        self.assertEqual(self.receive(), 'STATUS=Serving 3 clients')
+
+    def test_mainpid(self):
+        """ Should send ``MAINPID=`` with this process, or the given one. """
+        notifier = self.notifier()
+        notifier.mainpid()
+        self.assertEqual(self.receive(), 'MAINPID={:d}'.format(os.getpid()))
+        notifier.mainpid(1234)
+        self.assertEqual(self.receive(), 'MAINPID=1234')
+        self.assertEqual(notifier.main_pid, 1234)
+
+    def test_watchdog(self):
+        """ Should send ``WATCHDOG=1``. """
+        self.notifier().watchdog()
+        self.assertEqual(self.receive(), 'WATCHDOG=1')
+
+    def test_start_watchdog(self):
+        """ Should send keep-alives at half the expected interval. """
+        notifier = self.notifier(WATCHDOG_USEC='100000', WATCHDOG_PID='{:d}'.format(os.getpid()))
+        self.assertEqual(notifier.watchdog_usec, 100000)
+        notifier.start_watchdog()
+        for _ in range(3):
+            self.assertEqual(self.receive(), 'WATCHDOG=1')
+        notifier.stop_watchdog()
+
+    def test_watchdog_pid_mismatch(self):
+        """ Should send no keep-alives when `WATCHDOG_PID` names another process. """
+        notifier = self.notifier(WATCHDOG_USEC='100000', WATCHDOG_PID='{:d}'.format(os.getpid() + 1))
+        self.assertFalse(notifier.watchdog_applies())
+        notifier.start_watchdog()
+        self.assertIsNone(notifier._watchdog_thread)
+        self.manager.settimeout(0.2)
+        self.assertRaises(socket.timeout, self.manager.recv, 4096)
+
+    def test_watchdog_handed_to_main_process(self):
+        """ Should let the announced main process send keep-alives in place of `WATCHDOG_PID`. """
+        notifier = self.notifier(WATCHDOG_USEC='100000', WATCHDOG_PID='{:d}'.format(os.getpid()))
+        notifier.mainpid(os.getpid() + 1)
+        self.assertTrue(notifier.watchdog_applies(os.getpid() + 1))
+        self.assertFalse(notifier.watchdog_applies(os.getpid() + 2))
+
+    def test_unreachable(self):
+        """ Should return ``False`` when the service manager cannot be reached. """
+        notifier = self.notifier()
+        self.manager.close()
+        os.unlink(self.address)
+        self.assertFalse(notifier.ready())
+
+
+class ServiceNotifier_abstract_TestCase(unittest.TestCase):
+    """ Test cases for `ServiceNotifier` with an abstract socket address. """
+
+    def test_abstract_address(self):
+        """ Should send to the abstract address named with a leading ``@``. """
+        name = 'python-daemon-test-{:d}'.format(os.getpid())
+        manager = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        manager.settimeout(5)
+        try:
+            manager.bind('\0' + name)
+            notifier = ServiceNotifier.from_environment({'NOTIFY_SOCKET': '@' + name})
+            try:
+                self.assertEqual(notifier.address, '\0' + name)
+                self.assertTrue(notifier.ready())
+                self.assertEqual(manager.recv(4096), b'READY=1')
+            finally:
+                notifier.close()
+        finally:
+            manager.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+# test/test_pidlockfile.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for the PID file backends of `daemon.pidlockfile`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+from lockfile import AlreadyLocked, LockTimeout
+
+from daemon.pidlockfile import (
+    FcntlPIDLockFile, KernelPIDLockFile, PIDFileWaiter, SocketPIDLockFile, TimeoutPIDLockFile, _get_inotify,
+)
+
+from . import fork_child, kill_child
+
+
+class KernelPIDLockFile_BaseTestCase(object):
+    """ Test cases shared by each kernel-locked backend. """
+
+    #: Number of queries in a row, more than a listen backlog.
+    query_count = 300
+
+    def make_lock(self, path):
+        raise NotImplementedError
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.pid')
+        self.lock = self.make_lock(self.path)
+        self.children = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.children:
+            kill_child(pid)
+        if self.lock.i_am_locking():
+            self.lock.release()
+        shutil.rmtree(self.directory)
+
+    def fork_holder(self, after_acquire=None):
+        """ Fork a process which takes the lock; return its PID once it holds it.
+
+            `after_acquire`, if given, is called in that process once it
+            holds the lock, and returns a PID to report in its place.
+        """
+        read_fd, write_fd = os.pipe()
+
+        def hold():
+            os.close(read_fd)
+            lock = self.make_lock(self.path)
+            lock.acquire()
+            pid = after_acquire(lock) if after_acquire is not None else os.getpid()
+            os.write(write_fd, struct.pack(str('i'), pid))
+            time.sleep(30)
+
+        self.children.append(fork_child(hold))
+        os.close(write_fd)
+        try:
+            data = os.read(read_fd, 4)
+        finally:
+            os.close(read_fd)
+        self.assertEqual(len(data), 4)
+        return struct.unpack(str('i'), data)[0]
+
+    def wait_until_unlocked(self, timeout=5):
+        deadline = time.time() + timeout
+        while self.lock.is_locked():
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def test_not_locked(self):
+        """ Should report no holder when nobody holds the lock. """
+        self.assertFalse(self.lock.is_locked())
+        self.assertIsNone(self.lock.read_pid())
+
+    def test_repeated_queries_by_holder(self):
+        """ Should report this process to itself, as often as asked. """
+        self.lock.acquire()
+        for _ in range(self.query_count):
+            self.assertTrue(self.lock.is_locked())
+            self.assertEqual(self.lock.read_pid(), os.getpid())
+        self.lock.release()
+        self.assertFalse(self.lock.is_locked())
+
+    def test_repeated_queries_of_other_holder(self):
+        """ Should report another holder as often as asked, without stalling. """
+        holder = self.fork_holder()
+        started = time.time()
+        for _ in range(self.query_count):
+            self.assertTrue(self.lock.is_locked())
+            self.assertEqual(self.lock.read_pid(), holder)
+        self.assertLess(time.time() - started, 10)
+
+        self.assertRaises(AlreadyLocked, self.lock.acquire, 0)
+
+    def test_released_when_holder_killed(self):
+        """ Should be free once the holding process is killed. """
+        holder = self.fork_holder()
+        self.assertTrue(self.lock.is_locked())
+        kill_child(holder)
+        self.assertTrue(self.wait_until_unlocked())
+        self.lock.acquire(0)
+        self.assertEqual(self.lock.read_pid(), os.getpid())
+
+    def test_lock_wait(self):
+        """ Should record the time spent waiting for a held lock. """
+        self.lock.acquire(0)
+        self.assertLess(self.lock.lock_wait, 0.2)
+        self.lock.release()
+
+        holder = self.fork_holder()
+        timer = threading.Timer(0.3, kill_child, [holder])
+        timer.start()
+        try:
+            self.lock.acquire(10)
+        finally:
+            timer.join()
+        self.assertGreaterEqual(self.lock.lock_wait, 0.2)
+
+    def test_forked_process_does_not_keep_lock(self):
+        """ Should be free once the holder is killed, though its fork runs on. """
+        def fork_worker(lock):
+            def work():
+                lock.close_after_fork()
+                time.sleep(30)
+            return fork_child(work)
+
+        worker = self.fork_holder(after_acquire=fork_worker)
+        try:
+            self.assertTrue(self.lock.is_locked())
+            kill_child(self.children[-1])
+            self.assertTrue(self.wait_until_unlocked())
+        finally:
+            kill_child(worker)
+
+
+class FcntlPIDLockFile_TestCase(KernelPIDLockFile_BaseTestCase, unittest.TestCase):
+    """ Test cases for `FcntlPIDLockFile`. """
+
+    def make_lock(self, path):
+        return FcntlPIDLockFile(path)
+
+
+class SocketPIDLockFile_TestCase(KernelPIDLockFile_BaseTestCase, unittest.TestCase):
+    """ Test cases for `SocketPIDLockFile`. """
+
+    def make_lock(self, path):
+        return SocketPIDLockFile(path)
+
+
+class SocketPIDLockFile_pidfile_TestCase(KernelPIDLockFile_BaseTestCase, unittest.TestCase):
+    """ Test cases for `SocketPIDLockFile` also writing a PID file. """
+
+    def make_lock(self, path):
+        return SocketPIDLockFile(path, write_pidfile=True)
+
+    def test_writes_pidfile(self):
+        """ Should write the PID file while held, and remove it on release. """
+        self.lock.acquire()
+        with open(self.path) as pidfile:
+            self.assertEqual(int(pidfile.read()), os.getpid())
+        self.lock.release()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class KernelPIDLockFile_TestCase(unittest.TestCase):
+    """ Test cases for `KernelPIDLockFile` class. """
+
+    def test_abstract(self):
+        """ Should not be instantiated without the kernel lock methods. """
+        self.assertRaises(TypeError, KernelPIDLockFile, '/tmp/test.pid')
+
+
+class TimeoutPIDLockFile_TestCase(unittest.TestCase):
+    """ Test cases for `TimeoutPIDLockFile`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.pid')
+        self.lock = TimeoutPIDLockFile(self.path, acquire_timeout=0.2)
+        self.children = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.children:
+            kill_child(pid)
+        if self.lock.i_am_locking():
+            self.lock.release()
+        shutil.rmtree(self.directory)
+
+    def fork_holder(self, hold_for=30):
+        """ Fork a process which holds the lock for `hold_for` seconds; return its PID once it does. """
+        read_fd, write_fd = os.pipe()
+
+        def hold():
+            os.close(read_fd)
+            lock = TimeoutPIDLockFile(self.path)
+            lock.acquire()
+            os.write(write_fd, b'!')
+            time.sleep(hold_for)
+            lock.release()
+
+        pid = fork_child(hold)
+        self.children.append(pid)
+        os.close(write_fd)
+        try:
+            self.assertEqual(os.read(read_fd, 1), b'!')
+        finally:
+            os.close(read_fd)
+        return pid
+
+    def test_acquire(self):
+        """ Should take the lock, and record the PID. """
+        self.lock.acquire()
+        self.assertTrue(self.lock.i_am_locking())
+        self.assertEqual(self.lock.read_pid(), os.getpid())
+        self.assertLess(self.lock.lock_wait, 0.2)
+        self.lock.release()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_held(self):
+        """ Should raise `LockTimeout` once the timeout passes, leaving nothing behind. """
+        holder = self.fork_holder()
+        for event_wait in [True, False]:
+            self.lock.event_wait = event_wait
+            started = time.time()
+            self.assertRaises(LockTimeout, self.lock.acquire)
+            self.assertGreaterEqual(time.time() - started, 0.2)
+            self.assertFalse(os.path.exists(self.lock.unique_name))
+        self.assertEqual(self.lock.read_pid(), holder)
+
+    def test_held_without_timeout(self):
+        """ Should raise `AlreadyLocked` at once with a zero timeout. """
+        self.fork_holder()
+        self.assertRaises(AlreadyLocked, self.lock.acquire, 0)
+        self.assertFalse(os.path.exists(self.lock.unique_name))
+
+    def test_woken_by_release(self):
+        """ Should take the lock as soon as the holder releases it. """
+        self.fork_holder(hold_for=0.3)
+        self.lock.acquire(timeout=10)
+        self.assertTrue(self.lock.i_am_locking())
+        self.assertEqual(self.lock.read_pid(), os.getpid())
+        self.assertGreaterEqual(self.lock.lock_wait, 0.2)
+
+
+class PIDFileWaiter_TestCase(unittest.TestCase):
+    """ Test cases for `PIDFileWaiter`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.pid')
+        open(self.path, 'w').close()
+        # A long polling interval, so that only an event wakes the waiter early.
+        self.waiter = PIDFileWaiter(self.path, interval=10)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.waiter.close()
+        shutil.rmtree(self.directory)
+
+    def later(self, function, delay=0.1):
+        timer = threading.Timer(delay, function)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def assertWakes(self, change):
+        """ Assert that `change`, made shortly, wakes the waiter well before its timeout. """
+        self.later(change)
+        started = time.time()
+        self.waiter.wait(5)
+        self.assertLess(time.time() - started, 2)
+
+    def test_uses_inotify(self):
+        """ Should watch with inotify where it is available. """
+        if _get_inotify() is None:
+            self.skipTest('inotify is not available')
+        self.assertIsNotNone(self.waiter._fd)
+
+    def test_removed(self):
+        """ Should wake when the file is removed. """
+        if self.waiter._fd is None:
+            self.skipTest('inotify is not available')
+        self.assertWakes(lambda: os.unlink(self.path))
+
+    def test_renamed(self):
+        """ Should wake when the file is moved away. """
+        if self.waiter._fd is None:
+            self.skipTest('inotify is not available')
+        self.assertWakes(lambda: os.rename(self.path, self.path + '.old'))
+
+    def test_closed_after_writing(self):
+        """ Should wake when the file is closed after writing. """
+        if self.waiter._fd is None:
+            self.skipTest('inotify is not available')
+
+        def write():
+            with open(self.path, 'w') as pidfile:
+                pidfile.write('1\n')
+
+        self.assertWakes(write)
+
+    def test_other_file_ignored(self):
+        """ Should not wake for changes to other files in the directory. """
+        if self.waiter._fd is None:
+            self.skipTest('inotify is not available')
+        other = os.path.join(self.directory, 'other')
+        open(other, 'w').close()
+        self.later(lambda: os.unlink(other))
+        started = time.time()
+        self.waiter.wait(0.5)
+        self.assertGreaterEqual(time.time() - started, 0.5)
+
+    def test_timeout(self):
+        """ Should return once the timeout passes without a change. """
+        started = time.time()
+        self.waiter.wait(0.2)
+        self.assertGreaterEqual(time.time() - started, 0.2)
+        self.assertLess(time.time() - started, 2)
+
+    def test_close(self):
+        """ Should close the inotify descriptor. """
+        self.waiter.close()
+        self.assertIsNone(self.waiter._fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# test/test_readiness.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for the readiness handshake of `ReadinessPipe`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import time
+import unittest
+
+from daemon.daemon import DaemonReadinessError, DaemonReadinessTimeout, ReadinessPipe
+from daemon.runner import DaemonRunnerStartFailureError, DaemonRunnerStartTimeoutError, wait_until_ready
+
+from . import fork_child, kill_child
+
+
+class ReadinessPipe_TestCase(unittest.TestCase):
+    """ Test cases for `ReadinessPipe` between a parent and a child. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.readiness = ReadinessPipe()
+        self.children = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.children:
+            kill_child(pid)
+        self.readiness.close()
+
+    def fork(self, function):
+        pid = fork_child(function)
+        self.children.append(pid)
+        return pid
+
+    def test_wait_returns_pid_of_ready_process(self):
+        """ Should return the PID reported ready, and close the pipe. """
+        pid = self.fork(lambda: self.readiness.notify_ready())
+        self.assertEqual(self.readiness.wait(5), pid)
+        self.assertIsNone(self.readiness.read_fd)
+        self.assertIsNone(self.readiness.write_fd)
+
+    def test_wait_keep_open_receives_exit_report(self):
+        """ Should keep the read end open for the exit report if told to. """
+        def report():
+            self.readiness.notify_ready()
+            self.readiness.notify_exit(3, {'answer': 42})
+
+        pid = self.fork(report)
+        self.assertEqual(self.readiness.wait(5, keep_open=True), pid)
+        self.assertIsNotNone(self.readiness.read_fd)
+        self.assertEqual(self.readiness.receive(5), ('exit', (3, {'answer': 42}, None)))
+        self.assertIsNone(self.readiness.receive(5))
+
+    def test_wait_raises_reported_error(self):
+        """ Should raise the error the process reported, and close the pipe. """
+        self.fork(lambda: self.readiness.notify_error(ValueError('no config')))
+        with self.assertRaises(DaemonReadinessError) as context:
+            self.readiness.wait(5)
+        self.assertIn('ValueError: no config', '{!s}'.format(context.exception))
+        self.assertIsNone(self.readiness.read_fd)
+
+    def test_wait_raises_if_process_exits_first(self):
+        """ Should raise if the process exits without reporting. """
+        self.fork(lambda: None)
+        with self.assertRaises(DaemonReadinessError):
+            self.readiness.wait(5)
+        self.assertIsNone(self.readiness.read_fd)
+
+    def test_wait_raises_timeout(self):
+        """ Should raise a timeout if nothing is reported, and close the pipe. """
+        self.fork(lambda: time.sleep(30))
+        started = time.time()
+        with self.assertRaises(DaemonReadinessTimeout):
+            self.readiness.wait(0.1)
+        self.assertLess(time.time() - started, 5)
+        self.assertIsNone(self.readiness.read_fd)
+
+    def test_wait_keep_open_timeout_leaves_pipe_open(self):
+        """ Should leave the read end open after a timeout if told to. """
+        self.fork(lambda: time.sleep(30))
+        with self.assertRaises(DaemonReadinessTimeout):
+            self.readiness.wait(0.1, keep_open=True)
+        self.assertIsNotNone(self.readiness.read_fd)
+
+    def test_notify_exit_gives_up_when_reader_is_gone(self):
+        """ Should not wait for a reader which has closed the pipe. """
+        self.readiness._close_read_end()
+        started = time.time()
+        self.assertFalse(self.readiness.send('exit', (0, b'x' * (4 << 20), None), timeout=10))
+        self.assertLess(time.time() - started, 5)
+
+
+class wait_until_ready_TestCase(unittest.TestCase):
+    """ Test cases for `wait_until_ready` function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.readiness = ReadinessPipe()
+        self.pid = None
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        if self.pid is not None:
+            kill_child(self.pid)
+        self.readiness.close()
+
+    def test_raises_start_failure_on_error(self):
+        """ Should raise `DaemonRunnerStartFailureError` on a reported error. """
+        self.pid = fork_child(lambda: self.readiness.notify_error(OSError('denied')))
+        self.assertRaises(DaemonRunnerStartFailureError, wait_until_ready, self.readiness, 5)
+
+    def test_raises_start_timeout(self):
+        """ Should raise `DaemonRunnerStartTimeoutError` on a timeout. """
+        self.pid = fork_child(lambda: time.sleep(30))
+        self.assertRaises(DaemonRunnerStartTimeoutError, wait_until_ready, self.readiness, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
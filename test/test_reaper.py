@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# test/test_reaper.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.reaper`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import signal
+import time
+import unittest
+
+from daemon.reaper import ChildReaper, child_pids
+
+from . import kill_child
+
+
+def exited_child(status=0):
+    """ Fork a child which exits with `status`; return its PID once it is a zombie. """
+    pid = os.fork()
+    if pid == 0:
+        os._exit(status)
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        info = os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+        if info is not None and info.si_pid == pid:
+            break
+        time.sleep(0.01)
+    return pid
+
+
+def is_child(pid):
+    """ Return ``True`` if `pid` is a child of this process, not yet reaped. """
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+    except OSError:
+        return False
+    return True
+
+
+class ChildReaper_TestCase(unittest.TestCase):
+    """ Test cases for `ChildReaper`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.pids = []
+        self.saved_handler = signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.pids:
+            kill_child(pid)
+        signal.signal(signal.SIGCHLD, self.saved_handler)
+
+    def fork(self, status=0):
+        pid = exited_child(status)
+        self.pids.append(pid)
+        return pid
+
+    def test_reap(self):
+        """ Should reap every exited child, and record its status. """
+        exited = self.fork(0)
+        failed = self.fork(3)
+        reaper = ChildReaper()
+        self.assertEqual(reaper.reap(), 2)
+        self.assertFalse(is_child(exited))
+        self.assertFalse(is_child(failed))
+        self.assertEqual(sorted(reaper.last_statuses), sorted([(exited, 0), (failed, 3)]))
+        self.assertEqual((reaper.exited, reaper.failed, reaper.killed), (1, 1, 0))
+
+    def test_killed_child(self):
+        """ Should record a child killed by a signal as the negated signal number. """
+        pid = os.fork()
+        if pid == 0:
+            time.sleep(10)
+            os._exit(0)
+        self.pids.append(pid)
+        os.kill(pid, signal.SIGKILL)
+        reaper = ChildReaper()
+        deadline = time.time() + 5
+        while not reaper.reap() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(list(reaper.last_statuses), [(pid, -signal.SIGKILL)])
+        self.assertEqual(reaper.killed, 1)
+
+    def test_excluded_child_does_not_block_others(self):
+        """ Should reap other children while an excluded child is left a zombie. """
+        excluded = self.fork()
+        ordinary = self.fork()
+        reaper = ChildReaper(exclude=lambda: [excluded])
+        self.assertEqual(reaper.reap(), 1)
+        self.assertTrue(is_child(excluded))
+        self.assertFalse(is_child(ordinary))
+        self.assertEqual(list(reaper.last_statuses), [(ordinary, 0)])
+
+    def test_nothing_to_reap(self):
+        """ Should return 0 when no child has exited. """
+        self.assertEqual(ChildReaper().reap(), 0)
+
+
+class child_pids_TestCase(unittest.TestCase):
+    """ Test cases for `child_pids` function. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.saved_handler = signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        signal.signal(signal.SIGCHLD, self.saved_handler)
+
+    def test_lists_children(self):
+        """ Should list a child of this process, until it is reaped. """
+        pid = exited_child()
+        try:
+            self.assertIn(pid, child_pids())
+        finally:
+            kill_child(pid)
+        self.assertNotIn(pid, child_pids())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+# test/test_runner.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `DaemonHandle`, on daemons started by `DaemonRunner`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import gc
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+from daemon.daemon import is_process_running, wait_for_process_exit
+from daemon.runner import DaemonHandle, DaemonRunner, DaemonRunnerResultError, DaemonRunnerStopFailureError
+
+from . import fork_child, kill_child, system_streams
+
+
+class LargeResultRunner(DaemonRunner):
+    """ Runner whose daemon returns a result larger than a pipe holds. """
+
+    def run(self):
+        time.sleep(0.2)
+        return 'x' * (4 << 20)
+
+
+class SleepingRunner(DaemonRunner):
+    """ Runner whose daemon sleeps until stopped. """
+
+    def run(self):
+        time.sleep(60)
+
+
+class LoggingRunner(DaemonRunner):
+    """ Runner whose daemon writes a line to its output until stopped. """
+
+    def run(self):
+        while True:
+            print('line')
+            sys.stdout.flush()
+            time.sleep(0.01)
+
+
+class FailingRunner(DaemonRunner):
+    """ Runner whose daemon fails. """
+
+    def run(self):
+        raise RuntimeError('daemon failed')
+
+
+def count_open_file_descriptors():
+    return len(os.listdir('/proc/self/fd'))
+
+
+class DaemonHandle_TestCase(unittest.TestCase):
+    """ Test cases for `DaemonHandle` class. """
+
+    def start(self, runner_class):
+        """ Start a daemon of `runner_class`; return its handle. """
+        with system_streams():
+            return runner_class(force_detach=True).start(wait_ready=True, ready_timeout=10, handle=True)
+
+    def test_result(self):
+        """ Should return the daemon's result, and close the pipe. """
+        open_before = count_open_file_descriptors()
+        handle = self.start(LargeResultRunner)
+        self.assertEqual(len(handle.result(timeout=10)), 4 << 20)
+        self.assertEqual(handle.exit_code, 0)
+        self.assertEqual(count_open_file_descriptors(), open_before)
+
+    def test_result_of_failed_daemon(self):
+        """ Should raise the daemon's error. """
+        handle = self.start(FailingRunner)
+        with self.assertRaises(DaemonRunnerResultError) as context:
+            handle.result(timeout=10)
+        self.assertIn('daemon failed', '{!s}'.format(context.exception))
+
+    def test_dropped_handle_closes_pipe(self):
+        """ Should let the daemon exit at once once its handle is dropped. """
+        open_before = count_open_file_descriptors()
+        handle = self.start(LargeResultRunner)
+        pid = handle.pid
+        del handle
+        gc.collect()
+        self.assertEqual(count_open_file_descriptors(), open_before)
+
+        started = time.time()
+        self.assertTrue(wait_for_process_exit(pid, 10))
+        self.assertLess(time.time() - started, 5)
+
+    def test_partly_set_up(self):
+        """ Should not raise when a handle which was never set up is collected. """
+        handle = DaemonHandle.__new__(DaemonHandle)
+        handle.__del__()
+
+
+class DaemonRunner_start_TestCase(unittest.TestCase):
+    """ Test cases for `DaemonRunner.start`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.pidfile_path = os.path.join(self.directory, 'daemon.pid')
+        self.pids = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.pids:
+            kill_child(pid)
+        shutil.rmtree(self.directory)
+
+    def test_wait_ready(self):
+        """ Should return the PID once ready, keeping no pipe open. """
+        open_before = count_open_file_descriptors()
+        runner = SleepingRunner(pidfile=self.pidfile_path, force_detach=True)
+        with system_streams():
+            pid = runner.start(wait_ready=True, ready_timeout=10)
+        self.pids.append(pid)
+        self.assertEqual(count_open_file_descriptors(), open_before)
+        self.assertEqual(runner.pid, pid)
+
+    def test_no_pipe(self):
+        """ Should return ``None`` at once, without creating a pipe. """
+        open_before = count_open_file_descriptors()
+        runner = SleepingRunner(pidfile=self.pidfile_path, force_detach=True)
+        with system_streams():
+            self.assertIsNone(runner.start())
+        self.assertEqual(count_open_file_descriptors(), open_before)
+
+        deadline = time.time() + 10
+        while not runner.pid and time.time() < deadline:
+            time.sleep(0.01)
+        self.pids.append(runner.pid)
+        self.assertTrue(is_process_running(runner.pid))
+
+    def test_without_detaching(self):
+        """ Should not wait to report a large result when the daemon does not detach. """
+        def child():
+            runner = LargeResultRunner(context_kwargs={'detach_process': False})
+            with system_streams():
+                runner.start(wait_ready=True, handle=True)
+
+        started = time.time()
+        pid = fork_child(child)
+        self.pids.append(pid)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertLess(time.time() - started, 5)
+
+
+class DaemonRunner_stop_TestCase(unittest.TestCase):
+    """ Test cases for `DaemonRunner.stop`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.pidfile_path = os.path.join(self.directory, 'daemon.pid')
+        self.pids = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.pids:
+            kill_child(pid)
+        shutil.rmtree(self.directory)
+
+    def start(self, **context_kwargs):
+        """ Start a sleeping daemon; return its runner and PID. """
+        runner = SleepingRunner(pidfile=self.pidfile_path, force_detach=True, context_kwargs=context_kwargs)
+        with system_streams():
+            pid = runner.start(wait_ready=True, ready_timeout=10)
+        self.pids.append(pid)
+        return runner, pid
+
+    def test_no_daemon(self):
+        """ Should return ``None`` when there is no daemon to stop. """
+        runner = SleepingRunner(pidfile=self.pidfile_path)
+        self.assertIsNone(runner.stop(wait=True))
+
+    def test_without_waiting(self):
+        """ Should return ``None`` at once when not told to wait. """
+        runner, pid = self.start()
+        self.assertIsNone(runner.stop())
+        self.assertTrue(wait_for_process_exit(pid, 10))
+
+    def test_wait(self):
+        """ Should return the seconds the daemon took to exit, once it has. """
+        runner, pid = self.start()
+        elapsed = runner.stop(wait=True, timeout=10)
+        self.assertIsInstance(elapsed, float)
+        self.assertLess(elapsed, 10)
+        self.assertFalse(is_process_running(pid))
+        self.assertFalse(os.path.exists(self.pidfile_path))
+
+    def test_escalate(self):
+        """ Should kill a daemon still running after the timeout, and break its PID file. """
+        runner, pid = self.start(signal_map={signal.SIGTERM: None})
+        elapsed = runner.stop(wait=True, timeout=0.3)
+        self.assertGreaterEqual(elapsed, 0.3)
+        self.assertLess(elapsed, 5)
+        self.assertFalse(is_process_running(pid))
+        self.assertFalse(os.path.exists(self.pidfile_path))
+
+    def test_no_escalation(self):
+        """ Should raise `DaemonRunnerStopFailureError` for a daemon still running, if not to escalate. """
+        runner, pid = self.start(signal_map={signal.SIGTERM: None})
+        self.assertRaises(DaemonRunnerStopFailureError, runner.stop, wait=True, timeout=0.2, escalate_to=None)
+        self.assertTrue(is_process_running(pid))
+
+
+class DaemonRunner_reopen_streams_TestCase(unittest.TestCase):
+    """ Test cases for reopening the output of a daemon started by `DaemonRunner`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'daemon.log')
+        self.pids = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for pid in self.pids:
+            kill_child(pid)
+        shutil.rmtree(self.directory)
+
+    def wait_for_output(self, path):
+        deadline = time.time() + 10
+        while not (os.path.exists(path) and os.path.getsize(path)):
+            self.assertLess(time.time(), deadline, 'No output in {}'.format(path))
+            time.sleep(0.01)
+
+    def test_reopen_signal(self):
+        """ Should write to a new file once sent the reopen signal, after the log is moved aside. """
+        runner = LoggingRunner(
+            pidfile=os.path.join(self.directory, 'daemon.pid'), stdout=self.log_path, force_detach=True,
+            context_kwargs={'signal_map': {signal.SIGTERM: 'terminate', signal.SIGHUP: 'reopen_streams'}})
+        with system_streams():
+            pid = runner.start(wait_ready=True, ready_timeout=10)
+        self.pids.append(pid)
+        self.wait_for_output(self.log_path)
+
+        rotated_path = self.log_path + '.1'
+        os.rename(self.log_path, rotated_path)
+        os.kill(pid, signal.SIGHUP)
+        self.wait_for_output(self.log_path)
+
+        rotated_size = os.path.getsize(rotated_path)
+        size = os.path.getsize(self.log_path)
+        time.sleep(0.1)
+        self.assertEqual(os.path.getsize(rotated_path), rotated_size)
+        self.assertGreater(os.path.getsize(self.log_path), size)
+
+        runner.stop(wait=True, timeout=10)
+        with open(self.log_path) as log:
+            self.assertTrue(log.read().startswith('line\n'))
+
+
+class wait_for_process_exit_TestCase(unittest.TestCase):
+    """ Test cases for `wait_for_process_exit` function. """
+
+    def test_exit(self):
+        """ Should return ``True`` once the process exits, and ``False`` while it runs. """
+        pid = fork_child(lambda: time.sleep(0.3))
+        try:
+            self.assertFalse(wait_for_process_exit(pid, 0.05))
+            # The exited child is not reaped here, yet counts as exited.
+            self.assertTrue(wait_for_process_exit(pid, 10))
+        finally:
+            kill_child(pid)
+
+
+if __name__ == '__main__':
+    unittest.main()
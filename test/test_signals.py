@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# test/test_signals.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.signals`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import signal
+import threading
+import time
+import unittest
+
+from daemon.signals import SignalDispatcher, signal_name
+
+
+class SignalDispatcher_TestCase(unittest.TestCase):
+    """ Test cases for `SignalDispatcher`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.calls = []
+        self.exits = []
+        self.called = threading.Event()
+        self.dispatcher = SignalDispatcher({
+            signal.SIGUSR1: self.handle,
+            signal.SIGUSR2: self.handle,
+            signal.SIGWINCH: signal.SIG_IGN,
+        }, exit_handler=self.exits.append)
+        self.previous_handler = signal.getsignal(signal.SIGUSR1)
+        self.dispatcher.install()
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        self.dispatcher.close()
+
+    def handle(self, signal_number, stack_frame):
+        self.calls.append(signal_number)
+        self.called.set()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_not_run_in_signal_context(self):
+        """ Should only note a signal until dispatched. """
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.dispatcher.dispatch(), 1)
+        self.assertEqual(self.calls, [signal.SIGUSR1])
+
+    def test_coalesced(self):
+        """ Should run each handler once for a burst of its signal. """
+        for _ in range(3):
+            os.kill(os.getpid(), signal.SIGUSR1)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        self.assertEqual(self.dispatcher.dispatch(), 4)
+        self.assertEqual(self.calls, [signal.SIGUSR1, signal.SIGUSR2])
+        self.assertEqual(self.dispatcher.received, {signal.SIGUSR1: 3, signal.SIGUSR2: 1})
+        self.assertEqual(self.dispatcher.dispatched, {signal.SIGUSR1: 1, signal.SIGUSR2: 1})
+
+    def test_nothing_received(self):
+        """ Should run nothing when no signal has arrived. """
+        self.assertEqual(self.dispatcher.dispatch(), 0)
+        self.assertEqual(self.calls, [])
+
+    def test_as_dict(self):
+        """ Should count the signals received and dispatched by name. """
+        os.kill(os.getpid(), signal.SIGUSR1)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.dispatcher.dispatch()
+        self.assertEqual(self.dispatcher.as_dict(), {
+            'received': {'SIGUSR1': 2},
+            'dispatched': {'SIGUSR1': 1},
+        })
+
+    def test_installs_special_handlers(self):
+        """ Should install ``SIG_IGN`` and ``SIG_DFL`` directly. """
+        self.assertEqual(signal.getsignal(signal.SIGWINCH), signal.SIG_IGN)
+
+    def test_thread(self):
+        """ Should run the handlers in the dispatcher thread as signals arrive. """
+        self.dispatcher.start()
+        os.kill(os.getpid(), signal.SIGUSR2)
+        self.assertTrue(self.called.wait(5))
+        self.assertEqual(self.calls, [signal.SIGUSR2])
+
+    def test_thread_exit(self):
+        """ Should pass the exit status of `SystemExit` in a handler to the exit handler. """
+        codes = iter([3, 'fatal error', None])
+
+        def exit_handler(signal_number, stack_frame):
+            raise SystemExit(next(codes))
+
+        self.dispatcher.handlers[signal.SIGUSR1] = exit_handler
+        self.dispatcher.start()
+        for count in range(1, 4):
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.assertTrue(self.wait_for(lambda: len(self.exits) == count))
+        self.assertEqual(self.exits, [3, 1, 0])
+
+    def test_attach(self):
+        """ Should have a loop call `dispatch` when the pipe is readable. """
+        readers = {}
+
+        class Loop(object):
+            def add_reader(self, fd, callback):
+                readers[fd] = callback
+
+            def remove_reader(self, fd):
+                del readers[fd]
+
+        loop = Loop()
+        self.dispatcher.attach(loop)
+        self.assertEqual(list(readers), [self.dispatcher.fileno()])
+        os.kill(os.getpid(), signal.SIGUSR1)
+        readers[self.dispatcher.fileno()]()
+        self.assertEqual(self.calls, [signal.SIGUSR1])
+        self.dispatcher.detach(loop)
+        self.assertEqual(readers, {})
+
+    def test_close(self):
+        """ Should restore the previous handlers and wakeup descriptor. """
+        self.dispatcher.start()
+        write_fd = self.dispatcher.write_fd
+        self.dispatcher.close()
+        self.assertIsNone(self.dispatcher.fileno())
+        self.assertEqual(signal.getsignal(signal.SIGUSR1), self.previous_handler)
+        previous = signal.set_wakeup_fd(-1)
+        signal.set_wakeup_fd(previous)
+        self.assertNotEqual(previous, write_fd)
+
+
+class signal_name_TestCase(unittest.TestCase):
+    """ Test cases for `signal_name` function. """
+
+    def test_name(self):
+        """ Should return the name of a signal, or its number if unknown. """
+        self.assertEqual(signal_name(signal.SIGTERM), 'SIGTERM')
+        self.assertEqual(signal_name(1000), '1000')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+# test/test_streams.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `daemon.streams`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from daemon import streams
+from daemon.streams import BufferedStreamSink
+
+
+def read_file(path):
+    with open(path, 'rb') as infile:
+        return infile.read()
+
+
+class BufferedStreamSink_TestCase(unittest.TestCase):
+    """ Test cases for `BufferedStreamSink`. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'daemon.log')
+        self.sinks = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        for sink in self.sinks:
+            sink.close()
+        shutil.rmtree(self.directory)
+
+    def sink(self, **kwargs):
+        sink = BufferedStreamSink(self.path, **kwargs)
+        sink.open()
+        self.sinks.append(sink)
+        return sink
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_flush(self):
+        """ Should write everything received to the file on flush. """
+        sink = self.sink()
+        sink.write('first\n')
+        sink.write(b'second\n')
+        self.assertEqual(read_file(self.path), b'')
+        sink.flush()
+        self.assertEqual(read_file(self.path), b'first\nsecond\n')
+        self.assertEqual(sink.as_dict()['bytes_written'], 13)
+        self.assertEqual(sink.as_dict()['flushes'], 1)
+
+    def test_batches_until_interval(self):
+        """ Should hold writes back until the flush interval has passed. """
+        sink = self.sink(flush_interval=0.2)
+        sink.start()
+        sink.write('line\n')
+        time.sleep(0.05)
+        self.assertEqual(read_file(self.path), b'')
+        self.assertTrue(self.wait_for(lambda: read_file(self.path) == b'line\n'))
+
+    def test_batches_until_size(self):
+        """ Should write at once when a batch is full. """
+        sink = self.sink(batch_size=10, flush_interval=60)
+        sink.start()
+        sink.write('0123456789\n')
+        self.assertTrue(self.wait_for(lambda: read_file(self.path) == b'0123456789\n'))
+
+    def test_drops_oldest_lines_when_full(self):
+        """ Should drop the oldest whole lines beyond the capacity. """
+        sink = self.sink(capacity=10)
+        sink.write('aaaa\nbbbb\ncccc\n')
+        sink.flush()
+        self.assertEqual(read_file(self.path), b'bbbb\ncccc\n')
+        self.assertEqual(sink.bytes_dropped, 5)
+        self.assertEqual(sink.lines_dropped, 1)
+
+    def test_close_redirects(self):
+        """ Should point the given descriptors at the file on close. """
+        sink = BufferedStreamSink(self.path)
+        sink.open()
+        fd = os.dup(sink.fileno())
+        try:
+            os.write(fd, b'before\n')
+            sink.close(redirect_fds=[fd])
+            os.write(fd, b'after\n')
+        finally:
+            os.close(fd)
+        self.assertEqual(read_file(self.path), b'before\nafter\n')
+        self.assertFalse(sink.is_open)
+
+    def test_close_stops_flusher(self):
+        """ Should stop the flusher thread before closing its descriptors. """
+        for flush_interval in [60, 0]:
+            sink = BufferedStreamSink(self.path, flush_interval=flush_interval)
+            sink.start()
+            thread = sink._thread
+            sink.write('line\n')
+            sink.close()
+            self.assertFalse(thread.is_alive())
+            self.assertIsNone(sink._thread)
+
+    def test_close_repeatedly_while_flushing(self):
+        """ Should leave the flusher thread no closed descriptor to fail on. """
+        errors = []
+        saved_excepthook = getattr(threading, 'excepthook', None)
+        threading.excepthook = errors.append
+        try:
+            for _ in range(200):
+                sink = BufferedStreamSink(self.path, flush_interval=0)
+                sink.start()
+                sink.write('line\n')
+                sink.close()
+        finally:
+            threading.excepthook = saved_excepthook
+        self.assertEqual(errors, [])
+        self.assertEqual(read_file(self.path), b'line\n' * 200)
+
+    def test_reopen(self):
+        """ Should write to a new file at the path once the old one is moved aside. """
+        sink = self.sink()
+        sink.write('old\n')
+        sink.flush()
+        os.rename(self.path, self.path + '.old')
+        sink.reopen()
+        sink.write('new\n')
+        sink.flush()
+        self.assertEqual(read_file(self.path + '.old'), b'old\n')
+        self.assertEqual(read_file(self.path), b'new\n')
+        self.assertEqual(sink.reopens, 1)
+
+    def test_reopen_while_busy(self):
+        """ Should reopen before the next write when the sink is busy. """
+        sink = self.sink()
+        os.rename(self.path, self.path + '.old')
+        with sink._lock:
+            sink.reopen()
+        self.assertEqual(sink.reopens, 0)
+        sink.write('new\n')
+        sink.flush()
+        self.assertEqual(read_file(self.path), b'new\n')
+        self.assertEqual(sink.reopens, 1)
+
+    def test_rotate(self):
+        """ Should rotate the file by size, keeping `rotate_count` old files. """
+        sink = self.sink(rotate_size=10, rotate_count=2, compress=False)
+        for index in range(4):
+            sink.write('line {:d} of the log\n'.format(index))
+            sink.flush()
+        sink.close()
+
+        self.assertEqual(sink.rotations, 4)
+        self.assertEqual(read_file(self.path), b'')
+        self.assertEqual(read_file(self.path + '.1'), b'line 3 of the log\n')
+        self.assertEqual(read_file(self.path + '.2'), b'line 2 of the log\n')
+        self.assertEqual(sorted(os.listdir(self.directory)), ['daemon.log', 'daemon.log.1', 'daemon.log.2'])
+
+    def test_rotate_between_lines(self):
+        """ Should not rotate in the middle of a line. """
+        sink = self.sink(rotate_size=4, compress=False)
+        sink.write('partial')
+        sink.flush()
+        self.assertEqual(sink.rotations, 0)
+        sink.write(' line\n')
+        sink.flush()
+        self.assertEqual(sink.rotations, 1)
+
+    def test_rotate_compressed(self):
+        """ Should compress the old files. """
+        sink = self.sink(rotate_size=10)
+        sink.write('a line of the log\n')
+        sink.flush()
+        sink.close()
+
+        with gzip.open(self.path + '.1.gz', 'rb') as infile:
+            self.assertEqual(infile.read(), b'a line of the log\n')
+        self.assertFalse(os.path.exists(self.path + '.1'))
+
+    def test_rotate_does_not_wait_for_compression(self):
+        """ Should keep writing while an old file is being compressed. """
+        released = threading.Event()
+        compress_file = streams.compress_file
+
+        def slow_compress_file(path):
+            released.wait(10)
+            compress_file(path)
+
+        streams.compress_file = slow_compress_file
+        try:
+            sink = self.sink(rotate_size=10, rotate_count=3)
+            started = time.time()
+            for index in range(3):
+                sink.write('line {:d} of the log\n'.format(index))
+                sink.flush()
+            self.assertLess(time.time() - started, 5)
+            self.assertEqual(read_file(self.path), b'')
+            self.assertEqual(sink.rotations, 3)
+
+            released.set()
+            sink.close()
+        finally:
+            streams.compress_file = compress_file
+
+        for index, name in [(2, 'daemon.log.1.gz'), (1, 'daemon.log.2.gz'), (0, 'daemon.log.3.gz')]:
+            with gzip.open(os.path.join(self.directory, name), 'rb') as infile:
+                self.assertEqual(infile.read(), 'line {:d} of the log\n'.format(index).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
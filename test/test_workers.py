@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# test/test_workers.py
+# Part of python-daemon, an implementation of PEP 3143.
+#
+# Copyright 2014-2016 Alex Honeywell
+#
+# This is free software: you may copy, modify, and/or distribute this work
+# under the terms of the Python Software Foundation License, version 2 or
+# later as published by the Python Software Foundation.
+# No warranty expressed or implied. See the file LICENSE.PSF-2 for details.
+""" Unit tests for `WorkerPool`. """
+
+from __future__ import unicode_literals, print_function, absolute_import
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from six.moves import StringIO
+
+from daemon.workers import WorkerPool
+
+
+class WorkerPool_TestCase(unittest.TestCase):
+    """ Test cases for `WorkerPool` class. """
+
+    def setUp(self):
+        """ Set up test fixtures. """
+        self.directory = tempfile.mkdtemp()
+        self.messages = []
+
+    def tearDown(self):
+        """ Tear down test fixtures. """
+        shutil.rmtree(self.directory)
+
+    def make_pool(self, target, count, **kwargs):
+        kwargs.setdefault('restart_delay', 0.01)
+        kwargs.setdefault('report', self.messages.append)
+        return WorkerPool(target, count, **kwargs)
+
+    def fail_once(self, index):
+        """ Fail the first time in each slot; succeed after that. """
+        marker = os.path.join(self.directory, 'started-{:d}'.format(index))
+        if os.path.exists(marker):
+            return 0
+        open(marker, 'w').close()
+        return 3
+
+    def test_all_workers_succeed(self):
+        """ Should return 0 once every worker has exited with status 0. """
+        pool = self.make_pool(lambda index: 0, 3)
+        self.assertEqual(pool.run(), 0)
+        self.assertEqual(pool.restarts, 0)
+        self.assertEqual(pool.exit_codes, {0: 3})
+        self.assertEqual(pool.workers, {})
+
+    def test_failed_worker_restarted_in_its_slot(self):
+        """ Should restart a failed worker in the same slot. """
+        pool = self.make_pool(self.fail_once, 2)
+        self.assertEqual(pool.run(), 0)
+        self.assertEqual(pool.restarts, 2)
+        self.assertEqual(pool.exit_codes, {3: 2, 0: 2})
+        self.assertEqual(sorted(os.listdir(self.directory)), ['started-0', 'started-1'])
+        self.assertEqual(len(self.messages), 2)
+        self.assertIn('exited with status 3; restarting', self.messages[0])
+
+    def test_exception_in_worker_exits_with_status_1(self):
+        """ Should exit a worker which raises with status 1, and restart it. """
+        def target(index):
+            if self.fail_once(index):
+                raise RuntimeError('worker failed')
+            return 0
+
+        pool = self.make_pool(target, 1)
+        self.assertEqual(pool.run(), 0)
+        self.assertEqual(pool.exit_codes, {1: 1, 0: 1})
+
+    def test_crash_loop_gives_up(self):
+        """ Should stop restarting workers which keep failing, and return 1. """
+        pool = self.make_pool(lambda index: 3, 2, crash_loop_restarts=3)
+        self.assertEqual(pool.run(), 1)
+        self.assertTrue(pool.crash_loop)
+        self.assertEqual(pool.workers, {})
+        self.assertGreaterEqual(pool.restarts, 3)
+        self.assertIn('giving up', self.messages[-1])
+        self.assertEqual(pool.as_dict()['last_message'], self.messages[-1])
+
+    def test_crash_loop_forgets_old_restarts(self):
+        """ Should count only the restarts within the crash loop interval. """
+        pool = self.make_pool(self.fail_once, 2, crash_loop_restarts=1, crash_loop_interval=0)
+        self.assertEqual(pool.run(), 0)
+        self.assertFalse(pool.crash_loop)
+
+    def test_restart_delay_backs_off(self):
+        """ Should double the delay for each failure of a slot. """
+        pool = self.make_pool(lambda index: 3, 1, restart_delay=0.01, restart_jitter=0,
+                              crash_loop_restarts=3)
+        pool.run()
+        delays = [message.rsplit(' in ', 1)[1] for message in self.messages if 'restarting' in message]
+        self.assertEqual(delays, ['0.010 seconds', '0.020 seconds', '0.040 seconds'])
+
+    def test_report_defaults_to_stderr(self):
+        """ Should write the messages to standard error by default. """
+        pool = WorkerPool(lambda index: 3, 1, restart_delay=0.01, crash_loop_restarts=0)
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.assertEqual(pool.run(), 1)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(output, pool.last_message + '\n')
+        self.assertIn('giving up', output)
+
+    def test_reload_from_another_thread(self):
+        """ Should forward ``SIGHUP`` to the workers and handle it in the master, from another thread. """
+        def path(name, index):
+            return os.path.join(self.directory, '{}-{:d}'.format(name, index))
+
+        def target(index):
+            signal.signal(signal.SIGHUP, lambda signal_number, stack_frame: open(path('hup', index), 'w').close())
+            open(path('ready', index), 'w').close()
+            while not os.path.exists(path('hup', index)):
+                time.sleep(0.01)
+            return 0
+
+        reloads = []
+        results = []
+        pool = self.make_pool(target, 2, signal_handlers={
+            signal.SIGHUP: lambda signal_number, stack_frame: reloads.append(threading.current_thread())})
+
+        def reload_when_ready():
+            while not all(os.path.exists(path('ready', index)) for index in range(2)):
+                time.sleep(0.01)
+            results.append(pool.reload(timeout=10))
+
+        thread = threading.Thread(target=reload_when_ready)
+        thread.start()
+        self.assertEqual(pool.run(), 0)
+        thread.join()
+        self.assertEqual(results, [True])
+        self.assertEqual(reloads, [threading.current_thread()])
+        self.assertEqual(pool.exit_codes, {0: 2})
+
+    def test_reload_when_not_running(self):
+        """ Should raise `ValueError` if the pool is not running. """
+        pool = self.make_pool(lambda index: 0, 1, signal_handlers={signal.SIGHUP: lambda *args: None})
+        with self.assertRaises(ValueError):
+            pool.reload()
+
+    def test_as_dict(self):
+        """ Should report the restarts and exit codes. """
+        pool = self.make_pool(self.fail_once, 1)
+        pool.run()
+        self.assertEqual(pool.as_dict(), {
+            'workers': {},
+            'restarts': 1,
+            'exit_codes': {3: 1, 0: 1},
+            'crash_loop': False,
+            'last_message': self.messages[-1],
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()